@@ -0,0 +1,73 @@
+import argparse
+import sys
+from PIL import Image, ImageColor
+from backends import add_backend_arguments, apply_backend_args, current
+from build_cache import add_cache_arguments, run_cached
+from export import add_export_arguments, save_output
+from timing import add_trace_arguments, apply_trace_args, span
+from watch import add_watch_arguments, watch_cli
+
+def alpha_extract_image(img, key_color_hex, bg_brightness, edge_softness, cancel=None):
+    """
+    Extract alpha from green/blue screen by analyzing how much the key channel is darkened.
+    Semi-transparent elements (shadows, smoke) darken the green proportionally to their opacity.
+    Same algorithm as the keying tool's Alpha Extract tab; returns a new RGBA image
+    (None if cancelled).
+    """
+    with span('alpha_extract'):
+        data = current().alpha_extract(img.tobytes(), ImageColor.getrgb(key_color_hex),
+                                       bg_brightness, edge_softness, cancel=cancel)
+        if data is None:
+            return None
+        return Image.frombytes("RGBA", img.size, data)
+
+def alpha_extract_stage(img, args):
+    """Runs alpha extraction on an in-memory RGBA image using parsed CLI options."""
+    width, height = img.size
+    print(f"Extracting alpha from {width}x{height} pixels with the {current().name} backend...")
+    return alpha_extract_image(img, args.color, args.bg_brightness, args.edge_softness)
+
+def add_alpha_extract_arguments(parser):
+    """Adds the alpha extraction options (everything except input/output) to a parser."""
+    parser.add_argument("-c", "--color", default="#00FF00",
+                        help="Screen color in Hex; decides green vs blue screen. Default Green.")
+    parser.add_argument("--bg-brightness", type=int, default=255,
+                        help="Key channel value (1-255) of a clean screen area")
+    parser.add_argument("--edge-softness", type=float, default=50.0,
+                        help="Edge softness (0 = hard, 100 = soft)")
+
+def process_alpha_extract(args):
+    print(f"Opening {args.input}...")
+    try:
+        with span('decode'):
+            img = Image.open(args.input).convert("RGBA")
+    except Exception as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    img = alpha_extract_stage(img, args)
+
+    save_output(img, args.output, args)
+    print("Done.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Alpha Extract (semi-transparent shadows/smoke)")
+
+    parser.add_argument("input", help="Input image path")
+    parser.add_argument("output", help="Output image path")
+
+    add_alpha_extract_arguments(parser)
+    add_backend_arguments(parser)
+    add_cache_arguments(parser)
+    add_watch_arguments(parser)
+    add_export_arguments(parser)
+    add_trace_arguments(parser)
+
+    args = parser.parse_args()
+    apply_backend_args(args)
+    apply_trace_args(args)
+    run = lambda: run_cached('alpha_extract', args, lambda: process_alpha_extract(args))
+    if args.watch:
+        watch_cli(args, run)
+    else:
+        run()
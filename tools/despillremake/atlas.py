@@ -0,0 +1,452 @@
+import argparse
+import json
+import os
+import sys
+from PIL import Image
+
+from build_cache import file_hash, params_hash
+from export import COMPRESSION_PROFILES, DEFAULT_COMPRESSION, format_size, save_image
+from game_export import trim
+from timing import add_trace_arguments, apply_trace_args, span
+
+# ==========================================
+# TEXTURE ATLAS PACKER
+# ==========================================
+# Usage:
+#   python atlas.py keyed/buttons -o ui/atlas/menu --trim
+#   python atlas.py button_*.png discord_button_*.png -o ui/atlas/menu --max-size 2048
+#
+# Packs keyed images into one or a few atlases with a skyline bottom-left
+# packer (images sorted by height, so a button's normal and hover states of
+# the same size end up side by side) and writes:
+#   OUT.json          atlases and regions (x, y, size, trim margin, source hash)
+#   OUT_0.png, ...    the atlas pages
+#   TRES_DIR/NAME.tres a Godot AtlasTexture per region; with --trim its
+#                     margin restores the untrimmed size, so a TextureButton
+#                     keeps its layout when pointed at it
+#
+# Incremental: OUT.json doubles as the manifest. On the next run unchanged
+# sources are left where they are; a changed source that still fits its old
+# rectangle is repainted in place, anything else (new or grown) is placed on
+# top of the existing pages' skyline, and removed regions are cleared (their
+# .tres files are deleted). Only pages that changed are re-encoded and only
+# .tres files whose text changed are rewritten, so Godot reimports as little
+# as possible. Holes are not
+# reclaimed: --repack (or changed packing options) lays everything out anew.
+
+ATLAS_VERSION = 1
+IMAGE_EXTENSIONS = ('.png', '.webp', '.tga', '.bmp')
+
+# --- Skyline packer ---
+
+class Skyline:
+    """
+    Skyline bottom-left rectangle packer for one width x height page. The
+    skyline is a list of (x, y, width) segments covering the page width.
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.nodes = [(0, 0, width)]
+
+    @classmethod
+    def from_rects(cls, width, height, rects):
+        """Skyline lying on top of already placed (x, y, w, h) rectangles."""
+        sky = cls(width, height)
+        heights = [0] * width
+        for x, y, w, h in rects:
+            for column in range(x, min(x + w, width)):
+                heights[column] = max(heights[column], y + h)
+        sky.nodes = []
+        for x, y in enumerate(heights):
+            if sky.nodes and sky.nodes[-1][1] == y:
+                nx, ny, nw = sky.nodes[-1]
+                sky.nodes[-1] = (nx, ny, nw + 1)
+            else:
+                sky.nodes.append((x, y, 1))
+        return sky
+
+    def _fit(self, index, w):
+        """Lowest y a w-wide rectangle can sit at starting at segment `index` (None if it overflows)."""
+        x = self.nodes[index][0]
+        if x + w > self.width:
+            return None
+        y = 0
+        remaining = w
+        i = index
+        while remaining > 0:
+            _, node_y, node_w = self.nodes[i]
+            y = max(y, node_y)
+            remaining -= node_w
+            i += 1
+        return y
+
+    def insert(self, w, h):
+        """Places a w x h rectangle as low (then as far left) as possible. Returns (x, y) or None."""
+        best = None
+        for index, (x, _, _) in enumerate(self.nodes):
+            y = self._fit(index, w)
+            if y is None or y + h > self.height:
+                continue
+            if best is None or (y + h, x) < (best[0] + h, best[1]):
+                best = (y, x, index)
+        if best is None:
+            return None
+        y, x, index = best
+        self._raise(index, x, y + h, w)
+        return x, y
+
+    def _raise(self, index, x, top, w):
+        self.nodes.insert(index, (x, top, w))
+        # Shrink or drop the segments now covered by the new one
+        i = index + 1
+        while i < len(self.nodes):
+            node_x, node_y, node_w = self.nodes[i]
+            overlap = x + w - node_x
+            if overlap <= 0:
+                break
+            if node_w > overlap:
+                self.nodes[i] = (node_x + overlap, node_y, node_w - overlap)
+                break
+            del self.nodes[i]
+        # Merge neighbours at the same height
+        i = 0
+        while i < len(self.nodes) - 1:
+            if self.nodes[i][1] == self.nodes[i + 1][1]:
+                node_x, node_y, node_w = self.nodes[i]
+                self.nodes[i] = (node_x, node_y, node_w + self.nodes[i + 1][2])
+                del self.nodes[i + 1]
+            else:
+                i += 1
+
+def pack(sizes, max_size, padding=0, pages=None):
+    """
+    Packs {name: (w, h)} into max_size pages. `pages` (a list of Skylines)
+    continues existing pages; new ones are added as needed.
+    Returns ({name: (page, x, y)}, pages). Raises ValueError if an image is
+    larger than a page.
+    """
+    pages = list(pages or [])
+    placed = {}
+    # Tallest first; equal sizes (state pairs) stay next to each other
+    for name in sorted(sizes, key=lambda n: (-sizes[n][1], -sizes[n][0], n)):
+        w, h = sizes[name]
+        w, h = w + 2 * padding, h + 2 * padding
+        if w > max_size or h > max_size:
+            raise ValueError(f"{name} ({sizes[name][0]}x{sizes[name][1]}) does not fit a "
+                             f"{max_size}x{max_size} atlas; raise --max-size or export a smaller variant")
+        for page, sky in enumerate(pages):
+            pos = sky.insert(w, h)
+            if pos:
+                break
+        else:
+            pages.append(Skyline(max_size, max_size))
+            page = len(pages) - 1
+            pos = pages[page].insert(w, h)
+        placed[name] = (page, pos[0] + padding, pos[1] + padding)
+    return placed, pages
+
+# --- Sources ---
+
+def find_sources(inputs):
+    """{region name: path} for image files and the images directly inside directories."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(os.path.join(item, name) for name in sorted(os.listdir(item))
+                         if name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            paths.append(item)
+    sources = {}
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name in sources:
+            raise ValueError(f"Two sources are named '{name}': {sources[name]} and {path}")
+        sources[name] = path
+    return sources
+
+def load_source(path, trimmed, trim_pad):
+    """(image, (left, top, right, bottom) margin around it in the source, source size)."""
+    with span('decode', path=path):
+        img = Image.open(path).convert('RGBA')
+    if not trimmed:
+        return img, (0, 0, 0, 0), img.size
+    cropped, bbox = trim(img, pad=trim_pad)
+    return cropped, (bbox[0], bbox[1], img.width - bbox[2], img.height - bbox[3]), img.size
+
+# --- Godot output ---
+
+def res_path(path, project_root=None):
+    """res:// path of a file, relative to the Godot project (the nearest project.godot above it)."""
+    path = os.path.abspath(path)
+    root = project_root
+    if root is None:
+        directory = os.path.dirname(path)
+        while True:
+            if os.path.isfile(os.path.join(directory, 'project.godot')):
+                root = directory
+                break
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                root = os.path.dirname(path)
+                break
+            directory = parent
+    return 'res://' + os.path.relpath(path, os.path.abspath(root)).replace(os.sep, '/')
+
+def tres_text(page_res, region):
+    margin = region['margin']
+    lines = [
+        '[gd_resource type="AtlasTexture" load_steps=2 format=3]',
+        '',
+        f'[ext_resource type="Texture2D" path="{page_res}" id="1_atlas"]',
+        '',
+        '[resource]',
+        'atlas = ExtResource("1_atlas")',
+        f"region = Rect2({region['x']}, {region['y']}, {region['width']}, {region['height']})",
+    ]
+    if any(margin):
+        # position = offset of the region inside the original, size = pixels added back
+        lines.append(f"margin = Rect2({margin[0]}, {margin[1]}, {margin[0] + margin[2]}, {margin[1] + margin[3]})")
+    lines.append('filter_clip = true')
+    return "\n".join(lines) + "\n"
+
+def write_if_changed(path, text):
+    """Writes `text` unless the file already holds it. Returns True if written."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            if f.read() == text:
+                return False
+    except OSError:
+        pass
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return True
+
+# --- Building ---
+
+class AtlasBuilder:
+    """Builds or incrementally updates the atlas OUT.json / OUT_N.png / .tres set."""
+
+    def __init__(self, output, max_size=2048, padding=2, trimmed=False, trim_pad=1,
+                 compression=DEFAULT_COMPRESSION, tres_dir=None, project_root=None):
+        self.output = output
+        self.max_size = max_size
+        self.padding = padding
+        self.trimmed = trimmed
+        self.trim_pad = trim_pad
+        self.compression = compression
+        self.tres_dir = tres_dir
+        self.project_root = project_root
+        self.options_hash = params_hash({'version': ATLAS_VERSION, 'max_size': max_size, 'padding': padding,
+                                         'trim': trimmed, 'trim_pad': trim_pad})
+
+    def page_path(self, page):
+        return f"{self.output}_{page}.png"
+
+    def read_manifest(self):
+        try:
+            with open(self.output + '.json', 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load_previous(self):
+        """The previous OUT.json if it was built with the same options and its pages exist, else None."""
+        meta = self.read_manifest()
+        if meta is None or meta.get('options') != self.options_hash:
+            return None
+        if not all(os.path.isfile(self.page_path(i)) for i in range(len(meta['pages']))):
+            return None
+        return meta
+
+    def build(self, sources, repack=False):
+        """Packs {name: path}. Returns a stats dict."""
+        previous = None if repack else self.load_previous()
+        hashes = {name: file_hash(path) for name, path in sources.items()}
+        if previous is None:
+            return self.full_build(sources, hashes)
+        return self.update(previous, sources, hashes)
+
+    def full_build(self, sources, hashes):
+        loaded = {name: load_source(path, self.trimmed, self.trim_pad) for name, path in sources.items()}
+        with span('pack', images=len(loaded)):
+            placed, skylines = pack({name: item[0].size for name, item in loaded.items()},
+                                     self.max_size, self.padding)
+        regions = {}
+        for name, (page, x, y) in placed.items():
+            img, margin, source_size = loaded[name]
+            regions[name] = self.region(sources[name], hashes[name], page, x, y, img, margin, source_size)
+        pages = [Image.new('RGBA', self.page_size(regions, i)) for i in range(len(skylines))]
+        for name, region in regions.items():
+            pages[region['page']].paste(loaded[name][0], (region['x'], region['y']))
+        self.write(pages, regions, set(range(len(pages))))
+        return {'mode': 'full', 'placed': len(regions), 'repainted': 0, 'removed': 0,
+                'pages': len(pages), 'written': len(pages)}
+
+    def update(self, previous, sources, hashes):
+        old = previous['regions']
+        regions = {name: dict(region) for name, region in old.items() if name in sources}
+        pages = [Image.open(self.page_path(i)).convert('RGBA') for i in range(len(previous['pages']))]
+        dirty = set()
+
+        # Removed sources: clear their rectangles
+        removed = [name for name in old if name not in sources]
+        for name in removed:
+            region = old[name]
+            self.clear(pages[region['page']], region)
+            dirty.add(region['page'])
+
+        # Changed sources that still fit are repainted in place; the rest are placed anew
+        repainted = 0
+        to_place = {}
+        for name, path in sources.items():
+            if name in regions and regions[name]['sha256'] == hashes[name]:
+                continue
+            img, margin, source_size = load_source(path, self.trimmed, self.trim_pad)
+            region = regions.get(name)
+            if region and img.width <= region['width'] and img.height <= region['height']:
+                self.clear(pages[region['page']], region)
+                pages[region['page']].paste(img, (region['x'], region['y']))
+                regions[name] = self.region(path, hashes[name], region['page'], region['x'], region['y'],
+                                            img, margin, source_size)
+                dirty.add(region['page'])
+                repainted += 1
+            else:
+                if region:
+                    self.clear(pages[region['page']], region)
+                    dirty.add(region['page'])
+                    del regions[name]
+                to_place[name] = (img, margin, source_size)
+
+        if to_place:
+            # Continue on top of everything already on each page
+            skylines = [Skyline.from_rects(self.max_size, self.max_size, [
+                (r['x'] - self.padding, r['y'] - self.padding,
+                 r['width'] + 2 * self.padding, r['height'] + 2 * self.padding)
+                for r in regions.values() if r['page'] == i]) for i in range(len(pages))]
+            with span('pack', images=len(to_place)):
+                placed, skylines = pack({name: item[0].size for name, item in to_place.items()},
+                                        self.max_size, self.padding, skylines)
+            for name, (page, x, y) in placed.items():
+                img, margin, source_size = to_place[name]
+                regions[name] = self.region(sources[name], hashes[name], page, x, y, img, margin, source_size)
+                dirty.add(page)
+            for i in range(len(pages), len(skylines)):
+                pages.append(Image.new('RGBA', (1, 1)))
+            for page in sorted(dirty):
+                size = self.page_size(regions, page)
+                if pages[page].size != size:
+                    grown = Image.new('RGBA', size)
+                    grown.paste(pages[page].crop((0, 0) + tuple(min(a, b) for a, b in zip(pages[page].size, size))))
+                    pages[page] = grown
+            for name in placed:
+                region = regions[name]
+                pages[region['page']].paste(to_place[name][0], (region['x'], region['y']))
+
+        self.write(pages, regions, dirty)
+        return {'mode': 'incremental', 'placed': len(to_place), 'repainted': repainted,
+                'removed': len(removed), 'pages': len(pages), 'written': len(dirty)}
+
+    def region(self, path, sha, page, x, y, img, margin, source_size):
+        return {'page': page, 'x': x, 'y': y, 'width': img.width, 'height': img.height,
+                'margin': list(margin), 'source': path, 'source_size': list(source_size), 'sha256': sha}
+
+    def page_size(self, regions, page):
+        """Smallest page covering its regions (plus padding)."""
+        width = height = 1
+        for region in regions.values():
+            if region['page'] == page:
+                width = max(width, region['x'] + region['width'] + self.padding)
+                height = max(height, region['y'] + region['height'] + self.padding)
+        return min(width, self.max_size), min(height, self.max_size)
+
+    def clear(self, page_img, region):
+        page_img.paste((0, 0, 0, 0), (region['x'], region['y'],
+                                      region['x'] + region['width'], region['y'] + region['height']))
+
+    def remove_stale_tres(self, regions, tres_dir):
+        """
+        Deletes the .tres files of regions in the previous OUT.json that are
+        gone now (after a --repack too), if they are still where it put them.
+        """
+        previous = self.read_manifest() or {}
+        removed = 0
+        for name, region in previous.get('regions', {}).items():
+            path = os.path.join(tres_dir, name + '.tres')
+            if name in regions or region.get('tres') != res_path(path, self.project_root):
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        if removed:
+            print(f"  {removed} stale AtlasTexture resource(s) removed from {tres_dir}")
+
+    def write(self, pages, regions, dirty):
+        os.makedirs(os.path.dirname(os.path.abspath(self.output)), exist_ok=True)
+        for page in sorted(dirty):
+            seconds, num_bytes = save_image(pages[page], self.page_path(page), self.compression)
+            print(f"  {self.page_path(page)}: {pages[page].width}x{pages[page].height}, "
+                  f"{format_size(num_bytes)}, encoded in {seconds:.2f}s")
+
+        tres_dir = self.tres_dir or os.path.dirname(os.path.abspath(self.output))
+        os.makedirs(tres_dir, exist_ok=True)
+        page_res = [res_path(self.page_path(i), self.project_root) for i in range(len(pages))]
+        tres_written = 0
+        for name, region in sorted(regions.items()):
+            region['tres'] = res_path(os.path.join(tres_dir, name + '.tres'), self.project_root)
+            if write_if_changed(os.path.join(tres_dir, name + '.tres'), tres_text(page_res[region['page']], region)):
+                tres_written += 1
+        if tres_written:
+            print(f"  {tres_written} AtlasTexture resource(s) written to {tres_dir}")
+        self.remove_stale_tres(regions, tres_dir)
+
+        used = sum(r['width'] * r['height'] for r in regions.values())
+        total = sum(p.width * p.height for p in pages)
+        meta = {
+            'version': ATLAS_VERSION,
+            'options': self.options_hash,
+            'padding': self.padding,
+            'pages': [{'file': os.path.basename(self.page_path(i)), 'res': page_res[i],
+                       'width': p.width, 'height': p.height} for i, p in enumerate(pages)],
+            'regions': dict(sorted(regions.items())),
+            'occupancy': round(used / total, 4) if total else 0,
+        }
+        write_if_changed(self.output + '.json', json.dumps(meta, indent=2) + "\n")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack keyed images into texture atlases with Godot AtlasTextures")
+    parser.add_argument("inputs", nargs="+", help="Images or directories of images (region name = file name)")
+    parser.add_argument("-o", "--output", required=True,
+                        help="Output base path: writes OUTPUT.json and OUTPUT_0.png, OUTPUT_1.png, ...")
+    parser.add_argument("--max-size", type=int, default=2048, help="Maximum atlas page width/height (default 2048)")
+    parser.add_argument("--padding", type=int, default=2,
+                        help="Transparent pixels around each region, against filtering bleed (default 2)")
+    parser.add_argument("--trim", action="store_true",
+                        help="Trim transparent borders first; the .tres margin restores the original size")
+    parser.add_argument("--trim-pad", type=int, default=1,
+                        help="Transparent pixels kept around trimmed content (default 1)")
+    parser.add_argument("--tres-dir", help="Directory for the .tres files (default: next to the atlas)")
+    parser.add_argument("--project-root", help="Godot project directory for res:// paths (default: nearest project.godot)")
+    parser.add_argument("--compression", choices=list(COMPRESSION_PROFILES), default=DEFAULT_COMPRESSION,
+                        help="Encode speed vs size of the atlas pages (default: balanced)")
+    parser.add_argument("--repack", action="store_true", help="Lay out every region anew instead of updating")
+    add_trace_arguments(parser)
+
+    args = parser.parse_args()
+    apply_trace_args(args)
+
+    try:
+        sources = find_sources(args.inputs)
+        if not sources:
+            parser.error("No images found")
+        builder = AtlasBuilder(args.output, args.max_size, args.padding, args.trim, args.trim_pad,
+                               args.compression, args.tres_dir, args.project_root)
+        print(f"Packing {len(sources)} image(s)...")
+        stats = builder.build(sources, args.repack)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print(f"{stats['mode'].capitalize()} pack: {stats['placed']} placed, {stats['repainted']} repainted in place, "
+          f"{stats['removed']} removed; {stats['written']} of {stats['pages']} page(s) written")
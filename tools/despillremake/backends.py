@@ -0,0 +1,465 @@
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+import keying_core
+from keying_core import (IDENTITY_LEVELS, LINEAR_LUT, alpha_extract_color, cancelled, clamp_uint8,
+                         despill_color, func_lab, is_key_set, key_distance, key_mask_value, levels_value,
+                         mask_cache, multiply_alpha, nearest_distance, pack, pixels32, tolerance_mask,
+                         tolerance_value, unpack)
+
+# ==========================================
+# KEYING BACKENDS (registry, auto-selection, verify)
+# ==========================================
+# Usage:
+#   python backends.py list
+#   python backends.py verify [--seed 1] [--images 4] [--size 96]
+#   python chroma_key.py in.png out.png --backend numpy
+#
+# A backend implements the per-pixel operations of keying_core on raw RGBA
+# buffers; everything around them (tiling, mattes, refinement, encoding) is
+# shared:
+#   despill(data, key_color, method, preserve_luma, cancel=None)
+#   alpha_extract(data, key_rgb, bg_brightness, edge_softness, cancel=None)
+#   key_mask(data, lab, lower, upper, skip=None, cache=None, cancel=None, levels=IDENTITY_LEVELS)
+# Operations a backend does not provide fall back to the 'buffer' backend.
+# Backend.despill and Backend.key_mask also take `out=` to fill a caller's
+# buffer: in place for 'buffer', with one copy for the others.
+#
+# The default is 'buffer', which starts instantly. 'auto' (opt-in) times
+# every available candidate on a small synthetic plate and picks the
+# fastest, which costs most of a second per process start, so it pays off
+# only for long runs. The choice is exported in KEYING_BACKEND so worker
+# processes (batch, sequence, service) use it without calibrating again.
+
+BACKEND_ENV = "KEYING_BACKEND"
+DEFAULT_BACKEND = 'buffer'
+OPS = ('despill', 'alpha_extract', 'key_mask')
+
+class Backend:
+    """
+    A named set of keying operations. `load()` returns {op: function} and
+    may raise ImportError when an optional dependency is missing.
+    Capabilities:
+      exact - output is bit-identical to the reference
+      bulk  - prefers whole frames over 64px tiles (per-call overhead)
+      auto  - candidate for --backend auto
+    """
+    def __init__(self, name, description, load, exact=False, bulk=False, auto=True):
+        self.name = name
+        self.description = description
+        self._load = load
+        self.exact = exact
+        self.bulk = bulk
+        self.auto = auto
+        self._ops = None
+        self.error = None
+
+    def ops(self):
+        if self._ops is None:
+            loaded = self._load()
+            self._ops = dict(BUFFER_OPS, **loaded) if self.name != 'buffer' else loaded
+        return self._ops
+
+    @property
+    def available(self):
+        try:
+            self.ops()
+            return True
+        except ImportError as e:
+            self.error = str(e)
+            return False
+
+    def provides(self):
+        """Operations this backend implements itself (not via the 'buffer' fallback)."""
+        return tuple(op for op in OPS if self.name == 'buffer' or self.ops()[op] is not BUFFER_OPS[op])
+
+    def _run(self, op, out, *args, **kwargs):
+        """
+        Runs `op`, writing into `out` when given. The buffer ops fill it
+        directly (it may be the input itself); other backends return a new
+        buffer, which is copied into `out`.
+        """
+        func = self.ops()[op]
+        if out is None:
+            return func(*args, **kwargs)
+        if func is BUFFER_OPS[op]:
+            return func(*args, out=out, **kwargs)
+        result = func(*args, **kwargs)
+        if result is None:
+            return None
+        memoryview(out).cast('B')[:] = result
+        return out
+
+    def despill(self, data, key_color='green', method='average', preserve_luma=False, cancel=None, out=None):
+        return self._run('despill', out, data, key_color, method, preserve_luma, cancel=cancel)
+
+    def alpha_extract(self, data, key_rgb, bg_brightness=255, edge_softness=50.0, cancel=None):
+        return self.ops()['alpha_extract'](data, key_rgb, bg_brightness, edge_softness, cancel=cancel)
+
+    def key_mask(self, data, lab, lower, upper, skip=None, cache=None, cancel=None, levels=IDENTITY_LEVELS,
+                 out=None):
+        return self._run('key_mask', out, data, lab, lower, upper, skip=skip, cache=cache, cancel=cancel,
+                         levels=levels)
+
+BACKENDS = {}
+
+def register(backend):
+    BACKENDS[backend.name] = backend
+    return backend
+
+# --- Reference: one pixel at a time, no caches ---
+
+def reference_despill(data, key_color='green', method='average', preserve_luma=False, cancel=None):
+    pixels = pixels32(data)
+    out = bytearray(len(pixels) * 4)
+    out_pixels = pixels32(out)
+    for i, px in enumerate(pixels):
+        if cancelled(cancel, i):
+            return None
+        r, g, b, a = unpack(px)
+        r, g, b = despill_color(r / 255.0, g / 255.0, b / 255.0, key_color, method, preserve_luma)
+        out_pixels[i] = pack(clamp_uint8(r * 255), clamp_uint8(g * 255), clamp_uint8(b * 255), a)
+    return out
+
+def reference_alpha_extract(data, key_rgb, bg_brightness=255, edge_softness=50.0, cancel=None):
+    pixels = pixels32(data)
+    out = bytearray(len(pixels) * 4)
+    out_pixels = pixels32(out)
+    is_green = key_rgb[1] >= key_rgb[2]
+    bg_val = max(bg_brightness / 255.0, 0.01)
+    for i, px in enumerate(pixels):
+        if cancelled(cancel, i):
+            return None
+        out_pixels[i] = pack(*alpha_extract_color(*unpack(px), is_green, bg_val, edge_softness / 100.0))
+    return out
+
+def reference_key_mask(data, lab, lower, upper, skip=None, cache=None, cancel=None, levels=IDENTITY_LEVELS):
+    pixels = pixels32(data)
+    out = bytearray(len(pixels))
+    for i, px in enumerate(pixels):
+        if cancelled(cancel, i):
+            return None
+        if skip is None or skip[i] != 255:
+            out[i] = key_mask_value(*unpack(px), lab, lower, upper, levels)
+    return out
+
+# --- LUT: table-driven Lab conversion on cache misses ---
+
+def lut_key_mask(data, lab, lower, upper, skip=None, cache=None, cancel=None, levels=IDENTITY_LEVELS):
+    """
+    Same as keying_core.key_mask, but pixels that need no un-premultiply
+    (alpha 0 or 255) take their linear RGB from LINEAR_LUT and run the
+    Lab math inline. The table holds exactly what linearize_srgb computes.
+    """
+    pixels = pixels32(data)
+    out = bytearray(len(pixels))
+    if cache is None:
+        cache = mask_cache(lab, lower, upper, levels)
+    multi = is_key_set(lab)
+    key_L, key_a, key_b = lab if not multi else (0.0, 0.0, 0.0)
+    sqrt = math.sqrt
+    yn, xn, zn = keying_core.Yn, keying_core.Xn, keying_core.Zn
+
+    for i, px in enumerate(pixels):
+        if cancelled(cancel, i):
+            return None
+        if skip is not None and skip[i] == 255:
+            continue
+        val = cache.get(px)
+        if val is None:
+            r, g, b, a = unpack(px)
+            if 0 < a < 255:
+                val = key_mask_value(r, g, b, a, lab, lower, upper, levels)
+            else:
+                lr, lg, lb = LINEAR_LUT[r], LINEAR_LUT[g], LINEAR_LUT[b]
+                x = (lr * 0.4124 + lg * 0.3576 + lb * 0.1805) * 100.0
+                y = (lr * 0.2126 + lg * 0.7152 + lb * 0.0722) * 100.0
+                z = (lr * 0.0193 + lg * 0.1192 + lb * 0.9505) * 100.0
+                fy = func_lab(y / yn)
+                if multi:
+                    dist = nearest_distance((116.0 * fy - 16.0, 500.0 * (func_lab(x / xn) - fy),
+                                             200.0 * (fy - func_lab(z / zn))), lab, lower)
+                else:
+                    diff_L = key_L - (116.0 * fy - 16.0)
+                    diff_a = key_a - (500.0 * (func_lab(x / xn) - fy))
+                    diff_b = key_b - (200.0 * (fy - func_lab(z / zn)))
+                    dist = sqrt(diff_L * diff_L + diff_a * diff_a + diff_b * diff_b)
+                val = tolerance_mask(dist, lower, upper, levels)
+            cache[px] = val
+        out[i] = val
+    return out
+
+# --- Registry ---
+
+BUFFER_OPS = {
+    'despill': keying_core.despill_rgba,
+    'alpha_extract': keying_core.alpha_extract_rgba,
+    'key_mask': keying_core.key_mask,
+}
+
+def _load_numpy():
+    import keying_array
+    return {'despill': keying_array.np_despill, 'alpha_extract': keying_array.np_alpha_extract,
+            'key_mask': keying_array.np_key_mask}
+
+def _load_bands():
+    import keying_bands
+    return {'despill': keying_bands.band_despill, 'alpha_extract': keying_bands.band_alpha_extract}
+
+def _load_numba():
+    import keying_array
+    if keying_array.numba is None:
+        raise ImportError("No module named 'numba'")
+    return {'despill': keying_array.jit_despill, 'alpha_extract': keying_array.jit_alpha_extract,
+            'key_mask': keying_array.jit_key_mask}
+
+register(Backend('reference', "Pure Python, one pixel at a time, no caches (ground truth)",
+                 lambda: {'despill': reference_despill, 'alpha_extract': reference_alpha_extract,
+                          'key_mask': reference_key_mask}, exact=True, auto=False))
+register(Backend('buffer', "Pure Python over 32-bit pixel views with per-color caches (default)",
+                 lambda: dict(BUFFER_OPS), exact=True))
+register(Backend('lut', "Buffer backend with table-driven sRGB linearization for the key mask",
+                 lambda: {'key_mask': lut_key_mask}, exact=True))
+register(Backend('bands', "Pillow ImageMath/ImageChops band operations, no NumPy (key mask: buffer)",
+                 _load_bands, exact=True))
+register(Backend('numpy', "NumPy float64 array math (needs numpy)", _load_numpy, bulk=True))
+register(Backend('numba', "Numba-compiled per-pixel loops (needs numpy and numba)", _load_numba, bulk=True))
+
+# --- Test plates ---
+
+def test_plate(width, height, seed=0, alpha_share=0.15):
+    """
+    Deterministic RGBA test plate: a noisy, unevenly lit screen (green for
+    even seeds, blue for odd), solid shapes with soft edges and random
+    partial alpha on `alpha_share` of the pixels. Returns raw RGBA bytes.
+    """
+    rng = random.Random(seed)
+    screen = (rng.randrange(40, 120), rng.randrange(160, 256), rng.randrange(40, 120))
+    if seed % 2:
+        screen = (screen[0], screen[2], screen[1])
+    shapes = [(rng.uniform(0, width), rng.uniform(0, height), rng.uniform(3, max(4, width / 3)),
+               tuple(rng.randrange(256) for _ in range(3))) for _ in range(6)]
+
+    data = bytearray(width * height * 4)
+    for y in range(height):
+        shade = 0.7 + 0.3 * y / max(1, height - 1)
+        for x in range(width):
+            r, g, b = (min(255, max(0, int(c * shade) + rng.randint(-12, 12))) for c in screen)
+            for cx, cy, radius, color in shapes:
+                d = math.hypot(x - cx, y - cy) / radius
+                if d < 1.0:
+                    t = min(1.0, (1.0 - d) * 4)
+                    r, g, b = (int(c1 * t + c0 * (1 - t)) for c0, c1 in zip((r, g, b), color))
+            a = rng.randrange(256) if rng.random() < alpha_share else 255
+            i = (y * width + x) * 4
+            data[i:i + 4] = bytes((r, g, b, a))
+    return bytes(data)
+
+# --- Selection ---
+
+CALIBRATION_SIZE = 64
+_active = [None]
+_calibration = {}
+
+def calibrate(size=CALIBRATION_SIZE):
+    """Times each available auto candidate on a test plate. Returns [(seconds, name), ...], fastest first."""
+    if not _calibration:
+        plate = test_plate(size, size, seed=1234)
+        tiny = plate[:64]
+        lab = keying_core.key_to_lab((0, 255, 0))
+        for backend in BACKENDS.values():
+            if not backend.auto or not backend.available:
+                continue
+            runs = lambda data: (backend.despill(data, 'green', 'average', True),
+                                 backend.alpha_extract(data, (0, 255, 0), 230, 50.0),
+                                 backend.key_mask(data, lab, 15.0, 35.0, cache={}))
+            # Warm up (JIT compilation, lazy imports) on a few pixels first
+            runs(tiny)
+            start = time.perf_counter()
+            runs(plate)
+            _calibration[backend.name] = time.perf_counter() - start
+    return sorted((seconds, name) for name, seconds in _calibration.items())
+
+def get_backend(name=None):
+    """Backend by name; None reads KEYING_BACKEND (default: DEFAULT_BACKEND), and 'auto' calibrates."""
+    name = name or os.environ.get(BACKEND_ENV) or DEFAULT_BACKEND
+    if name == 'auto':
+        return BACKENDS[calibrate()[0][1]]
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend '{name}' (choose from auto, {', '.join(BACKENDS)})")
+    backend = BACKENDS[name]
+    if not backend.available:
+        raise ValueError(f"Backend '{name}' is not available: {backend.error}")
+    return backend
+
+def set_backend(name=None):
+    """Makes `name` the backend for this process and the worker processes it starts."""
+    backend = get_backend(name)
+    _active[0] = backend
+    os.environ[BACKEND_ENV] = backend.name
+    return backend
+
+def current():
+    if _active[0] is None:
+        set_backend()
+    return _active[0]
+
+def add_backend_arguments(parser):
+    parser.add_argument("--backend", default=None, choices=['auto'] + list(BACKENDS),
+                        help=f"Keying engine (default: ${BACKEND_ENV} or {DEFAULT_BACKEND}; "
+                             "auto = time the available ones and use the fastest)")
+
+def apply_backend_args(args):
+    """Selects the backend named by --backend; exits with a message if it is unusable."""
+    try:
+        return set_backend(args.backend)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+# --- Verification ---
+
+VERIFY_CASES = [
+    ('despill', f"{color}/{method}{'/luma' if luma else ''}",
+     lambda b, data, color=color, method=method, luma=luma: b.despill(data, color, method, luma))
+    for color in ('green', 'blue') for method in keying_core.DESPILL_METHODS for luma in (False, True)
+] + [
+    ('alpha_extract', f"{name}/bg{bg}/soft{soft:g}",
+     lambda b, data, rgb=rgb, bg=bg, soft=soft: b.alpha_extract(data, rgb, bg, soft))
+    for name, rgb in (('green', (0, 255, 0)), ('blue', (0, 0, 255))) for bg, soft in ((255, 0.0), (210, 50.0))
+] + [
+    ('key_mask', f"{name}/{lower:g}-{upper:g}",
+     lambda b, data, rgb=rgb, lower=lower, upper=upper: b.key_mask(data, keying_core.key_to_lab(rgb), lower, upper,
+                                                                   cache={}))
+    for name, rgb in (('green', (95, 179, 86)), ('blue', (40, 60, 220))) for lower, upper in ((5.0, 25.0), (15.0, 35.0))
+] + [
+    ('key_mask', f"{name}/{len(rgbs)} keys",
+     lambda b, data, rgbs=rgbs: b.key_mask(data, keying_core.key_set([keying_core.key_to_lab(c) for c in rgbs]),
+                                           10.0, 30.0, cache={}))
+    for name, rgbs in (('green', [(95, 179, 86), (70, 150, 60), (120, 205, 110), (95, 179, 86)]),
+                       ('spread', [(40 + 9 * i, 120 + 6 * i, 220 - 8 * i) for i in range(20)]))
+] + [
+    ('key_mask', f"green/levels {shadows:g}/{highlights:g}{'/invert' if invert else ''}",
+     lambda b, data, levels=(shadows, highlights, invert): b.key_mask(data, keying_core.key_to_lab((95, 179, 86)),
+                                                                      15.0, 35.0, cache={}, levels=levels))
+    for shadows, highlights, invert in ((100.0, 400.0, False), (70.0, 130.0, True))
+]
+
+# Keyed output (mask composed into alpha) against the original per-pixel
+# keyer, which multiplied alpha by the float mask: int(a * m). The keyers
+# multiply by the quantized mask byte M = int(m * 255) instead, truncating
+# a * M // 255 like ImageChops.multiply, which is exact for opaque pixels but
+# can be 1 lower on partial alpha, so these cases allow COMPOSE_TOLERANCE.
+# They run on plates where every pixel may carry partial alpha.
+COMPOSE_TOLERANCE = 1
+COMPOSE_ALPHA_SHARE = 0.5
+COMPOSE_CASES = [
+    ('green/15-35', (95, 179, 86), 15.0, 35.0, IDENTITY_LEVELS),
+    ('blue/5-25', (40, 60, 220), 5.0, 25.0, IDENTITY_LEVELS),
+    ('green/levels 70/130/invert', (95, 179, 86), 15.0, 35.0, (70.0, 130.0, True)),
+]
+
+def reference_compose(data, lab, lower, upper, levels=IDENTITY_LEVELS):
+    """Keyed RGBA data as the original keyer composed it: alpha = int(a * mask) with the float mask."""
+    pixels = pixels32(data)
+    out = bytearray(len(pixels) * 4)
+    out_pixels = pixels32(out)
+    for i, px in enumerate(pixels):
+        r, g, b, a = unpack(px)
+        mask = levels_value(tolerance_value(key_distance(r, g, b, a, lab, lower), lower, upper), *levels)
+        out_pixels[i] = pack(r, g, b, int(a * mask))
+    return out
+
+def channel_errors(expected, actual, channels):
+    """Per-channel (max, mean) absolute error between two interleaved byte buffers."""
+    stats = []
+    for c in range(channels):
+        diffs = [abs(e - a) for e, a in zip(expected[c::channels], actual[c::channels])]
+        stats.append((max(diffs, default=0), sum(diffs) / max(1, len(diffs))))
+    return stats
+
+def verify(names, seed=1, images=4, size=96, tolerance=1):
+    """
+    Runs each backend against the reference on seeded test plates and
+    prints max/mean error per channel. Returns True if every exact backend
+    matched bit for bit and every other stayed within `tolerance` (plus
+    COMPOSE_TOLERANCE for the composed output).
+    """
+    plates = [test_plate(size, size, seed + i) for i in range(images)]
+    alpha_plates = [test_plate(size, size, seed + i, COMPOSE_ALPHA_SHARE) for i in range(images)]
+    composed = {label: b''.join(reference_compose(plate, keying_core.key_to_lab(rgb), lower, upper, levels)
+                                for plate in alpha_plates)
+                for label, rgb, lower, upper, levels in COMPOSE_CASES}
+    reference = BACKENDS['reference']
+    ok = True
+    for name in names:
+        backend = BACKENDS[name]
+        if not backend.available:
+            print(f"{name:10} unavailable: {backend.error}")
+            continue
+        limit = 0 if backend.exact else tolerance
+        worst = 0
+        for op, label, run in VERIFY_CASES:
+            expected = b''.join(run(reference, plate) for plate in plates)
+            actual = b''.join(bytes(run(backend, plate)) for plate in plates)
+            channels = 1 if op == 'key_mask' else 4
+            stats = channel_errors(expected, actual, channels)
+            worst = max([worst] + [m for m, _ in stats])
+            names_c = 'M' if channels == 1 else 'RGBA'
+            print(f"{name:10} {op:14} {label:26} "
+                  + "  ".join(f"{c} max {m:3d} mean {avg:.4f}" for c, (m, avg) in zip(names_c, stats)))
+        compose_worst = 0
+        for label, rgb, lower, upper, levels in COMPOSE_CASES:
+            lab = keying_core.key_to_lab(rgb)
+            actual = b''.join(bytes(multiply_alpha(plate, backend.key_mask(plate, lab, lower, upper, cache={},
+                                                                           levels=levels)))
+                              for plate in alpha_plates)
+            stats = channel_errors(composed[label], actual, 4)
+            compose_worst = max([compose_worst] + [m for m, _ in stats])
+            print(f"{name:10} {'compose':14} {label:26} "
+                  + "  ".join(f"{c} max {m:3d} mean {avg:.4f}" for c, (m, avg) in zip('RGBA', stats)))
+        passed = worst <= limit and compose_worst <= limit + COMPOSE_TOLERANCE
+        ok = ok and passed
+        print(f"{name:10} {'PASS' if passed else 'FAIL'}: max error {worst} (allowed {limit}), "
+              f"composed {compose_worst} (allowed {limit + COMPOSE_TOLERANCE})\n")
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keying backends: list, calibrate and verify against the reference")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("list", help="Show backends, capabilities and calibration timings")
+
+    verify_parser = sub.add_parser("verify", help="Compare backends with the pure reference on seeded plates")
+    verify_parser.add_argument("backends", nargs="*", help="Backends to check (default: all but reference)")
+    verify_parser.add_argument("--seed", type=int, default=1, help="First plate seed")
+    verify_parser.add_argument("--images", type=int, default=4, help="Number of test plates")
+    verify_parser.add_argument("--size", type=int, default=96, help="Plate width and height in pixels")
+    verify_parser.add_argument("--tolerance", type=int, default=1,
+                               help="Max error allowed for backends not flagged exact (0-255)")
+
+    args = parser.parse_args()
+
+    if args.command == "list":
+        timings = {name: seconds for seconds, name in calibrate()}
+        fastest = min(timings, key=timings.get)
+        for backend in BACKENDS.values():
+            if backend.available:
+                flags = [flag for flag in ('exact', 'bulk', 'auto') if getattr(backend, flag)]
+                timing = f"{timings[backend.name] * 1000:7.1f} ms" if backend.name in timings else "        -"
+                mark = " <- auto" if backend.name == fastest else ""
+                print(f"{backend.name:10} {timing}  [{', '.join(flags)}] ops: {', '.join(backend.provides())}{mark}")
+                print(f"{'':10} {backend.description}")
+            else:
+                print(f"{backend.name:10} unavailable ({backend.error})")
+    else:
+        unknown = [name for name in args.backends if name not in BACKENDS]
+        if unknown:
+            parser.error(f"Unknown backend(s): {', '.join(unknown)}")
+        names = args.backends or [name for name in BACKENDS if name != 'reference']
+        if not verify(names, args.seed, args.images, args.size, args.tolerance):
+            sys.exit(1)
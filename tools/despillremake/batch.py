@@ -0,0 +1,291 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from PIL import Image
+
+import pipeline
+import timing
+from backends import add_backend_arguments, apply_backend_args
+from build_cache import MANIFEST_NAME, BuildCache, add_cache_arguments, backend_param, params_hash
+from export import COMPRESSION_PROFILES, DEFAULT_COMPRESSION, format_size, save_image
+from watch import add_watch_arguments, watch
+
+# ==========================================
+# BATCH KEYING (many files, one preset)
+# ==========================================
+# Usage:
+#   python batch.py "../../button_*.png" ../../discord_button_.png -o keyed --preset buttons.json
+#   python batch.py ../../ -o keyed --preset buttons.toml -j 8
+#
+# The preset is a JSON or TOML table of keying tool get_params() keys, e.g.
+#   {"ck_color": "#5fb356", "ck_low": 10, "apply_despill": true}
+# Missing keys take the GUI defaults.
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp')
+
+def load_preset(path):
+    """Loads a get_params()-style preset from JSON or TOML."""
+    if not path:
+        return pipeline.resolve_params({})
+    if path.lower().endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            raise ValueError("TOML presets need Python 3.11+ (tomllib); use JSON instead")
+        with open(path, 'rb') as f:
+            params = tomllib.load(f)
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            params = json.load(f)
+    return pipeline.resolve_params(params)
+
+def collect_inputs(patterns):
+    """Expands globs and directories (recursively) into a sorted list of image files."""
+    files = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for dirpath, _, filenames in os.walk(pattern):
+                for name in filenames:
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        files.add(os.path.normpath(os.path.join(dirpath, name)))
+        else:
+            for path in glob.glob(pattern, recursive=True):
+                if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS):
+                    files.add(os.path.normpath(path))
+    return sorted(files)
+
+def mirrored_path(src, root, out_dir, extension='.png'):
+    """Output path under `out_dir` mirroring `src`'s location relative to `root`."""
+    rel = os.path.relpath(os.path.abspath(src), os.path.abspath(root))
+    return os.path.join(out_dir, os.path.splitext(rel)[0] + extension)
+
+def common_root(files):
+    if not files:
+        return '.'
+    dirs = [os.path.dirname(os.path.abspath(f)) for f in files]
+    return os.path.commonpath(dirs)
+
+# --- Worker side ---
+# Each worker parses the preset and warms the key tables once, then keys
+# every file it receives with them.
+
+_worker_params = None
+_worker_export = {'compression': DEFAULT_COMPRESSION, 'channels': 'rgba'}
+
+def init_worker(params, export=None):
+    global _worker_params, _worker_export
+    _worker_params = params
+    if export:
+        _worker_export = export
+    # A forked worker starts with a copy of the parent's trace; it records its own
+    timing.stop_trace()
+    # Key a single pixel so key Lab, levels and the pixel cache are built up front
+    pipeline.process_params(Image.new("RGBA", (1, 1)), params)
+
+def key_file(src, dst):
+    """
+    Keys one file. Returns (src, dst, pixels, seconds, error, encode_seconds,
+    output_bytes).
+    """
+    start = time.perf_counter()
+    try:
+        with timing.span('file', src=src):
+            with timing.span('decode'):
+                img = Image.open(src).convert("RGBA")
+            pixels = img.width * img.height
+            img = pipeline.process_params(img, _worker_params)
+            os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+            channels = pipeline.export_channels(_worker_params, _worker_export['channels'])
+            encode_seconds, size = save_image(img, dst, _worker_export['compression'], channels)
+        return src, dst, pixels, time.perf_counter() - start, None, encode_seconds, size
+    except Exception as e:
+        return src, dst, 0, time.perf_counter() - start, str(e), 0.0, 0
+
+def key_file_traced(src, dst):
+    """key_file that also returns the worker's trace events: (result, events)."""
+    timing.start_trace()
+    result = key_file(src, dst)
+    return result, timing.drain()
+
+def make_pool(params, workers=None, export=None):
+    """
+    Worker pool whose processes are initialized with `params` (and the export
+    settings {'compression': ..., 'channels': ...}) once.
+    """
+    return ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(params, export))
+
+def run_batch(jobs, params, workers=None, on_result=None, pool=None, export=None):
+    """
+    Keys (src, dst) pairs across worker processes.
+    Returns a summary dict; `on_result` is called with each key_file result.
+    Pass an existing `pool` (from make_pool) to keep workers warm between runs.
+    """
+    if pool is None:
+        with make_pool(params, workers, export) as pool:
+            return run_batch(jobs, params, workers, on_result, pool)
+
+    start = time.perf_counter()
+    results = []
+    # Worker processes have their own trace; their events travel back with each result
+    traced = timing.tracing()
+    futures = [pool.submit(key_file_traced if traced else key_file, src, dst) for src, dst in jobs]
+    for future in as_completed(futures):
+        result = future.result()
+        if traced:
+            result, events = result
+            timing.add_events(events)
+        results.append(result)
+        if on_result:
+            on_result(result)
+    return summarize(results, time.perf_counter() - start)
+
+def summarize(results, elapsed):
+    done = [r for r in results if r[4] is None]
+    pixels = sum(r[2] for r in done)
+    elapsed = max(elapsed, 1e-9)
+    return {
+        'files': len(done),
+        'failures': [(r[0], r[4]) for r in results if r[4] is not None],
+        'seconds': elapsed,
+        'files_per_s': len(done) / elapsed,
+        'mpix_per_s': pixels / 1e6 / elapsed,
+        'encode_seconds': sum(r[5] for r in done),
+        'output_bytes': sum(r[6] for r in done),
+    }
+
+def print_result(result):
+    src, dst, pixels, seconds, error, encode_seconds, size = result
+    if error:
+        print(f"  FAILED {src}: {error}")
+    else:
+        print(f"  {src} -> {dst} ({seconds:.2f}s, encode {encode_seconds:.2f}s, {format_size(size)})")
+
+def print_summary(summary):
+    print(f"Keyed {summary['files']} file(s) in {summary['seconds']:.2f}s: "
+          f"{summary['files_per_s']:.2f} files/s, {summary['mpix_per_s']:.2f} Mpix/s, "
+          f"{len(summary['failures'])} failure(s)")
+    if summary['files']:
+        print(f"Output: {format_size(summary['output_bytes'])}, "
+              f"{summary['encode_seconds']:.2f}s encoding (summed over workers)")
+    for src, error in summary['failures']:
+        print(f"  {src}: {error}")
+
+def add_batch_arguments(parser):
+    parser.add_argument("inputs", nargs='+', help="Input files, globs or directories")
+    parser.add_argument("-o", "--output-dir", required=True, help="Directory for keyed outputs (mirrors the input tree)")
+    parser.add_argument("--root", help="Root the output tree mirrors (default: common parent of the inputs)")
+    parser.add_argument("--preset", help="JSON or TOML file of keying tool parameters")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--format", choices=['png', 'webp', 'rgba', 'npy'], default='png',
+                        help="Output format (webp is lossless; rgba is raw pixels plus a .json sidecar)")
+    parser.add_argument("--compression", choices=list(COMPRESSION_PROFILES), default=DEFAULT_COMPRESSION,
+                        help="Encode speed vs size for PNG/WebP outputs (default: balanced)")
+    parser.add_argument("--alpha-only", action="store_true",
+                        help="Write only the alpha channel, as a grayscale image")
+    add_backend_arguments(parser)
+    add_cache_arguments(parser)
+    timing.add_trace_arguments(parser)
+
+def export_settings(args):
+    return {'compression': args.compression, 'channels': 'alpha' if args.alpha_only else 'rgba'}
+
+def find_inputs(args):
+    """Input files for a batch run, never including our own outputs."""
+    # The output tree may sit inside an input directory
+    out_abs = os.path.abspath(args.output_dir)
+    return [f for f in collect_inputs(args.inputs)
+            if not os.path.abspath(f).startswith(out_abs + os.sep)]
+
+def build(args, params, pool=None, only=None):
+    """
+    Keys every input that is out of date (restricted to `only` if given)
+    and updates the build manifest. Returns the summary.
+    """
+    files = find_inputs(args)
+    root = args.root or common_root(files)
+    jobs = [(src, mirrored_path(src, root, args.output_dir, '.' + args.format)) for src in files
+            if only is None or src in only]
+
+    # Skip outputs whose input, parameters and engine version are unchanged
+    cache = BuildCache(args.manifest or os.path.join(args.output_dir, MANIFEST_NAME))
+    export = export_settings(args)
+    p_hash = params_hash({'tool': 'batch', 'params': params, 'export': export, 'backend': backend_param()})
+    if not args.force:
+        cache.skipped = [dst for src, dst in jobs if cache.is_up_to_date(src, dst, p_hash)]
+        jobs = [(src, dst) for src, dst in jobs if dst not in cache.skipped]
+
+    def on_result(result):
+        print_result(result)
+        src, dst, _, _, error, _, _ = result
+        if error is None:
+            cache.record(src, dst, p_hash)
+            cache.rebuilt.append(dst)
+
+    print(f"Keying {len(jobs)} file(s) into {args.output_dir}...")
+    summary = run_batch(jobs, params, args.jobs, on_result, pool, export) if jobs else summarize([], 0)
+    cache.save()
+    print_summary(summary)
+    print(f"Build cache: {cache.report()}")
+    return summary
+
+def watch_batch(args):
+    """
+    Re-keys changed inputs as they change. The worker pool stays warm between
+    runs and is only rebuilt when the preset itself changes.
+    """
+    state = {'params': None, 'pool': None}
+
+    def get_paths():
+        paths = find_inputs(args)
+        if args.preset:
+            paths.append(args.preset)
+        return paths
+
+    def on_change(changed):
+        if state['pool'] is None or args.preset in changed:
+            params = load_preset(args.preset)
+            if state['pool'] is not None:
+                state['pool'].shutdown()
+                print("Preset changed; restarting workers.")
+            state['params'] = params
+            state['pool'] = make_pool(params, args.jobs, export_settings(args))
+            build(args, params, state['pool'])
+        else:
+            build(args, state['params'], state['pool'], only=changed)
+
+    try:
+        watch(get_paths, on_change, args.poll_interval, args.debounce)
+    finally:
+        if state['pool'] is not None:
+            state['pool'].shutdown()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch keying of many images with one preset")
+    add_batch_arguments(parser)
+    add_watch_arguments(parser)
+    args = parser.parse_args()
+    # Chosen (and, with --backend auto, calibrated) once here; workers inherit it through the environment
+    apply_backend_args(args)
+    timing.apply_trace_args(args)
+
+    if args.watch:
+        watch_batch(args)
+        sys.exit(0)
+
+    try:
+        params = load_preset(args.preset)
+    except Exception as e:
+        print(f"Error loading preset: {e}")
+        sys.exit(1)
+
+    if not find_inputs(args):
+        print("No input images found.")
+        sys.exit(1)
+
+    summary = build(args, params)
+    if summary['failures']:
+        sys.exit(1)
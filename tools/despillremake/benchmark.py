@@ -0,0 +1,360 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from PIL import Image, ImageChops, ImageDraw, ImageFilter
+
+import PIL
+import backends
+import keying_core
+from alpha_extract import alpha_extract_image
+from chroma_key import chromakey_image
+from despill import despill_image, process_despill_pure
+from pipeline import process_params
+
+# ==========================================
+# KEYING BENCHMARKS
+# ==========================================
+# Usage:
+#   python benchmark.py                                  (256 and 1024, every plate/op/backend)
+#   python benchmark.py --sizes 256,1080p,4k,8k --backends numpy,numba -o bench.json
+#   python benchmark.py -o new.json --baseline bench.json --threshold 10
+#
+# Plates are generated deterministically from a seed (noise comes from
+# random.Random tiles, not Pillow's effect_noise), so runs are comparable
+# across machines and commits. Each case runs once to warm up and then
+# --repeat times, and more (up to MAX_RUNS) until the timed runs add up to
+# --min-time seconds, so millisecond cases get enough samples; the mask
+# cache is cleared before every run so each one measures a cold key.
+# Results are written as JSON; with --baseline, cases whose median time grew
+# by more than --threshold percent are reported as regressions and the exit
+# code is 1. A change must also exceed the noise of both runs (the larger
+# p90 - p50 spread, at least NOISE_FLOOR seconds) to count either way.
+#
+# Peak memory: `peak_traced_mb` is the tracemalloc peak of one extra run
+# (Python allocations such as tobytes() buffers and caches; Pillow's own
+# image memory is not traced). `max_rss_mb` is the process high-water mark
+# after the case.
+
+SCREEN = (95, 179, 86)
+KEY_HEX = '#5fb356'
+NOISE_TILE = 509  # prime, so the noise never lines up with 64px key tiles
+
+NAMED_SIZES = {'720p': (1280, 720), '1080p': (1920, 1080), '4k': (3840, 2160), '8k': (7680, 4320)}
+DEFAULT_SIZES = '256,1024'
+ALL_SIZES = '256,512,1024,1080p,4k,8k'
+
+DEFAULT_MIN_TIME = 0.5
+MAX_RUNS = 1000
+NOISE_FLOOR = 0.001  # seconds; timer and scheduler jitter below this is not a change
+
+ASSET = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'input.png')
+
+def parse_size(text):
+    """'256' -> (256, 256), '1920x1080' -> (1920, 1080), or a name such as '4k'."""
+    text = text.strip().lower()
+    if text in NAMED_SIZES:
+        return NAMED_SIZES[text]
+    if 'x' in text:
+        width, height = text.split('x')
+        return int(width), int(height)
+    return int(text), int(text)
+
+# --- Synthetic plates ---
+
+def noise_layer(size, seed, amplitude):
+    """RGB noise in [0, amplitude) tiled from a seeded random tile."""
+    rng = random.Random(seed)
+    tile = Image.frombytes("RGB", (NOISE_TILE, NOISE_TILE), rng.randbytes(NOISE_TILE * NOISE_TILE * 3))
+    tile = tile.point(lambda v: v * amplitude // 256)
+    layer = Image.new("RGB", size)
+    for y in range(0, size[1], NOISE_TILE):
+        for x in range(0, size[0], NOISE_TILE):
+            layer.paste(tile, (x, y))
+    return layer
+
+def screen(size, seed, amplitude=32):
+    """Unevenly lit screen with sensor-like noise."""
+    base = Image.linear_gradient("L").resize(size).point(lambda v: 200 + v * 55 // 255)
+    lit = Image.merge("RGB", [base.point(lambda v, c=c: c * v // 255) for c in SCREEN])
+    if amplitude:
+        lit = ImageChops.add(lit, noise_layer(size, seed, amplitude), offset=-amplitude // 2)
+    return lit.convert("RGBA")
+
+def subject(img, seed):
+    """Paints an opaque foreground subject (the same blobs on every plate of a seed)."""
+    rng = random.Random(seed)
+    draw = ImageDraw.Draw(img)
+    w, h = img.size
+    for _ in range(5):
+        cx, cy = rng.uniform(0.2, 0.8) * w, rng.uniform(0.3, 0.9) * h
+        r = rng.uniform(0.05, 0.2) * min(w, h)
+        draw.ellipse((cx - r, cy - r, cx + r, cy + r), fill=tuple(rng.randrange(30, 230) for _ in range(3)) + (255,))
+    return img
+
+def plate_flat(size, seed):
+    return subject(screen(size, seed, amplitude=0), seed)
+
+def plate_noisy(size, seed):
+    return subject(screen(size, seed), seed)
+
+def plate_hair(size, seed):
+    """Noisy screen with thousands of thin, curved strands over the subject's top edge."""
+    img = plate_noisy(size, seed)
+    rng = random.Random(seed + 1)
+    draw = ImageDraw.Draw(img)
+    w, h = size
+    for _ in range(max(50, w * h // 800)):
+        x, y = rng.uniform(0, w), rng.uniform(0.2 * h, 0.6 * h)
+        dx, dy = rng.uniform(-1, 1), rng.uniform(-2, -0.5)
+        points = []
+        for _ in range(rng.randrange(8, 24)):
+            points.append((x, y))
+            x += dx * 3
+            y += dy * 3
+            dx += rng.uniform(-0.3, 0.3)
+        shade = rng.randrange(40, 120)
+        draw.line(points, fill=(shade, shade * 3 // 4, shade // 2, 255), width=1)
+    return img
+
+def plate_smoke(size, seed):
+    """Noisy screen under semi-transparent gray smoke (low-frequency seeded noise)."""
+    img = plate_noisy(size, seed)
+    rng = random.Random(seed + 2)
+    cloud = Image.frombytes("L", (16, 9), rng.randbytes(16 * 9)).resize(size, Image.Resampling.BICUBIC)
+    cloud = cloud.filter(ImageFilter.GaussianBlur(max(1, size[0] // 64))).point(lambda v: v * 3 // 4)
+    smoke = Image.new("RGBA", size, (180, 180, 185, 0))
+    smoke.putalpha(cloud)
+    img.alpha_composite(smoke)
+    return img
+
+def plate_asset(size, seed):
+    """The repo's own keying sample, resized to the plate size."""
+    return Image.open(ASSET).convert("RGBA").resize(size, Image.Resampling.BICUBIC)
+
+PLATES = {
+    'flat': plate_flat,
+    'noisy': plate_noisy,
+    'hair': plate_hair,
+    'smoke': plate_smoke,
+    'asset': plate_asset,
+}
+
+# --- Operations ---
+# (op, label, run(img, paths)) where `paths` has 'input' (the plate saved as
+# PNG) and 'output' for the file-to-file case.
+
+PIPELINE_PARAMS = {'apply_despill': True, 'ds_luma': True, 'ck_color': KEY_HEX, 'mt_choke': 1, 'mt_feather': 2.0}
+
+CASES = [
+    ('despill', 'average', lambda img, paths: despill_image(img, 'green', 'average', False)),
+    ('despill', 'limit+luma', lambda img, paths: despill_image(img, 'green', 'limit', True)),
+    ('chroma', 'tol5-25', lambda img, paths: chromakey_image(img, KEY_HEX, 5.0, 25.0)),
+    ('chroma', 'tol15-35+mask', lambda img, paths: chromakey_image(img, KEY_HEX, 15.0, 35.0, mask_only=True)),
+    ('alpha_extract', 'bg230/soft50', lambda img, paths: alpha_extract_image(img, KEY_HEX, 230, 50.0)),
+    ('pipeline', 'chroma+despill+refine', lambda img, paths: process_params(img, PIPELINE_PARAMS)),
+    ('despill_file', 'png', lambda img, paths: process_despill_pure(paths['input'], paths['output'],
+                                                                      'green', 'average', False)),
+]
+OPS = sorted({op for op, _, _ in CASES})
+
+def percentile(values, q):
+    """Linear-interpolated percentile (q in 0-100) of a non-empty list."""
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+def max_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return rss / (1 << 20) if sys.platform == 'darwin' else rss / 1024
+
+def run_case(run, img, paths, repeat, min_time=DEFAULT_MIN_TIME):
+    """
+    Times at least `repeat` cold runs (after one warm-up), and more until
+    they add up to `min_time` seconds. Returns (seconds list, peak traced bytes).
+    """
+    def once():
+        work = img.copy()
+        keying_core.clear_mask_cache()
+        start = time.perf_counter()
+        run(work, paths)
+        return time.perf_counter() - start
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        once()
+        times = [once() for _ in range(repeat)]
+        while sum(times) < min_time and len(times) < MAX_RUNS:
+            times.append(once())
+        tracemalloc.start()
+        try:
+            once()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return times, peak
+
+def run_benchmarks(sizes, plates, ops, backend_names, repeat=5, seed=1, log=print, min_time=DEFAULT_MIN_TIME):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            for plate_name in plates:
+                img = PLATES[plate_name](size, seed)
+                paths = {'input': os.path.join(tmp, 'plate.png'), 'output': os.path.join(tmp, 'out.png')}
+                if 'despill_file' in ops:
+                    img.save(paths['input'])
+                for backend_name in backend_names:
+                    backend = backends.set_backend(backend_name)
+                    for op, label, run in CASES:
+                        if op not in ops:
+                            continue
+                        times, peak = run_case(run, img, paths, repeat, min_time)
+                        median = statistics.median(times)
+                        result = {
+                            'id': f"{op}/{label}/{plate_name}/{size[0]}x{size[1]}/{backend.name}",
+                            'op': op,
+                            'params': label,
+                            'plate': plate_name,
+                            'size': list(size),
+                            'backend': backend.name,
+                            'repeat': len(times),
+                            'seconds': {
+                                'min': min(times),
+                                'p50': median,
+                                'p90': percentile(times, 90),
+                                'p99': percentile(times, 99),
+                                'max': max(times),
+                                'mean': statistics.fmean(times),
+                            },
+                            'mpix_per_s': size[0] * size[1] / 1e6 / median if median > 0 else None,
+                            'peak_traced_mb': peak / (1 << 20),
+                            'max_rss_mb': max_rss_mb(),
+                        }
+                        results.append(result)
+                        log(f"{result['id']:58} p50 {median:8.4f}s  p90 {result['seconds']['p90']:8.4f}s  "
+                            f"{result['mpix_per_s']:8.2f} Mpix/s  peak {result['peak_traced_mb']:7.1f} MB")
+    return results
+
+def environment():
+    info = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'pillow': PIL.__version__,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    for module in ('numpy', 'numba'):
+        try:
+            info[module] = __import__(module).__version__
+        except ImportError:
+            pass
+    return info
+
+def noise(result):
+    """Timing noise of one result: its p90 - p50 spread, at least NOISE_FLOOR seconds."""
+    seconds = result['seconds']
+    return max(NOISE_FLOOR, seconds['p90'] - seconds['p50'])
+
+def compare(results, baseline, threshold):
+    """
+    Matches cases by id against a baseline. Returns (regressions, improvements,
+    missing) where the first two are lists of (id, old_p50, new_p50, change %).
+    Changes within the noise of either run (see noise()) are neither.
+    """
+    old = {r['id']: r for r in baseline.get('results', [])}
+    regressions, improvements = [], []
+    for result in results:
+        before = old.get(result['id'])
+        if before is None:
+            continue
+        old_p50, new_p50 = before['seconds']['p50'], result['seconds']['p50']
+        change = (new_p50 - old_p50) / old_p50 * 100 if old_p50 > 0 else 0.0
+        entry = (result['id'], old_p50, new_p50, change)
+        if abs(new_p50 - old_p50) <= max(noise(before), noise(result)):
+            continue
+        if change > threshold:
+            regressions.append(entry)
+        elif change < -threshold:
+            improvements.append(entry)
+    missing = sorted(set(old) - {r['id'] for r in results})
+    return regressions, improvements, missing
+
+def split_list(text, known, what):
+    items = [item.strip() for item in text.split(',') if item.strip()]
+    unknown = [item for item in items if item not in known]
+    if unknown:
+        raise ValueError(f"Unknown {what}: {', '.join(unknown)} (choose from {', '.join(known)})")
+    return items
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the keying operations on deterministic plates")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help=f"Comma-separated sizes: N, WxH, 720p, 1080p, 4k, 8k (default: {DEFAULT_SIZES}; "
+                             f"'all' = {ALL_SIZES})")
+    parser.add_argument("--plates", default=','.join(PLATES), help=f"Plates (default: {','.join(PLATES)})")
+    parser.add_argument("--ops", default=','.join(OPS), help=f"Operations (default: {','.join(OPS)})")
+    parser.add_argument("--backends", default=None,
+                        help="Backends to run (default: every available one except reference)")
+    parser.add_argument("--repeat", type=int, default=5, help="Minimum timed runs per case (after one warm-up)")
+    parser.add_argument("--min-time", type=float, default=DEFAULT_MIN_TIME,
+                        help=f"Keep timing a case until its runs add up to this many seconds "
+                             f"(default: {DEFAULT_MIN_TIME:g}, at most {MAX_RUNS} runs)")
+    parser.add_argument("--seed", type=int, default=1, help="Plate seed")
+    parser.add_argument("-o", "--output", help="Write results as JSON")
+    parser.add_argument("--baseline", help="Earlier JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="Median slowdown in percent that counts as a regression (default: 10)")
+    args = parser.parse_args()
+
+    try:
+        sizes = [parse_size(s) for s in (ALL_SIZES if args.sizes == 'all' else args.sizes).split(',')]
+        plates = split_list(args.plates, list(PLATES), "plate(s)")
+        ops = split_list(args.ops, OPS, "operation(s)")
+        if args.backends:
+            backend_names = split_list(args.backends, list(backends.BACKENDS), "backend(s)")
+        else:
+            backend_names = [name for name, b in backends.BACKENDS.items() if name != 'reference' and b.available]
+        baseline = None
+        if args.baseline:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+    except (ValueError, OSError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    results = run_benchmarks(sizes, plates, ops, backend_names, args.repeat, args.seed, min_time=args.min_time)
+    report = {'format': 1, 'environment': environment(), 'results': results}
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+        print(f"Wrote {len(results)} result(s) to {args.output}")
+
+    if baseline is not None:
+        regressions, improvements, missing = compare(results, baseline, args.threshold)
+        for case_id, old_p50, new_p50, change in improvements:
+            print(f"  faster  {case_id}: {old_p50:.4f}s -> {new_p50:.4f}s ({change:+.1f}%)")
+        for case_id, old_p50, new_p50, change in regressions:
+            print(f"  SLOWER  {case_id}: {old_p50:.4f}s -> {new_p50:.4f}s ({change:+.1f}%)")
+        if missing:
+            print(f"  {len(missing)} baseline case(s) not run this time")
+        print(f"{len(regressions)} regression(s), {len(improvements)} improvement(s) "
+              f"beyond {args.threshold:g}% against {args.baseline}")
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+
+from backends import current
+
+# ==========================================
+# INCREMENTAL BUILD CACHE
+# ==========================================
+# A manifest maps each output file to the input content hash, engine version
+# and parameter hash it was built from, plus the hash of the output itself.
+# An output is up to date when all of them still match, so unchanged assets
+# are skipped on the next run.
+#
+# Bump ENGINE_VERSION whenever the keying math changes output pixels.
+
+ENGINE_VERSION = "2"
+MANIFEST_NAME = ".keying_manifest.json"
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def params_hash(params):
+    """
+    Stable hash of a parameter structure. String values that name existing
+    files (e.g. garbage/core mattes, presets) contribute their content hash.
+    """
+    def normalize(value):
+        if isinstance(value, dict):
+            return {k: normalize(v) for k, v in sorted(value.items())}
+        if isinstance(value, (list, tuple)):
+            return [normalize(v) for v in value]
+        if isinstance(value, str) and os.path.isfile(value):
+            return {'file': value, 'sha256': file_hash(value)}
+        return value
+    blob = json.dumps(normalize(params), sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+class BuildCache:
+    def __init__(self, manifest_path):
+        self.manifest_path = os.path.abspath(manifest_path)
+        self.root = os.path.dirname(self.manifest_path)
+        self.entries = {}
+        self.skipped = []
+        self.rebuilt = []
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('format') == 1:
+                    self.entries = data.get('outputs', {})
+            except (OSError, ValueError):
+                # A broken manifest only costs a full rebuild
+                self.entries = {}
+
+    @classmethod
+    def for_output(cls, output_path, manifest_path=None):
+        """Cache whose manifest lives next to `output_path` unless given explicitly."""
+        if manifest_path is None:
+            manifest_path = os.path.join(os.path.dirname(os.path.abspath(output_path)), MANIFEST_NAME)
+        return cls(manifest_path)
+
+    def _key(self, output_path):
+        return os.path.relpath(os.path.abspath(output_path), self.root).replace(os.sep, '/')
+
+    def _input_hash(self, input_path, entry=None):
+        """Hashes the input, reusing the stored hash when size and mtime are unchanged."""
+        st = os.stat(input_path)
+        stamp = [st.st_size, st.st_mtime_ns]
+        if entry and entry.get('input_stat') == stamp:
+            return entry['input_hash'], stamp
+        return file_hash(input_path), stamp
+
+    def is_up_to_date(self, input_path, output_path, p_hash):
+        entry = self.entries.get(self._key(output_path))
+        if not entry or not os.path.exists(output_path):
+            return False
+        if entry.get('engine') != ENGINE_VERSION or entry.get('params_hash') != p_hash:
+            return False
+        try:
+            input_hash, _ = self._input_hash(input_path, entry)
+        except OSError:
+            return False
+        if input_hash != entry.get('input_hash'):
+            return False
+        st = os.stat(output_path)
+        if entry.get('output_stat') == [st.st_size, st.st_mtime_ns]:
+            return True
+        return file_hash(output_path) == entry.get('output_hash')
+
+    def record(self, input_path, output_path, p_hash):
+        key = self._key(output_path)
+        input_hash, input_stat = self._input_hash(input_path, self.entries.get(key))
+        st = os.stat(output_path)
+        self.entries[key] = {
+            'input': os.path.relpath(os.path.abspath(input_path), self.root).replace(os.sep, '/'),
+            'input_hash': input_hash,
+            'input_stat': input_stat,
+            'engine': ENGINE_VERSION,
+            'params_hash': p_hash,
+            'output_hash': file_hash(output_path),
+            'output_stat': [st.st_size, st.st_mtime_ns],
+        }
+
+    def save(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'format': 1, 'outputs': self.entries}, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.manifest_path)
+
+    def report(self):
+        return f"{len(self.rebuilt)} rebuilt, {len(self.skipped)} skipped (up to date)"
+
+# --- CLI helpers ---
+
+def add_cache_arguments(parser):
+    parser.add_argument("--force", action="store_true",
+                        help="Rebuild even if the output is up to date")
+    parser.add_argument("--manifest",
+                        help=f"Build manifest path (default: {MANIFEST_NAME} next to the output)")
+
+# Options that never change the output pixels (the backend is hashed by backend_param)
+_NON_PARAMS = {'input', 'output', 'force', 'manifest', 'keep_intermediates', 'trace',
+               'profile', 'profiler', 'watch', 'poll_interval', 'debounce', 'size', 'backend'}
+
+def backend_param():
+    """
+    The active backend's part of a parameter hash: None for exact backends,
+    which all produce the reference output, else the backend's name.
+    """
+    backend = current()
+    return None if backend.exact else backend.name
+
+def cli_params(tool, args):
+    """Parameter structure of a single-file CLI run, used for hashing."""
+    options = {k: v for k, v in vars(args).items() if k not in _NON_PARAMS}
+    return {'tool': tool, 'options': options, 'backend': backend_param()}
+
+def run_cached(tool, args, run, params=None):
+    """
+    Calls `run()` unless args.output is up to date for args.input and the
+    tool's options. Returns True if the output was rebuilt.
+    """
+    cache = BuildCache.for_output(args.output, args.manifest)
+    p_hash = params_hash(params if params is not None else cli_params(tool, args))
+
+    if not args.force and cache.is_up_to_date(args.input, args.output, p_hash):
+        print(f"Up to date: {args.output} (use --force to rebuild)")
+        return False
+
+    run()
+    cache.record(args.input, args.output, p_hash)
+    print(f"Rebuilt {args.output}")
+    cache.save()
+    return True
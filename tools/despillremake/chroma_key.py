@@ -1,198 +1,356 @@
 import argparse
+import contextlib
 import math
 import sys
-from PIL import Image, ImageColor
+from collections import Counter
+from PIL import Image, ImageChops, ImageColor
+from keying_core import (IDENTITY_LEVELS, KEY_MERGE_DISTANCE, is_key_set, key_distance, key_set, key_to_lab,
+                         levels_table, levels_value, mask_cache, mask_rgba, multiply_alpha, pixels32,
+                         tolerance_value, unpack)
+from backends import add_backend_arguments, apply_backend_args, current
+from build_cache import add_cache_arguments, run_cached
+from export import add_export_arguments, save_output
+from matte_ops import add_refine_arguments, refine_alpha, refine_args
+from profiling import add_profile_arguments, apply_profile_args, profile_cli
+from stream import add_stream_arguments, is_stream, run_stream
+from timing import add_trace_arguments, apply_trace_args, span
+from watch import add_watch_arguments, watch_cli
 
-# --- Constants from Olive Shader ---
-Xn = 95.0489
-Yn = 100.0
-Zn = 108.8840
-DELTA = 0.20689655172  # 6/29
-DELTA_3 = DELTA ** 3   # pow(delta, 3.0)
-DELTA_2 = DELTA ** 2   # pow(delta, 2)
+# --- Tiled Mask Generation ---
+# The frame is keyed in square tiles. Tiles a garbage/core matte fully decides
+# never reach the Lab math (keying_core.key_mask). Levels (shadows,
+# highlights, invert) are applied to the float mask before it is quantized,
+# so the result matches per-pixel float math: the backends fold them into the
+# mask byte, and pixels under a partial matte value are recomputed in float.
+# The mask is exact; composing it into partial alpha (a * M // 255) can be 1
+# below the float product (see backends.COMPOSE_CASES).
+TILE_SIZE = 64
 
-def linearize_srgb(v):
+def matte_tile(matte, box, full_size):
     """
-    Converts sRGB (0.0-1.0) to Linear RGB.
-    This mimics the 'SceneLinear' input expected by the Olive shader.
+    Lazily upsamples the part of a (possibly lower resolution) matte that
+    covers `box` of the full frame. Returns an "L" image the size of the box.
     """
-    if v <= 0.04045:
-        return v / 12.92
-    else:
-        return ((v + 0.055) / 1.055) ** 2.4
+    x0, y0, x1, y1 = box
+    if matte.size == full_size:
+        return matte.crop(box)
+    sx = matte.width / full_size[0]
+    sy = matte.height / full_size[1]
+    src_box = (x0 * sx, y0 * sy, x1 * sx, y1 * sy)
+    return matte.resize((x1 - x0, y1 - y0), Image.Resampling.BILINEAR, box=src_box)
 
-def func_lab(t):
+def key_distance_tile(tile, key_lab, lower, upper, skip=None, cache=None, levels=IDENTITY_LEVELS):
     """
-    The helper function from the GLSL shader:
-    float func(float t) { ... }
+    Computes the mask (0-255, levels applied) for one RGBA tile.
+    Pixels whose `skip` byte is 255 are left at 0 without computing Lab.
+    `cache` maps packed RGBA values to mask bytes across tiles.
     """
-    if t > DELTA_3:
-        return t ** (1.0 / 3.0)
-    else:
-        return (t / (3.0 * DELTA_2)) + (4.0 / 29.0)
+    return Image.frombytes("L", tile.size, current().key_mask(tile.tobytes(), key_lab, lower, upper, skip, cache,
+                                                              levels=levels))
 
-def rgb_to_xyz(r, g, b):
+def matte_mask_value(r, g, b, a, key_lab, lower, upper, garbage, core, levels):
     """
-    Converts Linear RGB to CIE XYZ (D65).
-    Standard Matrix for sRGB/Rec709.
+    Mask byte of one pixel under partial matte values (bytes, or None without
+    that matte): garbage removes from the float tolerance mask, core adds to
+    it, then levels are applied and the result is quantized.
     """
-    # Matrix multiplication
-    x = (r * 0.4124 + g * 0.3576 + b * 0.1805) * 100.0
-    y = (r * 0.2126 + g * 0.7152 + b * 0.0722) * 100.0
-    z = (r * 0.0193 + g * 0.1192 + b * 0.9505) * 100.0
-    return x, y, z
+    mask = tolerance_value(key_distance(r, g, b, a, key_lab, lower), lower, upper)
+    if garbage is not None:
+        mask = max(0.0, min(1.0, mask - garbage / 255.0))
+    if core is not None:
+        mask = max(0.0, min(1.0, mask + core / 255.0))
+    return int(levels_value(mask, *levels) * 255)
 
-def xyz_to_lab(x, y, z):
+def _flag(matte, test):
+    """255 where `test(value)` holds for an "L" matte tile, else 0."""
+    return matte.point([255 if test(v) else 0 for v in range(256)])
+
+def apply_mattes(tile, src, key_lab, lower, upper, g_tile, c_tile, levels):
+    """
+    Combines a keyed tile (levels applied, 0 where garbage is 255) with its
+    matte tiles. Full matte values take a levels table entry; pixels under a
+    partial value are recomputed with matte_mask_value.
+    """
+    table = levels_table(*levels)
+    g_full = _flag(g_tile, lambda v: v == 255) if g_tile is not None else None
+    c_full = _flag(c_tile, lambda v: v == 255) if c_tile is not None else None
+
+    # Garbage 255: the tolerance mask drops to 0, so only the core is left
+    if g_full is not None:
+        covered = c_tile.point(table) if c_tile is not None else Image.new("L", tile.size, table[0])
+        tile = Image.composite(covered, tile, g_full)
+    # Core 255: the mask is 1.0 whatever the key says
+    if c_full is not None:
+        tile = Image.composite(Image.new("L", tile.size, table[255]), tile, c_full)
+
+    partial = None
+    for matte in (g_tile, c_tile):
+        if matte is not None:
+            flags = _flag(matte, lambda v: 0 < v < 255)
+            partial = flags if partial is None else ImageChops.lighter(partial, flags)
+    for full in (g_full, c_full):
+        if full is not None:
+            partial = ImageChops.subtract(partial, full)
+
+    flags = partial.tobytes()
+    i = flags.find(255)
+    if i == -1:
+        return tile
+    out = bytearray(tile.tobytes())
+    pixels = pixels32(src.tobytes())
+    g_bytes = g_tile.tobytes() if g_tile is not None else None
+    c_bytes = c_tile.tobytes() if c_tile is not None else None
+    while i != -1:
+        out[i] = matte_mask_value(*unpack(pixels[i]), key_lab, lower, upper,
+                                  g_bytes[i] if g_bytes is not None else None,
+                                  c_bytes[i] if c_bytes is not None else None, levels)
+        i = flags.find(255, i + 1)
+    return Image.frombytes("L", tile.size, bytes(out))
+
+def build_chroma_mask(img, key_lab, lower, upper, garbage_img=None, core_img=None, tile_size=TILE_SIZE,
+                      cancel=None, levels=IDENTITY_LEVELS):
+    """
+    Builds the final tolerance+matte+levels mask ("L") for an RGBA image.
+    `levels` is (shadows, highlights, invert).
+    Returns (mask, stats) where stats counts tiles skipped by each matte,
+    or (None, stats) if `cancel()` returned True between tiles.
+    """
+    width, height = img.size
+    levels = tuple(levels)
+    cache = mask_cache(key_lab, lower, upper, levels)
+    stats = {"tiles": 0, "garbage_skipped": 0, "core_skipped": 0}
+
+    # Array backends pay per call, so without mattes they key the whole frame at once
+    backend = current()
+    if backend.bulk and garbage_img is None and core_img is None:
+        data = backend.key_mask(img.tobytes(), key_lab, lower, upper, cache=cache, cancel=cancel, levels=levels)
+        stats["tiles"] = 1
+        return (Image.frombytes("L", img.size, data) if data is not None else None), stats
+
+    table = levels_table(*levels)
+    mask = Image.new("L", img.size, 0)
+
+    for y0 in range(0, height, tile_size):
+        for x0 in range(0, width, tile_size):
+            if cancel is not None and cancel():
+                return None, stats
+            box = (x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+            stats["tiles"] += 1
+
+            g_tile = matte_tile(garbage_img, box, img.size) if garbage_img else None
+            c_tile = matte_tile(core_img, box, img.size) if core_img else None
+
+            # Core fully white: mask is 1.0 whatever the key says
+            if c_tile is not None and c_tile.getextrema()[0] == 255:
+                mask.paste(table[255], box)
+                stats["core_skipped"] += 1
+                continue
+
+            # Garbage fully white: mask is 0.0 (plus whatever the core adds)
+            if g_tile is not None and g_tile.getextrema()[0] == 255:
+                mask.paste(c_tile.point(table) if c_tile is not None else table[0], box)
+                stats["garbage_skipped"] += 1
+                continue
+
+            src = img.crop(box)
+            skip = g_tile.tobytes() if g_tile is not None else None
+            tile = key_distance_tile(src, key_lab, lower, upper, skip, cache, levels)
+            if g_tile is not None or c_tile is not None:
+                tile = apply_mattes(tile, src, key_lab, lower, upper, g_tile, c_tile, levels)
+            mask.paste(tile, box)
+
+    return mask, stats
+
+def load_matte(path, label):
+    """Loads a garbage/core matte as "L" at its own resolution (upsampled per tile later)."""
+    if not path:
+        return None
+    try:
+        matte = Image.open(path).convert("L")
+        print(f"Loaded {label}.")
+        return matte
+    except:
+        print(f"Warning: Could not load {label}.")
+        return None
+
+def key_lab_set(colors):
+    """Lab key (one hex color) or key set (a list of hex colors, deduplicated in Lab)."""
+    if isinstance(colors, str):
+        colors = [colors]
+    # ImageColor.getrgb returns (r, g, b) 0-255
+    return key_set([key_to_lab(ImageColor.getrgb(color)[:3]) for color in colors])
+
+def sample_border_keys(img, count=6, border=8, spread=30.0, min_share=0.005):
+    """
+    Key colors sampled from a `border`-pixel band around the edge of an RGBA
+    image, for unevenly lit screens. Band colors are grouped (5 bits per
+    channel); the most common group is the first key, and further keys are
+    picked farthest-first among groups holding at least `min_share` of the
+    band and lying within `spread` Lab units of the first (so foreground that
+    touches the edge is not sampled). Returns up to `count` hex colors.
+    """
+    w, h = img.size
+    b = max(1, min(border, w // 2, h // 2))
+    strips = [img.crop(box) for box in ((0, 0, w, b), (0, h - b, w, h), (0, b, b, h - b), (w - b, b, w, h - b))]
+    groups = Counter()
+    for strip in strips:
+        if strip.width == 0 or strip.height == 0:
+            continue
+        rgb = strip.convert('RGB').point(lambda v: (v & 0xF8) | 4)
+        for n, color in rgb.getcolors(strip.width * strip.height):
+            groups[color] += n
+    if not groups:
+        return []
+
+    total = sum(groups.values())
+    anchor, _ = groups.most_common(1)[0]
+    labs = {color: key_to_lab(color) for color, n in groups.items() if n >= total * min_share}
+    labs[anchor] = key_to_lab(anchor)
+    candidates = [c for c, lab in labs.items() if math.dist(lab, labs[anchor]) <= spread]
+
+    keys = [anchor]
+    while len(keys) < count:
+        best, best_dist = None, KEY_MERGE_DISTANCE * 2
+        for color in candidates:
+            dist = min(math.dist(labs[color], labs[k]) for k in keys)
+            if dist > best_dist:
+                best, best_dist = color, dist
+        if best is None:
+            break
+        keys.append(best)
+    return ['#{:02x}{:02x}{:02x}'.format(*color) for color in keys]
+
+def chromakey_image(img, color, lower, upper, shadows=100.0, highlights=100.0,
+                    invert=False, mask_only=False, garbage_img=None, core_img=None, refine=None,
+                    cancel=None):
+    """
+    Keys an RGBA image in memory and returns the result (None if cancelled).
+    `color` is one hex key color or a list of them (the mask then uses the
+    nearest key). `refine` is an optional dict of matte_ops.refine_alpha
+    keyword arguments; like the keying tool, a mask-only result shows the
+    unrefined key mask.
+    """
+    with span('chroma', size=list(img.size)):
+        k_lab = key_lab_set(color)
+
+        # 4.-7. Tolerance, mattes, Highlights / Shadows and Invert, quantized once
+        mask, stats = build_chroma_mask(img, k_lab, lower, upper, garbage_img, core_img, cancel=cancel,
+                                        levels=(shadows, highlights, invert))
+        if mask is None:
+            return None
+        if garbage_img or core_img:
+            print(f"Tiles: {stats['tiles']}, skipped by garbage matte: {stats['garbage_skipped']}, "
+                  f"by core matte: {stats['core_skipped']}")
+
+        # 7b. Matte refinement (choke / grow / feather / blur)
+        if refine and not mask_only:
+            mask = refine_alpha(mask, **refine)
+
+        # 8. Output Composition
+        if mask_only:
+            opaque = Image.new("L", img.size, 255)
+            return Image.merge("RGBA", (mask, mask, mask, opaque))
+
+        # The shader does: col *= mask.
+        # Since we are outputting RGBA, we multiply the Alpha channel. The mask
+        # is already quantized, so partial-alpha pixels can end up 1 below
+        # int(a * mask) of the float mask; opaque pixels match it exactly.
+        img.putalpha(ImageChops.multiply(img.getchannel("A"), mask))
+        return img
+
+_frame_mask = [bytearray()]
+
+def chromakey_frame(img, buf, color, lower, upper, shadows=100.0, highlights=100.0,
+                    invert=False, mask_only=False, garbage_img=None, core_img=None, refine=None):
     """
-    Converts CIE XYZ to Lab using the shader constants.
-    vec4 CIExyz_to_Lab(vec4 CIE)
+    Keys a streamed RGBA frame in place: `buf` is the raw frame and `img` a
+    read-only image view of it. The mask buffer is reused between frames.
+    Mattes need the tiled image path, so with those a keyed copy is
+    returned instead (see stream.stream_frames).
     """
-    l_val = 116.0 * func_lab(y / Yn) - 16.0
-    a_val = 500.0 * (func_lab(x / Xn) - func_lab(y / Yn))
-    b_val = 200.0 * (func_lab(y / Yn) - func_lab(z / Zn))
-    return l_val, a_val, b_val
+    if garbage_img or core_img:
+        return chromakey_image(img.copy(), color, lower, upper, shadows, highlights, invert, mask_only,
+                               garbage_img, core_img, refine)
+
+    with span('chroma', size=list(img.size)):
+        k_lab = key_lab_set(color)
+        levels = (shadows, highlights, invert)
+        pixels = img.width * img.height
+        if len(_frame_mask[0]) != pixels:
+            _frame_mask[0] = bytearray(pixels)
+        mask = current().key_mask(buf, k_lab, lower, upper, cache=mask_cache(k_lab, lower, upper, levels),
+                                  levels=levels, out=_frame_mask[0])
+
+        if refine and not mask_only:
+            view = Image.frombuffer("L", img.size, mask, "raw", "L", 0, 1)
+            refined = refine_alpha(view, **refine)
+            if refined is not view:
+                mask = refined.tobytes()
+
+        if mask_only:
+            mask_rgba(mask, out=buf)
+        else:
+            multiply_alpha(buf, mask, out=buf)
 
-def get_lab_color(r, g, b):
-    """Composite helper to go straight from sRGB to Lab"""
-    # 1. Linearize
-    lin_r = linearize_srgb(r)
-    lin_g = linearize_srgb(g)
-    lin_b = linearize_srgb(b)
-    # 2. To XYZ
-    x, y, z = rgb_to_xyz(lin_r, lin_g, lin_b)
-    # 3. To Lab
-    return xyz_to_lab(x, y, z)
+def key_colors(img, args):
+    """The key colors given by --color, --key and --auto-keys for an image."""
+    colors = [args.color] + list(args.key or [])
+    if args.auto_keys:
+        colors += sample_border_keys(img, args.auto_keys)
+    return colors
+
+def chroma_stage(img, args):
+    """Runs the chroma key on an in-memory RGBA image using parsed CLI options."""
+    garbage_img = load_matte(args.garbage_matte, "Garbage Matte")
+    core_img = load_matte(args.core_matte, "Core Matte")
+
+    width, height = img.size
+    print(f"Processing {width}x{height} pixels with the {current().name} backend. Please wait...")
+
+    colors = key_colors(img, args)
+    if len(colors) > 1:
+        keys = key_lab_set(colors)
+        print(f"Keying against {len(keys) if is_key_set(keys) else 1} key color(s) "
+              f"({len(colors)} given): {', '.join(colors)}")
+
+    return chromakey_image(
+        img, colors, args.lower, args.upper, args.shadows, args.highlights,
+        args.invert, args.mask_only, garbage_img, core_img, refine_args(args)
+    )
 
 def process_chromakey(args):
     print(f"Opening {args.input}...")
     try:
-        img = Image.open(args.input).convert("RGBA")
+        with span('decode'):
+            img = Image.open(args.input).convert("RGBA")
     except Exception as e:
         print(f"Error: {e}")
         sys.exit(1)
 
-    # Prepare Garbage/Core mattes if they exist
-    garbage_img = None
-    core_img = None
-    
-    if args.garbage_matte:
-        try:
-            garbage_img = Image.open(args.garbage_matte).convert("L").resize(img.size)
-            print("Loaded Garbage Matte.")
-        except:
-            print("Warning: Could not load Garbage Matte.")
-
-    if args.core_matte:
-        try:
-            core_img = Image.open(args.core_matte).convert("L").resize(img.size)
-            print("Loaded Core Matte.")
-        except:
-            print("Warning: Could not load Core Matte.")
-
-    # Parse Key Color
-    # ImageColor.getrgb returns (r, g, b) 0-255
-    key_rgb_255 = ImageColor.getrgb(args.color)
-    # Convert Key to Lab immediately (0.0 - 1.0 input)
-    key_lab = get_lab_color(key_rgb_255[0]/255.0, key_rgb_255[1]/255.0, key_rgb_255[2]/255.0)
+    img = chroma_stage(img, args)
 
-    width, height = img.size
-    pixels = img.load()
-    
-    # Access for mattes if they exist
-    garbage_pixels = garbage_img.load() if garbage_img else None
-    core_pixels = core_img.load() if core_img else None
-
-    print(f"Processing {width}x{height} pixels. Please wait...")
-
-    # Main Loop
-    for x in range(width):
-        for y in range(height):
-            # Get Source pixel
-            r255, g255, b255, a255 = pixels[x, y]
-
-            # Normalize to 0.0 - 1.0
-            r, g, b, a = r255/255.0, g255/255.0, b255/255.0, a255/255.0
-
-            # 1. Un-premultiply Alpha (Shader logic)
-            # if (unassoc.a > 0) { unassoc.rgb /= unassoc.a; }
-            if a > 0:
-                r_unassoc = r / a
-                g_unassoc = g / a
-                b_unassoc = b / a
-            else:
-                r_unassoc, g_unassoc, b_unassoc = r, g, b
-
-            # 2. Convert Pixel to Lab
-            pixel_lab = get_lab_color(r_unassoc, g_unassoc, b_unassoc)
-
-            # 3. Calculate Distance (Euclidean in Lab space)
-            # float colorclose(...)
-            # temp = sqrt(((key.g-col.g)^2) + ((key.b-col.b)^2) + ((key.r-col.r)^2));
-            # Note: Lab map: L=x, a=y, b=z in tuple
-            diff_L = key_lab[0] - pixel_lab[0]
-            diff_a = key_lab[1] - pixel_lab[1]
-            diff_b = key_lab[2] - pixel_lab[2]
-            
-            dist = math.sqrt(diff_L**2 + diff_a**2 + diff_b**2)
-
-            # 4. Calculate Mask based on tolerance
-            # if (temp < tola) return 0.0
-            # if (temp < tolb) return (temp-tola)/(tolb-tola)
-            mask = 1.0
-            if dist < args.lower:
-                mask = 0.0
-            elif dist < args.upper:
-                mask = (dist - args.lower) / (args.upper - args.lower)
-            
-            # Clamp mask
-            mask = max(0.0, min(1.0, mask))
-
-            # 5. Apply Mattes
-            if garbage_pixels:
-                # Garbage removes from mask (assumes white in matte = garbage)
-                g_val = garbage_pixels[x, y] / 255.0
-                mask -= g_val
-                mask = max(0.0, min(1.0, mask))
-            
-            if core_pixels:
-                # Core adds to mask (assumes white in matte = keep)
-                c_val = core_pixels[x, y] / 255.0
-                mask += c_val
-                mask = max(0.0, min(1.0, mask))
-
-            # 6. Highlights / Shadows (Levels adjustments)
-            # mask = shadows * 0.01 * (highlights * 0.01 * mask - 1.0) + 1.0
-            # Note: Input args are typically 0-100 floats
-            mask = args.shadows * 0.01 * (args.highlights * 0.01 * mask - 1.0) + 1.0
-            mask = max(0.0, min(1.0, mask))
-
-            # 7. Invert
-            if args.invert:
-                mask = 1.0 - mask
-
-            # 8. Output Composition
-            if args.mask_only:
-                val = int(mask * 255)
-                pixels[x, y] = (val, val, val, 255)
-            else:
-                # Apply mask to original alpha
-                # The shader does: col *= mask. 
-                # Since we are outputting RGBA, we multiply the Alpha channel.
-                new_a = int(a255 * mask)
-                pixels[x, y] = (r255, g255, b255, new_a)
-
-    print(f"Saving to {args.output}...")
-    img.save(args.output)
+    # A mask-only result is written as a single gray channel
+    save_output(img, args.output, args, mask_only=args.mask_only)
     print("Done.")
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Chroma Key Tool (Olive Editor Logic)")
-    
-    parser.add_argument("input", help="Input image path")
-    parser.add_argument("output", help="Output image path")
-    
+def check_chroma_args(args):
+    """
+    Raises ValueError for --mask-only with matte refinement: like the keying
+    tool, the mask view shows the unrefined key mask.
+    """
+    if args.mask_only and any(value > 0 for value in refine_args(args).values()):
+        raise ValueError("--mask-only writes the unrefined key mask; "
+                         "drop --choke/--grow/--feather/--blur or --mask-only")
+
+def add_chroma_arguments(parser):
+    """Adds the chroma key options (everything except input/output) to a parser."""
     parser.add_argument("-c", "--color", default="#00FF00", 
                         help="Key color in Hex (e.g. #00FF00 or #0000FF). Default Green.")
+    parser.add_argument("--key", action="append", metavar="COLOR",
+                        help="Additional key color for unevenly lit screens; repeatable. "
+                             "The mask uses the distance to the nearest key.")
+    parser.add_argument("--auto-keys", type=int, default=0, metavar="N",
+                        help="Also sample up to N key colors from the image border")
 
     parser.add_argument("--lower", type=float, default=5.0, 
                         help="Lower Tolerance (Clip Black). Distance below this is fully transparent.")
@@ -207,8 +365,47 @@ if __name__ == "__main__":
     parser.add_argument("--garbage-matte", help="Path to garbage matte image (removes from result)")
     parser.add_argument("--core-matte", help="Path to core matte image (keeps in result)")
 
-    parser.add_argument("--mask-only", action="store_true", help="Output grayscale mask only")
+    parser.add_argument("--mask-only", action="store_true",
+                        help="Output grayscale mask only (the unrefined key mask; "
+                             "cannot be combined with matte refinement)")
     parser.add_argument("--invert", action="store_true", help="Invert the final mask")
 
+    add_refine_arguments(parser)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chroma Key Tool (Olive Editor Logic)")
+    
+    parser.add_argument("input", help="Input image path ('-' for raw RGBA frames on stdin)")
+    parser.add_argument("output", help="Output image path ('-' for raw RGBA frames on stdout)")
+    
+    add_chroma_arguments(parser)
+    add_backend_arguments(parser)
+    add_cache_arguments(parser)
+    add_watch_arguments(parser)
+    add_stream_arguments(parser)
+    add_export_arguments(parser)
+    add_trace_arguments(parser)
+    add_profile_arguments(parser)
+
     args = parser.parse_args()
-    process_chromakey(args)
\ No newline at end of file
+    try:
+        check_chroma_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+    apply_backend_args(args)
+    apply_trace_args(args)
+    apply_profile_args(args)
+    run = lambda: run_cached('chroma_key', args, lambda: process_chromakey(args))
+    with profile_cli(args):
+        if is_stream(args):
+            # Mattes are loaded once for the whole stream; stdout carries only frame data
+            with contextlib.redirect_stdout(sys.stderr):
+                garbage_img = load_matte(args.garbage_matte, "Garbage Matte")
+                core_img = load_matte(args.core_matte, "Core Matte")
+            run_stream(args, lambda img, buf: chromakey_frame(
+                img, buf, key_colors(img, args), args.lower, args.upper, args.shadows, args.highlights,
+                args.invert, args.mask_only, garbage_img, core_img, refine_args(args)))
+        elif args.watch:
+            watch_cli(args, run)
+        else:
+            run()
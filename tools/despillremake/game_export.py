@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+import re
+import sys
+from PIL import Image
+
+from export import COMPRESSION_PROFILES, DEFAULT_COMPRESSION, format_size, save_image
+from timing import add_trace_arguments, apply_trace_args, span
+
+# ==========================================
+# GAME-READY TEXTURE EXPORT
+# ==========================================
+# Usage:
+#   python game_export.py discord_button_.png -o export --size 15.5% --size 50%
+#   python game_export.py keyed/*.png -o export --size 512 --size 256 --premultiply
+#   python pipeline.py in.png out.png chroma --color "#5fb356" --variant 320x90
+#
+# For each keyed image:
+#   1. trims the fully transparent border (alpha <= --trim-threshold), keeping
+#      --trim-pad pixels so bilinear filtering does not bleed into the edge,
+#      and records where the trimmed rectangle sat in the original
+#   2. writes one variant per --size, downscaled with Lanczos (Pillow resizes
+#      RGBA in premultiplied space, so edges pick up no dark or keyed fringe)
+#      and never upscaled; without --size the trimmed full size is written
+#   3. optionally premultiplies the colors by alpha (the Godot material then
+#      needs blend_mode premul_alpha)
+#   4. writes NAME.variants.json describing the source, the trim offsets and
+#      every variant
+#
+# Sizes: "W" fits the longest side to W, "WxH" fits inside W x H, "N%" scales
+# the trimmed image. Pick the size the texture is drawn at on screen (e.g. the
+# Discord button is shown at scale 0.155 in node_2d.tscn: --size 15.5%).
+
+SIZE_PATTERN = re.compile(r'^(?:(\d+(?:\.\d+)?)%|(\d+)(?:x(\d+))?)$')
+
+def parse_size(text):
+    """'256', '320x90' or '15.5%' -> ('fit', (w, h)) or ('scale', factor)."""
+    match = SIZE_PATTERN.match(text.strip().lower())
+    if not match:
+        raise ValueError(f"Invalid size '{text}' (use W, WxH or N%)")
+    percent, width, height = match.groups()
+    if percent:
+        factor = float(percent) / 100
+        if factor <= 0:
+            raise ValueError(f"Invalid size '{text}'")
+        return 'scale', factor
+    width = int(width)
+    height = int(height) if height else width
+    if not width or not height:
+        raise ValueError(f"Invalid size '{text}'")
+    return 'fit', (width, height)
+
+def target_size(size, spec):
+    """Pixel size of a variant of an image of `size`; never larger than `size`."""
+    w, h = size
+    kind, value = spec
+    if kind == 'scale':
+        factor = value
+    else:
+        factor = min(value[0] / w, value[1] / h)
+    factor = min(factor, 1.0)
+    return max(1, round(w * factor)), max(1, round(h * factor))
+
+def trim(img, threshold=0, pad=1):
+    """
+    Crops away the border whose alpha is <= `threshold`, keeping `pad`
+    pixels around the content. Returns (image, (left, top, right, bottom)).
+    A fully transparent image is kept as a 1x1 pixel.
+    """
+    alpha = img.getchannel('A')
+    if threshold:
+        alpha = alpha.point(lambda a: 255 if a > threshold else 0)
+    bbox = alpha.getbbox()
+    if bbox is None:
+        bbox = (0, 0, 1, 1)
+    else:
+        left, top, right, bottom = bbox
+        bbox = (max(0, left - pad), max(0, top - pad),
+                min(img.width, right + pad), min(img.height, bottom + pad))
+    if bbox == (0, 0) + img.size:
+        return img, bbox
+    return img.crop(bbox), bbox
+
+def premultiply(img):
+    """RGBA image whose color bands are multiplied by alpha (still labelled RGBA)."""
+    return Image.frombytes('RGBA', img.size, img.convert('RGBa').tobytes())
+
+def export_variants(img, output_path, sizes=(), premultiplied=False, trim_threshold=0,
+                    trim_pad=1, compression=DEFAULT_COMPRESSION, source=None):
+    """
+    Writes the trimmed variants of a keyed RGBA image next to `output_path`
+    (NAME@WxH.EXT) and their metadata to NAME.variants.json.
+    Returns the metadata dict.
+    """
+    base, ext = os.path.splitext(output_path)
+    ext = ext or '.png'
+    with span('trim'):
+        trimmed, bbox = trim(img, trim_threshold, trim_pad)
+
+    specs = [parse_size(s) if isinstance(s, str) else s for s in sizes] or [('scale', 1.0)]
+    variants = []
+    written = set()
+    for spec in specs:
+        size = target_size(trimmed.size, spec)
+        if size in written:
+            continue
+        written.add(size)
+        with span('resize', size=f"{size[0]}x{size[1]}"):
+            variant = trimmed if size == trimmed.size else trimmed.resize(size, Image.Resampling.LANCZOS)
+        if premultiplied:
+            variant = premultiply(variant)
+        path = f"{base}@{size[0]}x{size[1]}{ext}"
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        seconds, num_bytes = save_image(variant, path, compression)
+        variants.append({
+            'file': os.path.basename(path),
+            'width': size[0],
+            'height': size[1],
+            'scale': round(size[0] / trimmed.width, 6),
+            'bytes': num_bytes,
+        })
+        print(f"  {path}: {size[0]}x{size[1]}, {format_size(num_bytes)}, encoded in {seconds:.2f}s")
+
+    meta = {
+        'source': source or os.path.basename(output_path),
+        'source_size': list(img.size),
+        # Where the trimmed rectangle sits in the source: draw a variant at
+        # offset * (variant scale) to line up with the untrimmed image
+        'trim': {'x': bbox[0], 'y': bbox[1], 'width': bbox[2] - bbox[0], 'height': bbox[3] - bbox[1]},
+        'premultiplied': bool(premultiplied),
+        'variants': variants,
+    }
+    with open(base + '.variants.json', 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+# --- CLI helpers ---
+
+def add_trim_arguments(parser):
+    parser.add_argument("--premultiply", action="store_true",
+                        help="Premultiply colors by alpha (use blend_mode premul_alpha in Godot)")
+    parser.add_argument("--trim-threshold", type=int, default=0,
+                        help="Alpha at or below this counts as transparent when trimming (default 0)")
+    parser.add_argument("--trim-pad", type=int, default=1,
+                        help="Transparent pixels kept around the trimmed content (default 1)")
+
+def add_variant_arguments(parser):
+    """Options for writing game-ready variants after keying (pipeline.py)."""
+    parser.add_argument("--variant", action="append", default=[], metavar="SIZE",
+                        help="Also write trimmed variants at this size (W, WxH or N%%); repeatable")
+    add_trim_arguments(parser)
+
+def check_sizes(parser, sizes):
+    for size in sizes:
+        try:
+            parse_size(size)
+        except ValueError as e:
+            parser.error(str(e))
+
+def describe(meta, source_bytes=None):
+    trim_box = meta['trim']
+    total = sum(v['bytes'] for v in meta['variants'])
+    text = (f"{meta['source']}: {meta['source_size'][0]}x{meta['source_size'][1]} trimmed to "
+            f"{trim_box['width']}x{trim_box['height']} at ({trim_box['x']}, {trim_box['y']}), "
+            f"{len(meta['variants'])} variant(s), {format_size(total)}")
+    if source_bytes:
+        text += f" (source {format_size(source_bytes)})"
+    return text
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trim keyed images and write downscaled, game-ready variants")
+    parser.add_argument("inputs", nargs="+", help="Keyed RGBA images")
+    parser.add_argument("-o", "--output-dir", required=True, help="Directory for the variants and metadata")
+    parser.add_argument("--size", action="append", default=[], metavar="SIZE",
+                        help="Variant size: W (longest side), WxH (fit inside) or N%% (scale); repeatable")
+    parser.add_argument("--format", choices=['png', 'webp'], default='png', help="Variant file format")
+    parser.add_argument("--compression", choices=list(COMPRESSION_PROFILES), default=DEFAULT_COMPRESSION,
+                        help="Encode speed vs size (default: balanced)")
+    add_trim_arguments(parser)
+    add_trace_arguments(parser)
+
+    args = parser.parse_args()
+    check_sizes(parser, args.size)
+    apply_trace_args(args)
+
+    failures = 0
+    for src in args.inputs:
+        name = os.path.splitext(os.path.basename(src))[0]
+        try:
+            with span('decode'):
+                img = Image.open(src).convert('RGBA')
+            print(f"Exporting {src}...")
+            meta = export_variants(img, os.path.join(args.output_dir, f"{name}.{args.format}"),
+                                   args.size, args.premultiply, args.trim_threshold, args.trim_pad,
+                                   args.compression, source=os.path.basename(src))
+            print(describe(meta, os.path.getsize(src)))
+        except Exception as e:
+            print(f"  FAILED {src}: {e}")
+            failures += 1
+    sys.exit(1 if failures else 0)
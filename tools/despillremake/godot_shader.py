@@ -0,0 +1,445 @@
+import argparse
+import itertools
+import math
+import sys
+from PIL import Image, ImageColor
+
+import backends
+import pipeline
+from batch import load_preset
+from chroma_key import key_lab_set
+from keying_core import (DELTA_2, DELTA_3, LUMA_COEFF_B, LUMA_COEFF_G, LUMA_COEFF_R, Xn, Yn, Zn, is_key_set,
+                         key_to_lab)
+
+# ==========================================
+# GODOT SHADER EXPORT (runtime keying)
+# ==========================================
+# Usage:
+#   python godot_shader.py --preset intro.json -o keying.gdshader
+#   python godot_shader.py --preset intro.json --check-only
+#
+# Writes a canvas_item .gdshader that keys at draw time with the settings of
+# a get_params()-style preset (or the keying tool's current settings): chroma
+# key (key Lab, tolerances, shadows/highlights, invert, mask only), alpha
+# extraction and despill. Put it on the material of the TextureRect or
+# VideoStreamPlayer showing the video instead of pre-rendering keyed frames.
+# The settings become uniform defaults, so they can still be tweaked in the
+# inspector.
+#
+# Matte refinement (choke/grow/feather/blur) needs neighbouring pixels and is
+# not part of the shader; it is reported when the preset uses it.
+#
+# Self-check: shade() below is a line-by-line Python transcription of the
+# shader's fragment(). Before writing, it runs on sample colors (an RGB grid,
+# colors around the key and partly transparent pixels) next to the offline
+# pipeline with the reference backend; the export fails if any channel differs
+# by more than --tolerance (0-255). The offline path quantizes the mask to a
+# byte before multiplying alpha, the shader does not, so 1-2 levels of
+# difference are expected.
+
+DESPILL_METHOD_IDS = {'average': 0, 'double_red': 1, 'double_average': 2, 'limit': 3}
+DEFAULT_TOLERANCE = 2
+
+def shader_uniforms(params):
+    """Uniform values of the shader for a get_params()-style dict."""
+    params = pipeline.resolve_params(params)
+    mode = params['mode']
+    mask_only = pipeline.shows_mask(params)
+    key_rgb = ImageColor.getrgb(params['ck_color'])[:3]
+    # The key color stays the key_lab uniform (the one to tweak in the inspector);
+    # key_set() keeps the first of near-duplicates, so it is in `keys` as is
+    key_lab = tuple(float(v) for v in key_to_lab(key_rgb))
+    keys = key_lab_set([params['ck_color']] + list(params['ck_keys']))
+    keys = keys if is_key_set(keys) else (keys,)
+    return {
+        'apply_chroma': mode == 'Chroma' and params['apply_chroma'],
+        'key_lab': key_lab,
+        # Not a uniform: written into the shader as the EXTRA_KEYS constant
+        'extra_keys': tuple(key for key in keys if key != key_lab),
+        'lower_tolerance': float(params['ck_low']),
+        'upper_tolerance': float(params['ck_high']),
+        'shadows': float(params['ck_shadow']),
+        'highlights': float(params['ck_highlight']),
+        'invert': bool(params['ck_invert']),
+        'mask_only': bool(mask_only),
+        'apply_alpha_extract': (mode == 'Chroma' and params['apply_alpha'] and not mask_only)
+                               or (mode == 'AlphaExtract' and params['ae_enabled']),
+        'alpha_green_screen': key_rgb[1] >= key_rgb[2],
+        'bg_brightness': max(params['ae_brightness'] / 255.0, 0.01),
+        'edge_softness': params['ae_softness'] / 100.0,
+        'apply_despill': (mode == 'Chroma' and params['apply_despill'] and not mask_only) or mode == 'Despill',
+        'despill_green_screen': params['ds_color'].lower() == 'green',
+        'despill_method': DESPILL_METHOD_IDS[pipeline.DESPILL_METHODS[params['ds_method']]],
+        'preserve_luminance': bool(params['ds_luma']),
+    }
+
+def unsupported(params):
+    """Names of settings the shader cannot reproduce."""
+    params = pipeline.resolve_params(params)
+    if params['mode'] == 'Despill' or pipeline.shows_mask(params):
+        return []
+    return [name for name in ('mt_choke', 'mt_grow', 'mt_feather', 'mt_blur') if params[name]]
+
+# --- Shader source ---
+
+def glsl_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, tuple):
+        return f"vec3({', '.join(glsl_value(float(v)) for v in value)})"
+    return repr(float(value))
+
+UNIFORM_DECLARATIONS = [
+    ('apply_chroma', 'bool', None),
+    ('key_lab', 'vec3', 'Lab of the key color'),
+    ('lower_tolerance', 'float', 'Lab distance below which a pixel is fully keyed'),
+    ('upper_tolerance', 'float', 'Lab distance above which a pixel is fully kept'),
+    ('shadows', 'float', None),
+    ('highlights', 'float', None),
+    ('invert', 'bool', None),
+    ('mask_only', 'bool', 'Show the key mask as gray'),
+    ('apply_alpha_extract', 'bool', None),
+    ('alpha_green_screen', 'bool', None),
+    ('bg_brightness', 'float', 'Key channel of a clean screen area, 0-1'),
+    ('edge_softness', 'float', '0 (hard) to 1 (soft)'),
+    ('apply_despill', 'bool', None),
+    ('despill_green_screen', 'bool', None),
+    ('despill_method', 'int', '0 average, 1 double red, 2 double average, 3 limit'),
+    ('preserve_luminance', 'bool', None),
+]
+
+SHADER_BODY = """
+const float Xn = %(Xn)r;
+const float Yn = %(Yn)r;
+const float Zn = %(Zn)r;
+const float DELTA_2 = %(DELTA_2)r;
+const float DELTA_3 = %(DELTA_3)r;
+const vec3 LUMA_COEFFS = vec3(%(LUMA_R)r, %(LUMA_G)r, %(LUMA_B)r);
+
+float linearize_srgb(float v) {
+	return v <= 0.04045 ? v / 12.92 : pow((v + 0.055) / 1.055, 2.4);
+}
+
+float func_lab(float t) {
+	return t > DELTA_3 ? pow(t, 1.0 / 3.0) : t / (3.0 * DELTA_2) + 4.0 / 29.0;
+}
+
+vec3 srgb_to_lab(vec3 c) {
+	vec3 lin = vec3(linearize_srgb(c.r), linearize_srgb(c.g), linearize_srgb(c.b));
+	float x = (lin.r * 0.4124 + lin.g * 0.3576 + lin.b * 0.1805) * 100.0;
+	float y = (lin.r * 0.2126 + lin.g * 0.7152 + lin.b * 0.0722) * 100.0;
+	float z = (lin.r * 0.0193 + lin.g * 0.1192 + lin.b * 0.9505) * 100.0;
+	return vec3(116.0 * func_lab(y / Yn) - 16.0,
+	            500.0 * (func_lab(x / Xn) - func_lab(y / Yn)),
+	            200.0 * (func_lab(y / Yn) - func_lab(z / Zn)));
+}
+
+float key_mask(vec4 c) {
+	vec3 rgb = c.a > 0.0 ? c.rgb / c.a : c.rgb;
+	vec3 lab = srgb_to_lab(rgb);
+	float dist = distance(key_lab, lab);
+%%(extra_key_loop)s	float mask = 1.0;
+	if (dist < lower_tolerance) {
+		mask = 0.0;
+	} else if (dist < upper_tolerance) {
+		mask = (dist - lower_tolerance) / (upper_tolerance - lower_tolerance);
+	}
+	mask = clamp(mask, 0.0, 1.0);
+	mask = clamp(shadows * 0.01 * (highlights * 0.01 * mask - 1.0) + 1.0, 0.0, 1.0);
+	return invert ? 1.0 - mask : mask;
+}
+
+vec4 alpha_extract(vec4 c) {
+	float key_channel = alpha_green_screen ? c.g : c.b;
+	float other = alpha_green_screen ? max(c.r, c.b) : max(c.r, c.g);
+	if (!(key_channel > other + 0.05 && key_channel > 0.1)) {
+		return c;
+	}
+	float raw_alpha = 1.0 - key_channel / bg_brightness;
+	if (edge_softness > 0.0 && raw_alpha > 0.0 && raw_alpha < 1.0) {
+		raw_alpha = pow(raw_alpha, 1.0 / (1.0 + edge_softness));
+	}
+	raw_alpha = clamp(raw_alpha, 0.0, 1.0);
+	vec3 fg = vec3(0.0);
+	if (raw_alpha > 0.01) {
+		float unmixed = clamp((key_channel - (1.0 - raw_alpha) * bg_brightness) / raw_alpha, 0.0, 1.0);
+		fg = alpha_green_screen ? vec3(c.r, unmixed, c.b) : vec3(c.r, c.g, unmixed);
+	}
+	return vec4(fg, raw_alpha * c.a);
+}
+
+vec3 despill(vec3 c) {
+	vec3 orig = c;
+	if (despill_green_screen) {
+		float limit = c.b;
+		if (despill_method == 0) { limit = (c.r + c.b) / 2.0; }
+		else if (despill_method == 1) { limit = (2.0 * c.r + c.b) / 3.0; }
+		else if (despill_method == 2) { limit = (2.0 * c.b + c.r) / 3.0; }
+		c.g = min(c.g, limit);
+	} else {
+		float limit = c.g;
+		if (despill_method == 0) { limit = (c.r + c.g) / 2.0; }
+		else if (despill_method == 1) { limit = (2.0 * c.r + c.g) / 3.0; }
+		else if (despill_method == 2) { limit = (2.0 * c.g + c.r) / 3.0; }
+		c.b = min(c.b, limit);
+	}
+	if (preserve_luminance) {
+		c += dot(abs(orig - c), LUMA_COEFFS);
+	}
+	return clamp(c, 0.0, 1.0);
+}
+
+void fragment() {
+	vec4 c = texture(TEXTURE, UV);
+	bool show_mask = false;
+	if (apply_chroma) {
+		float mask = key_mask(c);
+		if (mask_only) {
+			c = vec4(vec3(mask), 1.0);
+			show_mask = true;
+		} else {
+			c.a *= mask;
+		}
+	}
+	if (apply_alpha_extract && !show_mask) {
+		c = alpha_extract(c);
+	}
+	if (apply_despill && !show_mask) {
+		c.rgb = despill(c.rgb);
+	}
+	COLOR = c;
+}
+""" % {'Xn': Xn, 'Yn': Yn, 'Zn': Zn, 'DELTA_2': DELTA_2, 'DELTA_3': DELTA_3,
+       'LUMA_R': LUMA_COEFF_R, 'LUMA_G': LUMA_COEFF_G, 'LUMA_B': LUMA_COEFF_B}
+
+# Distance to the nearest of several key colors (only emitted with ck_keys)
+EXTRA_KEY_LOOP = """\
+	for (int i = 0; i < EXTRA_KEY_COUNT; i++) {
+		dist = min(dist, distance(EXTRA_KEYS[i], lab));
+	}
+"""
+
+def shader_source(params, title=''):
+    """The .gdshader text for a get_params()-style dict."""
+    uniforms = shader_uniforms(params)
+    lines = [
+        "shader_type canvas_item;",
+        "",
+        "// Runtime keying generated by godot_shader.py" + (f" from {title}" if title else "") + ".",
+        "// Same math as keying_core.py; regenerate rather than edit.",
+    ]
+    skipped = unsupported(params)
+    if skipped:
+        lines.append(f"// Not reproduced (needs neighbouring pixels): {', '.join(skipped)}")
+    lines.append("")
+    for name, kind, comment in UNIFORM_DECLARATIONS:
+        line = f"uniform {kind} {name} = {glsl_value(uniforms[name])};"
+        lines.append(line + (f" // {comment}" if comment else ""))
+    extra_keys = uniforms['extra_keys']
+    if extra_keys:
+        lines += ["",
+                  "// Lab of the other key colors (ck_keys); a pixel is keyed by the nearest one",
+                  f"const int EXTRA_KEY_COUNT = {len(extra_keys)};",
+                  f"const vec3 EXTRA_KEYS[{len(extra_keys)}] = {{{', '.join(glsl_value(k) for k in extra_keys)}}};"]
+    return "\n".join(lines) + "\n" + SHADER_BODY % {'extra_key_loop': EXTRA_KEY_LOOP if extra_keys else ''}
+
+# --- Python transcription of fragment() ---
+
+def _linearize(v):
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+def _func_lab(t):
+    return t ** (1.0 / 3.0) if t > DELTA_3 else t / (3.0 * DELTA_2) + 4.0 / 29.0
+
+def _srgb_to_lab(r, g, b):
+    r, g, b = _linearize(r), _linearize(g), _linearize(b)
+    x = (r * 0.4124 + g * 0.3576 + b * 0.1805) * 100.0
+    y = (r * 0.2126 + g * 0.7152 + b * 0.0722) * 100.0
+    z = (r * 0.0193 + g * 0.1192 + b * 0.9505) * 100.0
+    return (116.0 * _func_lab(y / Yn) - 16.0,
+            500.0 * (_func_lab(x / Xn) - _func_lab(y / Yn)),
+            200.0 * (_func_lab(y / Yn) - _func_lab(z / Zn)))
+
+def _clamp(v):
+    return max(0.0, min(1.0, v))
+
+def _key_mask(c, u):
+    r, g, b, a = c
+    if a > 0.0:
+        r, g, b = r / a, g / a, b / a
+    lab = _srgb_to_lab(r, g, b)
+    dist = min(math.dist(key, lab) for key in (u['key_lab'],) + u['extra_keys'])
+    mask = 1.0
+    if dist < u['lower_tolerance']:
+        mask = 0.0
+    elif dist < u['upper_tolerance']:
+        mask = (dist - u['lower_tolerance']) / (u['upper_tolerance'] - u['lower_tolerance'])
+    mask = _clamp(mask)
+    mask = _clamp(u['shadows'] * 0.01 * (u['highlights'] * 0.01 * mask - 1.0) + 1.0)
+    return 1.0 - mask if u['invert'] else mask
+
+def _alpha_extract(c, u):
+    r, g, b, a = c
+    green = u['alpha_green_screen']
+    key_channel = g if green else b
+    other = max(r, b) if green else max(r, g)
+    if not (key_channel > other + 0.05 and key_channel > 0.1):
+        return c
+    raw_alpha = 1.0 - key_channel / u['bg_brightness']
+    if u['edge_softness'] > 0.0 and 0.0 < raw_alpha < 1.0:
+        raw_alpha = raw_alpha ** (1.0 / (1.0 + u['edge_softness']))
+    raw_alpha = _clamp(raw_alpha)
+    fg = (0.0, 0.0, 0.0)
+    if raw_alpha > 0.01:
+        unmixed = _clamp((key_channel - (1.0 - raw_alpha) * u['bg_brightness']) / raw_alpha)
+        fg = (r, unmixed, b) if green else (r, g, unmixed)
+    return fg + (raw_alpha * a,)
+
+def _despill(rgb, u):
+    r, g, b = rgb
+    orig = rgb
+    method = u['despill_method']
+    if u['despill_green_screen']:
+        limit = b
+        if method == 0:
+            limit = (r + b) / 2.0
+        elif method == 1:
+            limit = (2.0 * r + b) / 3.0
+        elif method == 2:
+            limit = (2.0 * b + r) / 3.0
+        g = min(g, limit)
+    else:
+        limit = g
+        if method == 0:
+            limit = (r + g) / 2.0
+        elif method == 1:
+            limit = (2.0 * r + g) / 3.0
+        elif method == 2:
+            limit = (2.0 * g + r) / 3.0
+        b = min(b, limit)
+    if u['preserve_luminance']:
+        luma = (abs(orig[0] - r) * LUMA_COEFF_R + abs(orig[1] - g) * LUMA_COEFF_G
+                + abs(orig[2] - b) * LUMA_COEFF_B)
+        r, g, b = r + luma, g + luma, b + luma
+    return _clamp(r), _clamp(g), _clamp(b)
+
+def shade(c, u):
+    """fragment() for one 0-1 (r, g, b, a) color with uniforms `u`."""
+    show_mask = False
+    if u['apply_chroma']:
+        mask = _key_mask(c, u)
+        if u['mask_only']:
+            c = (mask, mask, mask, 1.0)
+            show_mask = True
+        else:
+            c = c[:3] + (c[3] * mask,)
+    if u['apply_alpha_extract'] and not show_mask:
+        c = _alpha_extract(c, u)
+    if u['apply_despill'] and not show_mask:
+        c = _despill(c[:3], u) + (c[3],)
+    return c
+
+# --- Self-check ---
+
+def sample_colors(params, steps=9):
+    """RGBA test colors: an RGB grid, colors around the key and partly transparent pixels."""
+    colors = []
+    levels = [round(i * 255 / (steps - 1)) for i in range(steps)]
+    colors += [(r, g, b, 255) for r in levels for g in levels for b in levels]
+    params = pipeline.resolve_params(params)
+    key = ImageColor.getrgb(params['ck_color'])[:3]
+    for dr in range(-40, 41, 8):
+        for dg in range(-40, 41, 8):
+            for db in range(-40, 41, 20):
+                colors.append(tuple(max(0, min(255, k + d)) for k, d in zip(key, (dr, dg, db))) + (255,))
+    for extra in params['ck_keys']:
+        key = ImageColor.getrgb(extra)[:3]
+        for delta in itertools.product(range(-24, 25, 12), repeat=3):
+            colors.append(tuple(max(0, min(255, k + d)) for k, d in zip(key, delta)) + (255,))
+    colors += [(r, g, b, a) for r in (0, 128, 255) for g in (0, 200, 255) for b in (0, 128)
+               for a in (0, 64, 191)]
+    return colors
+
+def self_check(params, tolerance=DEFAULT_TOLERANCE, verbose=True):
+    """
+    Compares shade() with the offline pipeline (reference backend, without
+    matte refinement) on sample colors. Returns (passed, worst error, worst
+    sample) with errors in 0-255 levels.
+    """
+    params = pipeline.resolve_params(params)
+    offline_params = dict(params, mt_choke=0, mt_grow=0, mt_feather=0.0, mt_blur=0.0)
+    uniforms = shader_uniforms(params)
+    colors = sample_colors(params)
+
+    img = Image.new('RGBA', (len(colors), 1))
+    img.putdata(colors)
+    previous = backends.current()
+    backends.set_backend('reference')
+    try:
+        data = pipeline.process_params(img, offline_params).tobytes()
+    finally:
+        backends.set_backend(previous.name)
+    expected = [tuple(data[i:i + 4]) for i in range(0, len(data), 4)]
+
+    shaded = [shade(tuple(v / 255.0 for v in color), uniforms) for color in colors]
+    actual = [tuple(round(v * 255) for v in c) for c in shaded]
+    stats = backends.channel_errors(data, bytes(v for px in actual for v in px), 4)
+
+    worst, worst_sample = 0, None
+    for color, e, a in zip(colors, expected, actual):
+        # Color under a fully transparent pixel is not visible
+        err = abs(e[3] - a[3]) if e[3] == 0 and a[3] == 0 else max(abs(x - y) for x, y in zip(e, a))
+        if err > worst:
+            worst, worst_sample = err, (color, e, a)
+
+    if verbose:
+        print(f"Self-check on {len(colors)} sample colors: "
+              + "  ".join(f"{c} max {m:3d} mean {avg:.4f}" for c, (m, avg) in zip('RGBA', stats)))
+        if worst_sample:
+            color, e, a = worst_sample
+            print(f"  worst visible difference {worst}: input {color}, offline {e}, shader {a}")
+    return worst <= tolerance, worst, worst_sample
+
+def export_shader(params, path, title='', tolerance=DEFAULT_TOLERANCE):
+    """
+    Self-checks and writes the shader for `params`. Returns (passed, worst
+    error); nothing is written when the check fails.
+    """
+    passed, worst, _ = self_check(params, tolerance)
+    if passed:
+        with open(path, 'w', encoding='utf-8', newline='\n') as f:
+            f.write(shader_source(params, title))
+    return passed, worst
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export keying settings as a Godot canvas_item shader")
+    parser.add_argument("--preset", help="get_params()-style JSON/TOML preset (default: the keying tool defaults)")
+    parser.add_argument("-o", "--output", help="Output .gdshader path")
+    parser.add_argument("--tolerance", type=int, default=DEFAULT_TOLERANCE,
+                        help=f"Max difference from the offline result, 0-255 (default {DEFAULT_TOLERANCE})")
+    parser.add_argument("--check-only", action="store_true", help="Run the self-check without writing")
+
+    args = parser.parse_args()
+    if not args.output and not args.check_only:
+        parser.error("Give -o/--output or --check-only")
+    try:
+        params = load_preset(args.preset)
+    except (OSError, ValueError) as e:
+        print(f"Error loading preset: {e}")
+        sys.exit(1)
+
+    skipped = unsupported(params)
+    if skipped:
+        print(f"Warning: the shader does not reproduce {', '.join(skipped)} (matte refinement)")
+    if args.check_only:
+        passed = self_check(params, args.tolerance)[0]
+    else:
+        passed, worst = export_shader(params, args.output, args.preset or '', args.tolerance)
+        if passed:
+            print(f"Wrote {args.output}")
+    if not passed:
+        print(f"Self-check FAILED: shader and offline results differ by more than {args.tolerance}")
+        sys.exit(1)
+    print("Self-check passed.")
@@ -0,0 +1,223 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+import preview
+from timing import instant, span
+
+# ==========================================
+# MULTI-IMAGE SESSION (prefetch + LRU)
+# ==========================================
+# The keying tool's list of open images (several dropped files, a folder).
+# Every image keeps its own decoded source, preview copy, eraser mask, the
+# settings it was last keyed with and its last keyed preview, so stepping
+# back to it shows it again without decoding or keying anything.
+#
+# While the user looks at one image, a background thread decodes the next
+# and previous ones (--prefetch each way) and keys their previews with the
+# current settings, so stepping through a folder of button assets is
+# instant. Prefetch work is superseded like preview jobs: a newer prefetch
+# request, or a preview job for the shown image (cancel_prefetch), cancels
+# the keying of an older one part way, so it never competes with the
+# preview the user is waiting for.
+#
+# Loaded images are kept in least-recently-used order under a memory cap
+# (sources, masks and previews); the oldest ones are dropped first, but
+# never the image being shown.
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp')
+DEFAULT_CACHE_MB = 512
+DEFAULT_PREFETCH = 1
+
+def is_image(path):
+    return path.lower().endswith(IMAGE_EXTENSIONS)
+
+def image_paths(paths):
+    """Image files among `paths`, with folders expanded (sorted, not recursive) and duplicates dropped."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found += sorted(os.path.join(path, name) for name in os.listdir(path) if is_image(name))
+        elif is_image(path):
+            found.append(path)
+    seen = set()
+    return [p for p in found if not (os.path.normcase(os.path.abspath(p)) in seen
+                                     or seen.add(os.path.normcase(os.path.abspath(p))))]
+
+class LoadedImage:
+    """One decoded image of the list and the state the tool keeps for it."""
+    def __init__(self, path):
+        self.path = path
+        with span('decode', path=path):
+            self.original = Image.open(path).convert("RGBA")
+        self.preview = preview.make_preview(self.original)
+        self.mask = preview.ManualMask(self.original.size, self.preview.size)
+        self.params = None        # settings chosen for this image (None: follow the tool's)
+        self.keyed = None         # last keyed preview (never a WorkBuffers buffer)
+        self.keyed_params = None  # settings `keyed` was made with
+        self.keyed_edits = 0      # eraser edits included in `keyed`
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    def nbytes(self):
+        """Approximate memory held: RGBA source and previews plus both eraser masks."""
+        full = self.original.width * self.original.height
+        small = self.preview.width * self.preview.height
+        return full * 5 + small * (5 + (4 if self.keyed else 0))
+
+    def keyed_for(self, params):
+        """The cached keyed preview if it matches `params` and the eraser mask, else None."""
+        if self.keyed is not None and self.keyed_params == params and self.keyed_edits == self.mask.edits:
+            return self.keyed
+        return None
+
+    def set_keyed(self, params, keyed):
+        """Caches a keyed preview made with `params` (keyed is copied)."""
+        self.keyed = keyed.copy() if keyed is not None else None
+        self.keyed_params = dict(params) if keyed is not None else None
+        self.keyed_edits = self.mask.edits
+
+class ImageList:
+    """
+    Ordered image paths with one current index. open() returns the current
+    LoadedImage (decoding it if it is not cached or prefetched yet);
+    prefetch() warms its neighbours in the background.
+    """
+    def __init__(self, paths, cache_mb=DEFAULT_CACHE_MB, prefetch=DEFAULT_PREFETCH):
+        self.paths = list(paths)
+        self.index = 0
+        self.cache_bytes = int(cache_mb * 1024 * 1024)
+        self.prefetch_count = prefetch
+        self.lock = threading.Lock()
+        self.loaded = OrderedDict()  # path -> LoadedImage, least recently used first
+        self.loading = {}            # path -> Event set once a background decode finishes
+        self.generation = 0          # bumped by prefetch() / cancel_prefetch() to cancel older work
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+
+    def __len__(self):
+        return len(self.paths)
+
+    @property
+    def current_path(self):
+        return self.paths[self.index] if self.paths else None
+
+    def add(self, paths):
+        """Appends new paths; returns the index of the first of `paths` in the list (or None)."""
+        first = None
+        for path in image_paths(paths):
+            if path not in self.paths:
+                self.paths.append(path)
+            if first is None:
+                first = self.paths.index(path)
+        return first
+
+    def get(self, path):
+        """LoadedImage for `path`, from the cache, a running prefetch, or decoded now."""
+        with self.lock:
+            entry = self.loaded.get(path)
+            if entry is not None:
+                self.loaded.move_to_end(path)
+                return entry
+            decoding = self.loading.get(path)
+        if decoding is not None:
+            # The prefetch thread is decoding it right now: wait instead of decoding twice
+            decoding.wait()
+            with self.lock:
+                entry = self.loaded.get(path)
+        return entry or self.store(path, LoadedImage(path))
+
+    def store(self, path, entry):
+        with self.lock:
+            entry = self.loaded.setdefault(path, entry)
+            self.loaded.move_to_end(path)
+            self.evict()
+        return entry
+
+    def open(self, index):
+        """Makes `index` (wrapped around) current and returns its LoadedImage."""
+        self.index = index % len(self.paths)
+        return self.get(self.paths[self.index])
+
+    def step(self, delta):
+        return self.open(self.index + delta)
+
+    def neighbours(self):
+        """Paths to prefetch around the current image, nearest first (next before previous)."""
+        out = []
+        for distance in range(1, self.prefetch_count + 1):
+            for delta in (distance, -distance):
+                path = self.paths[(self.index + delta) % len(self.paths)]
+                if path != self.current_path and path not in out:
+                    out.append(path)
+        return out
+
+    def prefetch(self, params):
+        """
+        Decodes the neighbours of the current image in the background and keys
+        their previews with `params` (or the settings chosen for that image).
+        Supersedes any earlier prefetch request.
+        """
+        if not self.paths:
+            return
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+        for path in self.neighbours():
+            self.executor.submit(self._prefetch, path, dict(params), generation)
+
+    def cancel_prefetch(self):
+        """Stops queued and running prefetch work (the next prefetch() starts it again)."""
+        with self.lock:
+            self.generation += 1
+
+    def _prefetch(self, path, params, generation):
+        cancel = lambda: self.generation != generation
+        if cancel():
+            return
+        try:
+            with self.lock:
+                entry = self.loaded.get(path)
+                if entry is None:
+                    decoding = self.loading[path] = threading.Event()
+            if entry is None:
+                try:
+                    entry = self.store(path, LoadedImage(path))
+                finally:
+                    with self.lock:
+                        self.loading.pop(path, None)
+                    decoding.set()
+            params = entry.params or params
+            if entry.keyed_for(params) is not None or cancel():
+                return
+            with span('prefetch_key', path=path):
+                keyed = preview.process_job(entry.preview.copy(), params, entry.mask.for_size(entry.preview.size),
+                                            cancel=cancel, refine_scale=entry.preview.width / entry.original.width)
+            if keyed is not None and entry.keyed_for(params) is None:
+                entry.set_keyed(params, keyed)
+                with self.lock:
+                    self.evict()
+        except Exception as e:
+            instant('prefetch_failed', path=path, error=str(e))
+
+    def evict(self):
+        """Drops least recently used images over the memory cap (caller holds the lock)."""
+        total = sum(entry.nbytes() for entry in self.loaded.values())
+        for path in list(self.loaded):
+            if total <= self.cache_bytes:
+                break
+            if path == self.current_path:
+                continue
+            total -= self.loaded.pop(path).nbytes()
+            instant('image_evicted', path=path)
+
+    def memory(self):
+        with self.lock:
+            return len(self.loaded), sum(entry.nbytes() for entry in self.loaded.values())
+
+    def shutdown(self):
+        self.cancel_prefetch()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,307 @@
+import math
+import numpy as np
+from keying_core import (CANCEL_INTERVAL, DELTA_2, DELTA_3, IDENTITY_LEVELS, LUMA_COEFF_B, LUMA_COEFF_G,
+                         LUMA_COEFF_R, Xn, Yn, Zn, is_key_set)
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# ==========================================
+# ARRAY BACKENDS (NumPy, optional Numba JIT)
+# ==========================================
+# Only imported by backends.py when NumPy is installed. Both backends take
+# and return the same raw RGBA buffers as keying_core and repeat its
+# formulas operation for operation in float64, so they agree with the
+# pure-Python reference (`python backends.py verify` checks how closely).
+# Work is done in chunks of CANCEL_INTERVAL pixels, which bounds the
+# temporary arrays and gives `cancel` a chance to run.
+
+METHOD_INDEX = {'average': 0, 'double_red': 1, 'double_average': 2, 'limit': 3}
+
+def _pixels(data):
+    return np.frombuffer(memoryview(data).cast('B'), np.uint8).reshape(-1, 4)
+
+def _chunked(kernel, src, dst, cancel, skip=None):
+    """Runs kernel(src_chunk, dst_chunk[, skip_chunk]) over CANCEL_INTERVAL-pixel chunks."""
+    for start in range(0, len(src), CANCEL_INTERVAL):
+        if cancel is not None and cancel():
+            return False
+        end = start + CANCEL_INTERVAL
+        if skip is None:
+            kernel(src[start:end], dst[start:end])
+        else:
+            kernel(src[start:end], dst[start:end], skip[start:end])
+    return True
+
+def _rgba_op(kernel, data, cancel):
+    src = _pixels(data)
+    out = bytearray(src.size)
+    if not _chunked(kernel, src, _pixels(out), cancel):
+        return None
+    return out
+
+def _mask_op(kernel, data, skip, cancel):
+    src = _pixels(data)
+    out = bytearray(len(src))
+    dst = np.frombuffer(out, np.uint8)
+    skip = np.frombuffer(skip, np.uint8) if skip is not None else None
+    if not _chunked(kernel, src, dst, cancel, skip):
+        return None
+    return out
+
+# --- NumPy ---
+
+def _np_limit(method, x, y):
+    """Despill limit from the two non-key channels (x is red)."""
+    if method == 'average':
+        return (x + y) / 2.0
+    if method == 'double_red':
+        return (2.0 * x + y) / 3.0
+    if method == 'double_average':
+        return (2.0 * y + x) / 3.0
+    return y
+
+def np_despill(data, key_color='green', method='average', preserve_luma=False, cancel=None):
+    def kernel(src, dst):
+        orig_r, orig_g, orig_b = (src[:, c] / 255.0 for c in range(3))
+        r, g, b = orig_r, orig_g, orig_b
+        if key_color == 'green':
+            g = np.minimum(g, _np_limit(method, r, b))
+        elif key_color == 'blue':
+            b = np.minimum(b, _np_limit(method, r, g))
+        if preserve_luma:
+            luma = (np.abs(orig_r - r) * LUMA_COEFF_R) + \
+                   (np.abs(orig_g - g) * LUMA_COEFF_G) + \
+                   (np.abs(orig_b - b) * LUMA_COEFF_B)
+            r, g, b = r + luma, g + luma, b + luma
+        for c, v in enumerate((r, g, b)):
+            dst[:, c] = np.clip(v * 255, 0, 255).astype(np.uint8)
+        dst[:, 3] = src[:, 3]
+    return _rgba_op(kernel, data, cancel)
+
+def np_alpha_extract(data, key_rgb, bg_brightness=255, edge_softness=50.0, cancel=None):
+    is_green = key_rgb[1] >= key_rgb[2]
+    bg_val = max(bg_brightness / 255.0, 0.01)
+    edge_factor = edge_softness / 100.0
+
+    def kernel(src, dst):
+        r, g, b = (src[:, c] / 255.0 for c in range(3))
+        key, other1, other2 = (g, r, b) if is_green else (b, r, g)
+        screen = (key > np.maximum(other1, other2) + 0.05) & (key > 0.1)
+
+        raw_alpha = 1.0 - (key / bg_val)
+        if edge_factor > 0:
+            soft = (raw_alpha > 0) & (raw_alpha < 1)
+            raw_alpha = np.where(soft, np.where(soft, raw_alpha, 0.0) ** (1.0 / (1.0 + edge_factor)), raw_alpha)
+        raw_alpha = np.clip(raw_alpha, 0.0, 1.0)
+
+        solid = raw_alpha > 0.01
+        bg_contribution = (1.0 - raw_alpha) * bg_val
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fg_key = np.clip((key - bg_contribution) / raw_alpha, 0, 1)
+        fg = [r, g, b]
+        fg[1 if is_green else 2] = fg_key
+        final_alpha = (raw_alpha * (src[:, 3] / 255.0) * 255).astype(np.uint8)
+
+        for c in range(3):
+            value = np.where(solid, fg[c], 0.0)
+            dst[:, c] = np.where(screen, (value * 255).astype(np.uint8), src[:, c])
+        dst[:, 3] = np.where(screen, final_alpha, src[:, 3])
+    return _rgba_op(kernel, data, cancel)
+
+def _np_linearize(v):
+    return np.where(v <= 0.04045, v / 12.92, ((v + 0.055) / 1.055) ** 2.4)
+
+def _np_func_lab(t):
+    return np.where(t > DELTA_3, np.maximum(t, 0.0) ** (1.0 / 3.0), (t / (3.0 * DELTA_2)) + (4.0 / 29.0))
+
+def _keys(lab):
+    """Key set (see keying_core.key_set) or single Lab key as a list of keys."""
+    return list(lab) if is_key_set(lab) else [lab]
+
+def np_key_mask(data, lab, lower, upper, skip=None, cache=None, cancel=None, levels=IDENTITY_LEVELS):
+    keys = _keys(lab)
+    shadows, highlights, invert = levels
+
+    def kernel(src, dst, skip_chunk=None):
+        r, g, b, a = (src[:, c] / 255.0 for c in range(4))
+        # 1. Un-premultiply Alpha (Shader logic)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            nz = a > 0
+            r, g, b = (np.where(nz, v / a, v) for v in (r, g, b))
+
+        # 2. Convert Pixel to Lab
+        lr, lg, lb = _np_linearize(r), _np_linearize(g), _np_linearize(b)
+        x = (lr * 0.4124 + lg * 0.3576 + lb * 0.1805) * 100.0
+        y = (lr * 0.2126 + lg * 0.7152 + lb * 0.0722) * 100.0
+        z = (lr * 0.0193 + lg * 0.1192 + lb * 0.9505) * 100.0
+        fx, fy, fz = _np_func_lab(x / Xn), _np_func_lab(y / Yn), _np_func_lab(z / Zn)
+
+        # 3. Euclidean distance to the key (the nearest one of a key set;
+        # each extra key costs a few multiplies, the Lab conversion is shared)
+        p_L, p_a, p_b = 116.0 * fy - 16.0, 500.0 * (fx - fy), 200.0 * (fy - fz)
+        dist2 = None
+        for key in keys:
+            diff_L = key[0] - p_L
+            diff_a = key[1] - p_a
+            diff_b = key[2] - p_b
+            d2 = diff_L * diff_L + diff_a * diff_a + diff_b * diff_b
+            dist2 = d2 if dist2 is None else np.minimum(dist2, d2)
+        dist = np.sqrt(dist2)
+
+        # 4. Mask based on tolerance
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mask = np.where(dist < lower, 0.0, np.where(dist < upper, (dist - lower) / (upper - lower), 1.0))
+        mask = np.clip(mask, 0.0, 1.0)
+
+        # 6. Highlights / Shadows and 7. Invert, before quantizing
+        mask = np.clip(shadows * 0.01 * (highlights * 0.01 * mask - 1.0) + 1.0, 0.0, 1.0)
+        if invert:
+            mask = 1.0 - mask
+        dst[:] = (mask * 255).astype(np.uint8)
+        if skip_chunk is not None:
+            dst[skip_chunk == 255] = 0
+    return _mask_op(kernel, data, skip, cancel)
+
+# --- Numba (per-pixel loops compiled to machine code) ---
+
+if numba is not None:
+    jit = numba.njit(cache=True, nogil=True)
+
+    @jit
+    def _jit_despill(src, dst, is_green, method, preserve_luma):
+        for i in range(src.shape[0]):
+            r = src[i, 0] / 255.0
+            g = src[i, 1] / 255.0
+            b = src[i, 2] / 255.0
+            orig_r, orig_g, orig_b = r, g, b
+            other = b if is_green else g
+            if method == 0:
+                limit = (r + other) / 2.0
+            elif method == 1:
+                limit = (2.0 * r + other) / 3.0
+            elif method == 2:
+                limit = (2.0 * other + r) / 3.0
+            else:
+                limit = other
+            if is_green:
+                if g > limit:
+                    g = limit
+            elif b > limit:
+                b = limit
+            if preserve_luma:
+                luma = (abs(orig_r - r) * LUMA_COEFF_R) + \
+                       (abs(orig_g - g) * LUMA_COEFF_G) + \
+                       (abs(orig_b - b) * LUMA_COEFF_B)
+                r += luma
+                g += luma
+                b += luma
+            dst[i, 0] = int(max(0.0, min(255.0, r * 255)))
+            dst[i, 1] = int(max(0.0, min(255.0, g * 255)))
+            dst[i, 2] = int(max(0.0, min(255.0, b * 255)))
+            dst[i, 3] = src[i, 3]
+
+    @jit
+    def _jit_alpha_extract(src, dst, is_green, bg_val, edge_factor):
+        for i in range(src.shape[0]):
+            r = src[i, 0] / 255.0
+            g = src[i, 1] / 255.0
+            b = src[i, 2] / 255.0
+            key = g if is_green else b
+            max_other = max(r, b) if is_green else max(r, g)
+            if not (key > max_other + 0.05 and key > 0.1):
+                for c in range(4):
+                    dst[i, c] = src[i, c]
+                continue
+            raw_alpha = 1.0 - (key / bg_val)
+            if edge_factor > 0 and raw_alpha > 0 and raw_alpha < 1:
+                raw_alpha = raw_alpha ** (1.0 / (1.0 + edge_factor))
+            raw_alpha = min(max(raw_alpha, 0.0), 1.0)
+            fg_r, fg_g, fg_b = 0.0, 0.0, 0.0
+            if raw_alpha > 0.01:
+                fg_key = max(0.0, min(1.0, (key - (1.0 - raw_alpha) * bg_val) / raw_alpha))
+                fg_r = r
+                if is_green:
+                    fg_g, fg_b = fg_key, b
+                else:
+                    fg_g, fg_b = g, fg_key
+            dst[i, 0] = int(fg_r * 255)
+            dst[i, 1] = int(fg_g * 255)
+            dst[i, 2] = int(fg_b * 255)
+            dst[i, 3] = int(raw_alpha * (src[i, 3] / 255.0) * 255)
+
+    @jit
+    def _jit_linearize(v):
+        if v <= 0.04045:
+            return v / 12.92
+        return ((v + 0.055) / 1.055) ** 2.4
+
+    @jit
+    def _jit_func_lab(t):
+        if t > DELTA_3:
+            return t ** (1.0 / 3.0)
+        return (t / (3.0 * DELTA_2)) + (4.0 / 29.0)
+
+    @jit
+    def _jit_key_mask(src, dst, skip, use_skip, keys, lower, upper, shadows, highlights, invert):
+        for i in range(src.shape[0]):
+            if use_skip and skip[i] == 255:
+                dst[i] = 0
+                continue
+            r = src[i, 0] / 255.0
+            g = src[i, 1] / 255.0
+            b = src[i, 2] / 255.0
+            a = src[i, 3] / 255.0
+            if a > 0:
+                r, g, b = r / a, g / a, b / a
+            lr, lg, lb = _jit_linearize(r), _jit_linearize(g), _jit_linearize(b)
+            x = (lr * 0.4124 + lg * 0.3576 + lb * 0.1805) * 100.0
+            y = (lr * 0.2126 + lg * 0.7152 + lb * 0.0722) * 100.0
+            z = (lr * 0.0193 + lg * 0.1192 + lb * 0.9505) * 100.0
+            fy = _jit_func_lab(y / Yn)
+            p_L = 116.0 * fy - 16.0
+            p_a = 500.0 * (_jit_func_lab(x / Xn) - fy)
+            p_b = 200.0 * (fy - _jit_func_lab(z / Zn))
+            best = np.inf
+            for k in range(keys.shape[0]):
+                diff_L = keys[k, 0] - p_L
+                diff_a = keys[k, 1] - p_a
+                diff_b = keys[k, 2] - p_b
+                d2 = diff_L * diff_L + diff_a * diff_a + diff_b * diff_b
+                if d2 < best:
+                    best = d2
+                    if best < lower * lower:
+                        break
+            dist = math.sqrt(best)
+            mask = 1.0
+            if dist < lower:
+                mask = 0.0
+            elif dist < upper:
+                mask = (dist - lower) / (upper - lower)
+            mask = max(0.0, min(1.0, mask))
+            mask = max(0.0, min(1.0, shadows * 0.01 * (highlights * 0.01 * mask - 1.0) + 1.0))
+            if invert:
+                mask = 1.0 - mask
+            dst[i] = int(mask * 255)
+
+    def jit_despill(data, key_color='green', method='average', preserve_luma=False, cancel=None):
+        return _rgba_op(lambda src, dst: _jit_despill(src, dst, key_color == 'green', METHOD_INDEX[method],
+                                                      preserve_luma), data, cancel)
+
+    def jit_alpha_extract(data, key_rgb, bg_brightness=255, edge_softness=50.0, cancel=None):
+        is_green = key_rgb[1] >= key_rgb[2]
+        bg_val = max(bg_brightness / 255.0, 0.01)
+        return _rgba_op(lambda src, dst: _jit_alpha_extract(src, dst, is_green, bg_val, edge_softness / 100.0),
+                        data, cancel)
+
+    def jit_key_mask(data, lab, lower, upper, skip=None, cache=None, cancel=None, levels=IDENTITY_LEVELS):
+        no_skip = np.zeros(1, np.uint8)
+        keys = np.array(_keys(lab), np.float64).reshape(-1, 3)
+        shadows, highlights, invert = float(levels[0]), float(levels[1]), bool(levels[2])
+        def kernel(src, dst, skip_chunk=None):
+            use_skip = skip_chunk is not None
+            _jit_key_mask(src, dst, skip_chunk if use_skip else no_skip, use_skip,
+                          keys, float(lower), float(upper), shadows, highlights, invert)
+        return _mask_op(kernel, data, skip, cancel)
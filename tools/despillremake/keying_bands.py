@@ -0,0 +1,192 @@
+from PIL import Image, ImageChops, ImageMath
+
+from keying_core import DESPILL_METHODS, LUMA_COEFF_B, LUMA_COEFF_G, clamp_uint8, despill_color
+
+if not hasattr(ImageMath, 'lambda_eval'):
+    raise ImportError("The band backend needs Pillow 10.3 or newer (ImageMath.lambda_eval)")
+
+# ==========================================
+# BAND BACKEND (Pillow ImageMath / ImageChops)
+# ==========================================
+# Despill and alpha extraction as whole-band operations on the split R, G,
+# B, A planes, run in Pillow's C loops: no NumPy, no per-pixel Python. The
+# output is bit-identical to keying_core (`python backends.py verify bands`):
+#
+#   - Functions of one or two channels are tabulated from the core's own
+#     float64 formulas and applied with point(): one channel as an "L"
+#     table, two channels as a 65536-entry table over the "I" band
+#     a * 256 + b. That covers the despill limit (its float rounding is
+#     part of the reference result), and every alpha extraction output.
+#   - The luminance add-back needs all three channels, so it is computed
+#     in "F" (float32) bands. The true value is never within float32 error
+#     of an integer unless it is within NEAR_INTEGER of one, so only those
+#     pixels can truncate differently from float64; they are few and are
+#     recomputed with keying_core.despill_color.
+#   - Comparisons on integer levels (which pixels are screen) are exact in
+#     "L" bands.
+#
+# Tables are cached per setting, so repeated frames pay only the band ops.
+
+NEAR_INTEGER = 1e-3
+TABLE_CACHE_LIMIT = 16
+_limit_tables = {}
+_alpha_tables = {}
+
+def _image(data):
+    """RGBA image over raw bytes (one row: only band operations are used)."""
+    return Image.frombytes("RGBA", (len(data) // 4, 1), bytes(data))
+
+def _pair_index(x, y):
+    """"I" band x * 256 + y, for two-channel tables."""
+    return ImageMath.lambda_eval(lambda args: args['x'] * 256 + args['y'], x=x, y=y)
+
+def _cached(cache, key, build):
+    table = cache.get(key)
+    if table is None:
+        if len(cache) >= TABLE_CACHE_LIMIT:
+            cache.clear()
+        table = cache[key] = build()
+    return table
+
+def _cancelled(cancel):
+    return cancel is not None and cancel()
+
+# --- Despill ---
+
+def limit_table(key_color, method):
+    """Despilled key channel (0-255) for every (red, other channel) pair, from despill_color."""
+    def build():
+        table = []
+        for x in range(256):
+            for y in range(256):
+                # A key channel above any limit always gets clamped to it
+                if key_color == 'green':
+                    limit = despill_color(x / 255.0, 2.0, y / 255.0, key_color, method, False)[1]
+                else:
+                    limit = despill_color(x / 255.0, y / 255.0, 2.0, key_color, method, False)[2]
+                table.append(clamp_uint8(limit * 255))
+        return table
+    return _cached(_limit_tables, (key_color, method), build)
+
+def _limit_expr(method, x, y):
+    """Despill limit in 0-255 "F" bands (x is red, y the other non-key channel)."""
+    if method == 'average':
+        return (x + y) / 2.0
+    if method == 'double_red':
+        return (x * 2.0 + y) / 3.0
+    if method == 'double_average':
+        return (y * 2.0 + x) / 3.0
+    return y
+
+def _near_integer(v, args):
+    # Comparisons of "F" bands give 0.0 / 1.0, so max / min act as or / and
+    frac = v - args['float'](args['int'](v))
+    return args['max'](frac < NEAR_INTEGER, frac > 1.0 - NEAR_INTEGER)
+
+def _luma_bands(key, x, y, method, coeff):
+    """Despilled key, x, y with the luminance add-back as "F" bands, plus the pixels to recompute."""
+    def run(args):
+        k, x, y = args['k'], args['x'], args['y']
+        limit = _limit_expr(method, x, y)
+        luma = args['max'](k - limit, 0.0) * coeff
+        k2, x2, y2 = args['min'](k, limit) + luma, x + luma, y + luma
+        # Pixels at (or within float error of) the limit and next to an integer may truncate differently
+        near = args['max'](args['max'](_near_integer(k2, args), _near_integer(x2, args)), _near_integer(y2, args))
+        suspect = args['min'](k - limit > -NEAR_INTEGER, near)
+        return k2, x2, y2, suspect
+    bands = ImageMath.lambda_eval(run, k=key.convert("F"), x=x.convert("F"), y=y.convert("F"))
+    return [band.im for band in bands]
+
+def band_despill(data, key_color='green', method='average', preserve_luma=False, cancel=None):
+    if method not in DESPILL_METHODS:
+        raise ValueError(f"Unknown despill method '{method}'")
+    img = _image(data)
+    r, g, b, a = img.split()
+    green = key_color == 'green'
+    key, other = (g, b) if green else (b, g)
+
+    if not preserve_luma:
+        limit = _pair_index(r, other).point(limit_table(key_color, method), "L")
+        key = ImageChops.darker(key, limit)
+        bands = (r, key, b, a) if green else (r, g, key, a)
+        return bytearray(Image.merge("RGBA", bands).tobytes())
+
+    if _cancelled(cancel):
+        return None
+    k2, r2, o2, suspect = _luma_bands(key, r, other, method, LUMA_COEFF_G if green else LUMA_COEFF_B)
+    if _cancelled(cancel):
+        return None
+    # "F" -> "L" truncates and clips like clamp_uint8
+    k2, r2, o2 = k2.convert("L"), r2.convert("L"), o2.convert("L")
+    bands = (r2, k2, o2, a) if green else (r2, o2, k2, a)
+    out = bytearray(Image.merge("RGBA", bands).tobytes())
+
+    cache = {}
+    flags = suspect.convert("L").tobytes()
+    i = flags.find(1)
+    while i != -1:
+        j = i * 4
+        color = bytes(data[j:j + 3])
+        val = cache.get(color)
+        if val is None:
+            rgb = despill_color(color[0] / 255.0, color[1] / 255.0, color[2] / 255.0, key_color, method, True)
+            val = cache[color] = bytes(clamp_uint8(c * 255) for c in rgb)
+        out[j:j + 3] = val
+        i = flags.find(1, i + 1)
+    return out
+
+# --- Alpha extraction ---
+
+def alpha_tables(is_green, bg_val, edge_factor):
+    """
+    (key, keep, alpha) tables for screen pixels, repeating alpha_extract_color:
+    the unmixed key channel per key level, 255/0 for whether the color
+    survives (raw alpha > 0.01), and the new alpha per (key, alpha) pair.
+    """
+    def build():
+        key_table, keep_table, alpha_table = [], [], []
+        for k in range(256):
+            key_channel = k / 255.0
+            raw_alpha = 1.0 - (key_channel / bg_val)
+            if edge_factor > 0 and raw_alpha > 0 and raw_alpha < 1:
+                raw_alpha = raw_alpha ** (1.0 / (1.0 + edge_factor))
+            if raw_alpha < 0:
+                raw_alpha = 0.0
+            elif raw_alpha > 1:
+                raw_alpha = 1.0
+            if raw_alpha > 0.01:
+                bg_contribution = (1.0 - raw_alpha) * bg_val
+                fg = max(0, min(1, (key_channel - bg_contribution) / raw_alpha))
+                key_table.append(int(fg * 255))
+                keep_table.append(255)
+            else:
+                key_table.append(0)
+                keep_table.append(0)
+            alpha_table += [int(raw_alpha * (a / 255.0) * 255) for a in range(256)]
+        return key_table, keep_table, alpha_table
+    return _cached(_alpha_tables, (is_green, bg_val, edge_factor), build)
+
+def band_alpha_extract(data, key_rgb, bg_brightness=255, edge_softness=50.0, cancel=None):
+    img = _image(data)
+    r, g, b, a = img.split()
+    is_green = key_rgb[1] >= key_rgb[2]
+    bg_val = max(bg_brightness / 255.0, 0.01)
+    key_table, keep_table, alpha_table = alpha_tables(is_green, bg_val, edge_softness / 100.0)
+    key, other = (g, b) if is_green else (b, g)
+
+    # Screen: key channel > both others + 0.05 (13 levels) and > 0.1 (26 levels)
+    margin = ImageChops.subtract(key, ImageChops.lighter(r, other))
+    screen = ImageChops.darker(margin.point(lambda v: 255 if v >= 13 else 0),
+                               key.point(lambda v: 255 if v >= 26 else 0))
+    if not screen.getbbox():
+        return bytearray(data)
+    if _cancelled(cancel):
+        return None
+
+    keep = key.point(keep_table)
+    unmixed = (ImageChops.darker(r, keep), key.point(key_table), ImageChops.darker(other, keep),
+               _pair_index(key, a).point(alpha_table, "L"))
+    if not is_green:
+        unmixed = (unmixed[0], unmixed[2], unmixed[1], unmixed[3])
+    bands = [Image.composite(new, old, screen) for new, old in zip(unmixed, (r, g, b, a))]
+    return bytearray(Image.merge("RGBA", bands).tobytes())
@@ -0,0 +1,498 @@
+import bisect
+import math
+import sys
+
+# ==========================================
+# KEYING CORE (headless, buffer protocol)
+# ==========================================
+# The single copy of the keying math used by the CLIs, the pipeline and both
+# keying tool GUIs. Functions take raw straight-alpha RGBA pixel data as
+# anything exposing the buffer protocol (bytes, bytearray, memoryview,
+# array.array, Image.tobytes()...) and return a bytearray. Nothing here
+# imports Pillow, tkinter or ctypes, so the module loads in a few
+# milliseconds and runs anywhere Python does.
+#
+# Pixels are read as one native 32-bit integer each, which also makes them
+# cheap cache keys: plates have far fewer distinct colors than pixels.
+#
+# Long-running functions accept `cancel`, a callable polled every
+# CANCEL_INTERVAL pixels; when it returns True they stop and return None.
+
+# --- Constants from Olive Shader ---
+Xn = 95.0489
+Yn = 100.0
+Zn = 108.8840
+DELTA = 0.20689655172  # 6/29
+DELTA_3 = DELTA ** 3   # pow(delta, 3.0)
+DELTA_2 = DELTA ** 2   # pow(delta, 2)
+
+# Standard Rec.709 Luma Coefficients
+LUMA_COEFF_R = 0.2126
+LUMA_COEFF_G = 0.7152
+LUMA_COEFF_B = 0.0722
+
+DESPILL_METHODS = ('average', 'double_red', 'double_average', 'limit')
+
+CANCEL_INTERVAL = 1 << 16
+
+def linearize_srgb(v):
+    """
+    Converts sRGB (0.0-1.0) to Linear RGB.
+    This mimics the 'SceneLinear' input expected by the Olive shader.
+    """
+    if v <= 0.04045:
+        return v / 12.92
+    else:
+        return ((v + 0.055) / 1.055) ** 2.4
+
+# sRGB byte -> linear value, exactly what linearize_srgb(v / 255.0) returns
+LINEAR_LUT = [linearize_srgb(i / 255.0) for i in range(256)]
+
+def func_lab(t):
+    """
+    The helper function from the GLSL shader:
+    float func(float t) { ... }
+    """
+    if t > DELTA_3:
+        return t ** (1.0 / 3.0)
+    else:
+        return (t / (3.0 * DELTA_2)) + (4.0 / 29.0)
+
+def rgb_to_xyz(r, g, b):
+    """
+    Converts Linear RGB to CIE XYZ (D65).
+    Standard Matrix for sRGB/Rec709.
+    """
+    x = (r * 0.4124 + g * 0.3576 + b * 0.1805) * 100.0
+    y = (r * 0.2126 + g * 0.7152 + b * 0.0722) * 100.0
+    z = (r * 0.0193 + g * 0.1192 + b * 0.9505) * 100.0
+    return x, y, z
+
+def xyz_to_lab(x, y, z):
+    """
+    Converts CIE XYZ to Lab using the shader constants.
+    vec4 CIExyz_to_Lab(vec4 CIE)
+    """
+    l_val = 116.0 * func_lab(y / Yn) - 16.0
+    a_val = 500.0 * (func_lab(x / Xn) - func_lab(y / Yn))
+    b_val = 200.0 * (func_lab(y / Yn) - func_lab(z / Zn))
+    return l_val, a_val, b_val
+
+def get_lab_color(r, g, b):
+    """Composite helper to go straight from sRGB (0.0-1.0) to Lab"""
+    return xyz_to_lab(*rgb_to_xyz(linearize_srgb(r), linearize_srgb(g), linearize_srgb(b)))
+
+def parse_hex(color):
+    """'#RGB' or '#RRGGBB' -> (r, g, b) 0-255, for callers without Pillow's ImageColor."""
+    value = color.lstrip('#')
+    if len(value) == 3:
+        value = ''.join(c * 2 for c in value)
+    if len(value) != 6:
+        raise ValueError(f"Expected a hex color like #00FF00, got '{color}'")
+    return tuple(int(value[i:i + 2], 16) for i in (0, 2, 4))
+
+def key_to_lab(rgb):
+    """Lab of a 0-255 (r, g, b) key color."""
+    return get_lab_color(rgb[0] / 255.0, rgb[1] / 255.0, rgb[2] / 255.0)
+
+# --- Key sets (several sampled key colors) ---
+# An unevenly lit screen is keyed against several samples; a pixel's
+# distance is its Lab distance to the nearest one. The mask functions take
+# either one Lab triple or a key set from key_set(): keys deduplicated in Lab
+# and sorted by L, so nearest_distance() can walk outward from the pixel's L
+# and stop as soon as the L gap alone is larger than the best distance found.
+# The pixel's Lab is computed once whatever the number of keys.
+
+KEY_MERGE_DISTANCE = 1.0  # keys closer than this (Lab units) are one key
+
+def key_set(labs, merge_distance=KEY_MERGE_DISTANCE):
+    """
+    Key set from Lab triples: near-duplicates dropped (the first one wins),
+    the rest sorted by L. A single Lab triple is returned unchanged.
+    """
+    if not isinstance(labs[0], (tuple, list)):
+        return tuple(labs)
+    kept = []
+    limit = merge_distance * merge_distance
+    for lab in labs:
+        lab = tuple(float(v) for v in lab)
+        if all((lab[0] - k[0]) ** 2 + (lab[1] - k[1]) ** 2 + (lab[2] - k[2]) ** 2 >= limit for k in kept):
+            kept.append(lab)
+    if len(kept) == 1:
+        return kept[0]
+    return tuple(sorted(kept))
+
+def is_key_set(lab):
+    """True for a multi-key set from key_set(), False for one Lab triple."""
+    return isinstance(lab[0], tuple)
+
+def nearest_distance(pixel_lab, keys, stop_below=0.0):
+    """
+    Lab distance from `pixel_lab` to the nearest key of an L-sorted key set.
+    Stops early once a key closer than `stop_below` is found (the mask is 0
+    below the lower tolerance whichever key that is).
+    """
+    p_L, p_a, p_b = pixel_lab
+    n = len(keys)
+    hi = bisect.bisect_left(keys, (p_L,))
+    lo = hi - 1
+    best = math.inf
+    stop = stop_below * stop_below
+    while lo >= 0 or hi < n:
+        gap_lo = p_L - keys[lo][0] if lo >= 0 else math.inf
+        gap_hi = keys[hi][0] - p_L if hi < n else math.inf
+        if gap_lo <= gap_hi:
+            key, gap = keys[lo], gap_lo
+            lo -= 1
+        else:
+            key, gap = keys[hi], gap_hi
+            hi += 1
+        if gap * gap >= best:
+            break
+        diff_L = key[0] - p_L
+        diff_a = key[1] - p_a
+        diff_b = key[2] - p_b
+        dist = diff_L * diff_L + diff_a * diff_a + diff_b * diff_b
+        if dist < best:
+            best = dist
+            if best < stop:
+                break
+    return math.sqrt(best)
+
+# --- Raw pixel access ---
+
+if sys.byteorder == 'little':
+    def unpack(v):
+        return v & 255, (v >> 8) & 255, (v >> 16) & 255, v >> 24
+
+    def pack(r, g, b, a):
+        return r | (g << 8) | (b << 16) | (a << 24)
+
+    ALPHA_BITS = 0xFF000000
+else:
+    def unpack(v):
+        return v >> 24, (v >> 16) & 255, (v >> 8) & 255, v & 255
+
+    def pack(r, g, b, a):
+        return (r << 24) | (g << 16) | (b << 8) | a
+
+    ALPHA_BITS = 0x000000FF
+
+COLOR_BITS = 0xFFFFFFFF ^ ALPHA_BITS
+
+def pixels32(data):
+    """Zero-copy view of RGBA data as one native 32-bit integer per pixel."""
+    view = memoryview(data)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    if len(view) % 4:
+        raise ValueError(f"RGBA data length {len(view)} is not a multiple of 4")
+    return view.cast('I')
+
+def _output(out, size):
+    """Returns `out` if given (checking its size), else a new zeroed bytearray."""
+    if out is None:
+        return bytearray(size)
+    if len(memoryview(out).cast('B')) != size:
+        raise ValueError(f"Output buffer must be {size} bytes")
+    return out
+
+def cancelled(cancel, i):
+    return cancel is not None and i % CANCEL_INTERVAL == 0 and cancel()
+
+# --- Chroma key ---
+
+# (shadows, highlights, invert) of the Highlights / Shadows + Invert stage
+# that leave the mask as it is
+IDENTITY_LEVELS = (100.0, 100.0, False)
+
+MASK_CACHE_LIMIT = 1 << 20
+_mask_cache = [None, {}]
+
+def mask_cache(lab, lower, upper, levels=IDENTITY_LEVELS):
+    """
+    Pixel -> mask byte cache for the most recent key settings. It lives for
+    the whole process, so batch workers and repeated GUI previews stay warm.
+    """
+    settings = (lab, lower, upper, tuple(levels))
+    if _mask_cache[0] != settings or len(_mask_cache[1]) > MASK_CACHE_LIMIT:
+        _mask_cache[0] = settings
+        _mask_cache[1] = {}
+    return _mask_cache[1]
+
+def clear_mask_cache():
+    """Forgets cached mask bytes (benchmarks use this to measure cold runs)."""
+    _mask_cache[0] = None
+    _mask_cache[1] = {}
+
+def key_distance(r_int, g_int, b_int, a_int, lab, stop_below=0.0):
+    """Lab distance of one pixel to a key color given in Lab (or to the nearest key of a key set)."""
+    r, g, b, a = r_int / 255.0, g_int / 255.0, b_int / 255.0, a_int / 255.0
+
+    # 1. Un-premultiply Alpha (Shader logic)
+    if a > 0:
+        r, g, b = r / a, g / a, b / a
+
+    # 2. Convert Pixel to Lab, 3. Euclidean distance to the key
+    pixel_lab = get_lab_color(r, g, b)
+    if is_key_set(lab):
+        return nearest_distance(pixel_lab, lab, stop_below)
+    diff_L = lab[0] - pixel_lab[0]
+    diff_a = lab[1] - pixel_lab[1]
+    diff_b = lab[2] - pixel_lab[2]
+    return math.sqrt(diff_L * diff_L + diff_a * diff_a + diff_b * diff_b)
+
+def tolerance_value(dist, lower, upper):
+    """4. Mask (0.0-1.0) for a Lab distance and the lower/upper tolerances."""
+    mask = 1.0
+    if dist < lower:
+        mask = 0.0
+    elif dist < upper:
+        mask = (dist - lower) / (upper - lower)
+    return max(0.0, min(1.0, mask))
+
+def levels_value(mask, shadows, highlights, invert):
+    """6. Highlights / Shadows (Levels adjustments) and 7. Invert of a 0.0-1.0 mask."""
+    # mask = shadows * 0.01 * (highlights * 0.01 * mask - 1.0) + 1.0
+    mask = shadows * 0.01 * (highlights * 0.01 * mask - 1.0) + 1.0
+    mask = max(0.0, min(1.0, mask))
+    if invert:
+        mask = 1.0 - mask
+    return mask
+
+def tolerance_mask(dist, lower, upper, levels=IDENTITY_LEVELS):
+    """
+    Mask byte (0-255) for a Lab distance: the tolerance mask with `levels`
+    (shadows, highlights, invert) applied in float, quantized once.
+    """
+    return int(levels_value(tolerance_value(dist, lower, upper), *levels) * 255)
+
+def key_mask_value(r_int, g_int, b_int, a_int, lab, lower, upper, levels=IDENTITY_LEVELS):
+    """Mask byte (0-255) of one pixel against a key color given in Lab."""
+    return tolerance_mask(key_distance(r_int, g_int, b_int, a_int, lab, lower), lower, upper, levels)
+
+def key_mask(data, lab, lower, upper, skip=None, cache=None, out=None, cancel=None, levels=IDENTITY_LEVELS):
+    """
+    Mask (one byte per pixel, 0-255) of RGBA data against a key color given
+    in Lab or a key_set(), with `levels` (shadows, highlights, invert)
+    applied before quantizing. Pixels whose `skip` byte is 255 are left at 0
+    without computing Lab.
+    """
+    pixels = pixels32(data)
+    out = _output(out, len(pixels))
+    if cache is None:
+        cache = mask_cache(lab, lower, upper, levels)
+
+    for i, px in enumerate(pixels):
+        if cancelled(cancel, i):
+            return None
+        if skip is not None and skip[i] == 255:
+            out[i] = 0
+            continue
+        val = cache.get(px)
+        if val is None:
+            val = key_mask_value(*unpack(px), lab, lower, upper, levels)
+            cache[px] = val
+        out[i] = val
+
+    return out
+
+def levels_table(shadows, highlights, invert):
+    """256-entry lookup table for the Highlights/Shadows + Invert stage on a mask byte."""
+    return [int(levels_value(i / 255.0, shadows, highlights, invert) * 255) for i in range(256)]
+
+def multiply_alpha(data, mask, out=None):
+    """
+    RGBA data with alpha multiplied by a one-byte-per-pixel mask, truncated
+    like ImageChops.multiply (a * m // 255). `out` may be `data` itself.
+    Against the float mask (int(a * mask)) this is exact for opaque pixels
+    and up to 1 lower on partial alpha (see backends.COMPOSE_CASES).
+    """
+    pixels = pixels32(data)
+    out = _output(out, len(pixels) * 4)
+    out_pixels = pixels32(out)
+    for i, px in enumerate(pixels):
+        r, g, b, a = unpack(px)
+        out_pixels[i] = pack(r, g, b, a * mask[i] // 255)
+    return out
+
+def mask_rgba(mask, out=None):
+    """A one-byte-per-pixel mask as opaque gray RGBA data."""
+    out = _output(out, len(mask) * 4)
+    out_pixels = pixels32(out)
+    for i, m in enumerate(mask):
+        out_pixels[i] = pack(m, m, m, 255)
+    return out
+
+def chroma_key_rgba(data, lab, lower, upper, shadows=100.0, highlights=100.0,
+                    invert=False, mask_only=False, out=None, cancel=None):
+    """
+    Keys RGBA data without mattes or refinement (see chroma_key.py for those).
+    Returns RGBA data: the input with its alpha multiplied by the mask, or
+    the mask as opaque gray when `mask_only` is set.
+    """
+    # 4. Tolerance, 6. Highlights / Shadows and 7. Invert, quantized once
+    mask = key_mask(data, lab, lower, upper, cancel=cancel, levels=(shadows, highlights, invert))
+    if mask is None:
+        return None
+
+    # 8. Output Composition
+    if mask_only:
+        return mask_rgba(mask, out)
+    return multiply_alpha(data, mask, out)
+
+# --- Despill ---
+
+def despill_color(r, g, b, key_color, method, preserve_luma):
+    """Despills one 0.0-1.0 color. Returns the new (r, g, b), unclamped."""
+    orig_r, orig_g, orig_b = r, g, b
+    limit = 0.0
+
+    # --- GREEN SCREEN LOGIC ---
+    if key_color == 'green':
+        if method == 'average':
+            limit = (r + b) / 2.0
+        elif method == 'double_red':
+            limit = (2.0 * r + b) / 3.0
+        elif method == 'double_average':
+            limit = (2.0 * b + r) / 3.0
+        elif method == 'limit':
+            limit = b
+
+        # Apply: Green cannot be higher than limit
+        if g > limit:
+            g = limit
+
+    # --- BLUE SCREEN LOGIC ---
+    elif key_color == 'blue':
+        if method == 'average':
+            limit = (r + g) / 2.0
+        elif method == 'double_red':
+            limit = (2.0 * r + g) / 3.0
+        elif method == 'double_average':
+            limit = (2.0 * g + r) / 3.0
+        elif method == 'limit':
+            limit = g
+
+        # Apply: Blue cannot be higher than limit
+        if b > limit:
+            b = limit
+
+    # --- PRESERVE LUMINANCE LOGIC ---
+    if preserve_luma:
+        # GLSL: dot(abs(diff.rgb), luma_coeffs);
+        # We use abs() to match the C++ implementation exactly
+        luma = (abs(orig_r - r) * LUMA_COEFF_R) + \
+               (abs(orig_g - g) * LUMA_COEFF_G) + \
+               (abs(orig_b - b) * LUMA_COEFF_B)
+
+        # Add luma back
+        r += luma
+        g += luma
+        b += luma
+
+    return r, g, b
+
+def clamp_uint8(value):
+    """Helper to ensure value stays between 0 and 255 and is an integer."""
+    return int(max(0, min(255, value)))
+
+def despill_rgba(data, key_color='green', method='average', preserve_luma=False, out=None, cancel=None):
+    """Despilled copy of RGBA data (alpha unchanged). `out` may be `data` itself."""
+    if method not in DESPILL_METHODS:
+        raise ValueError(f"Unknown despill method '{method}'")
+    pixels = pixels32(data)
+    out = _output(out, len(pixels) * 4)
+    out_pixels = pixels32(out)
+    # Color -> despilled color (alpha bits cleared on both sides)
+    cache = {}
+
+    for i, px in enumerate(pixels):
+        if cancelled(cancel, i):
+            return None
+        color = px & COLOR_BITS
+        val = cache.get(color)
+        if val is None:
+            r, g, b, _ = unpack(color)
+            r, g, b = despill_color(r / 255.0, g / 255.0, b / 255.0, key_color, method, preserve_luma)
+            val = pack(clamp_uint8(r * 255), clamp_uint8(g * 255), clamp_uint8(b * 255), 0)
+            cache[color] = val
+        out_pixels[i] = val | (px & ALPHA_BITS)
+
+    return out
+
+# --- Alpha extraction ---
+
+def alpha_extract_color(r_int, g_int, b_int, a_int, is_green, bg_val, edge_factor):
+    """
+    Extracts alpha for one pixel by analyzing how much the key channel is darkened.
+    Semi-transparent elements (shadows, smoke) darken the green proportionally to their opacity.
+    """
+    r, g, b = r_int / 255.0, g_int / 255.0, b_int / 255.0
+
+    if is_green:
+        key_channel = g
+        other1, other2 = r, b
+    else:
+        key_channel = b
+        other1, other2 = r, g
+
+    # Only treat the pixel as screen if the key channel is DOMINANT
+    if not (key_channel > max(other1, other2) + 0.05 and key_channel > 0.1):
+        # Non-key-dominant pixel = solid foreground, keep as-is
+        return r_int, g_int, b_int, a_int
+
+    # Alpha = 1 - (key_channel / bg_brightness)
+    raw_alpha = 1.0 - (key_channel / bg_val)
+
+    # Apply edge softness
+    if edge_factor > 0 and raw_alpha > 0 and raw_alpha < 1:
+        raw_alpha = raw_alpha ** (1.0 / (1.0 + edge_factor))
+
+    if raw_alpha < 0:
+        raw_alpha = 0.0
+    elif raw_alpha > 1:
+        raw_alpha = 1.0
+
+    # Estimate foreground color: only the key channel is unmixed
+    if raw_alpha > 0.01:
+        bg_contribution = (1.0 - raw_alpha) * bg_val
+        if is_green:
+            fg_g = max(0, min(1, (g - bg_contribution) / raw_alpha))
+            fg_r, fg_b = r, b
+        else:
+            fg_b = max(0, min(1, (b - bg_contribution) / raw_alpha))
+            fg_r, fg_g = r, g
+    else:
+        fg_r, fg_g, fg_b = 0, 0, 0
+
+    final_alpha = int(raw_alpha * (a_int / 255.0) * 255)
+    return int(fg_r * 255), int(fg_g * 255), int(fg_b * 255), final_alpha
+
+def alpha_extract_rgba(data, key_rgb, bg_brightness=255, edge_softness=50.0, out=None, cancel=None):
+    """
+    Alpha-extracted copy of RGBA data. `key_rgb` (0-255) decides green vs
+    blue screen; `bg_brightness` is the key channel value of a clean screen
+    area and `edge_softness` goes from 0 (hard) to 100 (soft).
+    """
+    pixels = pixels32(data)
+    out = _output(out, len(pixels) * 4)
+    out_pixels = pixels32(out)
+
+    # Determine if green or blue screen based on which channel is dominant
+    is_green = key_rgb[1] >= key_rgb[2]
+    # Prevent division by zero
+    bg_val = max(bg_brightness / 255.0, 0.01)
+    edge_factor = edge_softness / 100.0
+    cache = {}
+
+    for i, px in enumerate(pixels):
+        if cancelled(cancel, i):
+            return None
+        val = cache.get(px)
+        if val is None:
+            val = pack(*alpha_extract_color(*unpack(px), is_green, bg_val, edge_factor))
+            cache[px] = val
+        out_pixels[i] = val
+
+    return out
@@ -0,0 +1,422 @@
+import argparse
+import asyncio
+import getpass
+import hmac
+import json
+import os
+import re
+import secrets
+import socket
+import stat
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# ==========================================
+# LOCAL KEYING SERVICE (warm workers)
+# ==========================================
+# Usage:
+#   python keying_service.py serve [-j 4]
+#   python keying_service.py run input.png output.png chroma --color "#5fb356" despill
+#   python keying_service.py stop
+#
+# `serve` keeps a pool of worker processes with Pillow imported and key tables
+# warm, and listens on a Unix domain socket (or 127.0.0.1 where Unix sockets
+# are unavailable, e.g. Windows). `run` sends one job and falls back to
+# running it in-process when no service is listening.
+#
+# Protocol: one JSON object per line each way.
+#   {"stages": [["chroma", {"color": "#5fb356"}], ["despill", {}]],
+#    "input": "in.png", "output": "out.png"}
+#   {"params": {...get_params() keys...}, "input": ..., "output": ...}
+#   {"stages": ..., "shm": "<SharedMemory name>", "size": [w, h]}
+#     (raw RGBA frame keyed in place inside the shared memory block)
+#   {"op": "ping"} / {"op": "shutdown"}
+# Every request also carries "token" (see below).
+# Reply: {"ok": true, "seconds": 0.12} or {"ok": false, "error": "..."}
+#
+# Access: the service reads and writes whatever paths a request names, with
+# the rights of the user running it, so only that user may talk to it. The
+# default socket lives in a per-user directory (TEMP/keying_service-UID,
+# mode 0700), and every request must carry the token from that directory's
+# token file (mode 0600), created by the first `serve`. The token is what
+# protects the 127.0.0.1 TCP fallback and sockets given with --address:
+# any local user can connect to those, but not read the token. On Windows
+# the token file is only as private as the user's TEMP directory (per-user
+# by default).
+
+DEFAULT_PORT = 47651
+SOCKET_NAME = "keying.sock"
+TOKEN_NAME = "token"
+
+def use_unix_socket():
+    return hasattr(socket, "AF_UNIX") and hasattr(asyncio, "start_unix_server")
+
+def service_dir():
+    """Per-user directory for the default socket and the token (not created here)."""
+    if hasattr(os, 'getuid'):
+        user = str(os.getuid())
+    else:
+        try:
+            user = re.sub(r'[^\w.-]', '_', getpass.getuser())
+        except Exception:
+            user = 'user'
+    return os.path.join(tempfile.gettempdir(), f"keying_service-{user}")
+
+def private_service_dir():
+    """service_dir(), created if needed; refuses a directory other users can reach."""
+    path = service_dir()
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if hasattr(os, 'getuid'):
+        info = os.lstat(path)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+            raise PermissionError(f"{path} must be a directory owned by and only accessible to you")
+    return path
+
+def load_token(create=False):
+    """The service token of this user (created when `create` is set), or None."""
+    path = os.path.join(service_dir(), TOKEN_NAME)
+    try:
+        with open(path, 'r', encoding='ascii') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        if not create:
+            return None
+    path = os.path.join(private_service_dir(), TOKEN_NAME)
+    token = secrets.token_hex(32)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # Another `serve` created it first
+        return load_token()
+    with os.fdopen(fd, 'w', encoding='ascii') as f:
+        f.write(token)
+    return token
+
+def default_address():
+    return os.path.join(service_dir(), SOCKET_NAME) if use_unix_socket() else f"127.0.0.1:{DEFAULT_PORT}"
+
+def parse_address(address):
+    """'host:port' -> ('tcp', host, port); anything else is a Unix socket path."""
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and host:
+        if host not in ('127.0.0.1', 'localhost', '::1'):
+            raise ValueError("The keying service only listens on localhost")
+        return 'tcp', host, int(port)
+    return 'unix', address, None
+
+# --- Job execution (worker processes, or in-process fallback) ---
+
+def init_worker():
+    # Import the engine up front so the first request pays nothing extra
+    import pipeline  # noqa: F401
+
+def attach_shared_memory(name):
+    """Attaches to a client's block without letting this process's tracker unlink it."""
+    from multiprocessing import shared_memory
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 always tracks; the client owns (and unlinks) the block
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return shm
+
+def run_job(request):
+    """Runs one keying request. Returns the reply dict."""
+    from PIL import Image
+    import pipeline
+
+    start = time.perf_counter()
+    try:
+        if 'params' in request:
+            process = lambda img: pipeline.process_params(img, request['params'])
+        else:
+            stages = pipeline.stages_from_options(request.get('stages', []))
+            process = lambda img: pipeline.run_pipeline(img, stages)
+
+        if 'shm' in request:
+            size = tuple(request['size'])
+            shm = attach_shared_memory(request['shm'])
+            try:
+                frame_bytes = size[0] * size[1] * 4
+                img = Image.frombytes("RGBA", size, bytes(shm.buf[:frame_bytes]))
+                out = process(img)
+                if out.size != size:
+                    raise ValueError("Stage changed the frame size")
+                shm.buf[:frame_bytes] = out.convert("RGBA").tobytes()
+            finally:
+                shm.close()
+        else:
+            img = Image.open(request['input']).convert("RGBA")
+            process(img).save(request['output'])
+
+        return {'ok': True, 'seconds': time.perf_counter() - start}
+    except Exception as e:
+        return {'ok': False, 'error': str(e)}
+
+# --- Server ---
+
+def socket_in_use(path):
+    """True if something accepts connections on the Unix socket at `path`."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(1.0)
+    try:
+        sock.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+def claim_socket_path(path):
+    """Removes a stale socket left at `path`; raises if it is live or not a socket."""
+    if not os.path.lexists(path):
+        return
+    if not stat.S_ISSOCK(os.lstat(path).st_mode):
+        raise RuntimeError(f"{path} exists and is not a socket")
+    if socket_in_use(path):
+        raise RuntimeError(f"A keying service is already listening on {path}")
+    os.remove(path)
+
+class KeyingService:
+    def __init__(self, workers=None, queue_size=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.token = load_token(create=True)
+        self.queue = asyncio.Queue(maxsize=queue_size or self.workers * 4)
+        self.pool = None
+        self.server = None
+        self.served = 0
+
+    async def dispatcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            request, reply = await self.queue.get()
+            try:
+                result = await loop.run_in_executor(self.pool, run_job, request)
+            except Exception as e:
+                result = {'ok': False, 'error': str(e)}
+            self.served += 1
+            if not reply.done():
+                reply.set_result(result)
+            self.queue.task_done()
+
+    async def handle_client(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    result = {'ok': False, 'error': 'Malformed request'}
+                else:
+                    if not isinstance(request, dict) or not hmac.compare_digest(
+                            str(request.get('token', '')), self.token):
+                        writer.write(json.dumps({'ok': False, 'error': 'Invalid token'}).encode('utf-8') + b'\n')
+                        await writer.drain()
+                        break
+                    op = request.get('op')
+                    if op == 'ping':
+                        result = {'ok': True, 'workers': self.workers, 'served': self.served}
+                    elif op == 'shutdown':
+                        result = {'ok': True}
+                        loop.call_soon(self.server.close)
+                    else:
+                        # Waits here when the queue is full: backpressure on the client
+                        reply = loop.create_future()
+                        await self.queue.put((request, reply))
+                        result = await reply
+                writer.write(json.dumps(result).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, address):
+        kind, host, port = parse_address(address)
+        if kind == 'unix':
+            if address == default_address():
+                private_service_dir()
+            claim_socket_path(host)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker)
+        # Start every worker now rather than on the first request
+        await asyncio.gather(*[asyncio.get_running_loop().run_in_executor(self.pool, init_worker)
+                               for _ in range(self.workers)])
+        dispatchers = [asyncio.create_task(self.dispatcher()) for _ in range(self.workers)]
+
+        if kind == 'unix':
+            self.server = await asyncio.start_unix_server(self.handle_client, path=host)
+        else:
+            self.server = await asyncio.start_server(self.handle_client, host=host, port=port)
+
+        print(f"Keying service on {address} with {self.workers} warm worker(s). Ctrl+C to stop.")
+        try:
+            async with self.server:
+                await self.server.wait_closed()
+        finally:
+            for task in dispatchers:
+                task.cancel()
+            self.pool.shutdown()
+            if kind == 'unix' and os.path.exists(host):
+                os.remove(host)
+            print("Keying service stopped.")
+
+# --- Client ---
+
+class ServiceClient:
+    """
+    Thin client. Every call falls back to running the job in this process
+    when no service is listening (unless fallback=False).
+    """
+    def __init__(self, address=None, timeout=None, fallback=True):
+        self.address = address or default_address()
+        self.timeout = timeout
+        self.fallback = fallback
+        self.token = load_token()
+
+    def _connect(self):
+        kind, host, port = parse_address(self.address)
+        if kind == 'unix':
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(host)
+        else:
+            sock = socket.create_connection((host, port), timeout=self.timeout)
+        return sock
+
+    def request(self, request):
+        """Sends one request. Returns the reply, or None if no service is running."""
+        if self.token is None:
+            # No service of this user has ever started (it creates the token)
+            return None
+        try:
+            sock = self._connect()
+        except OSError:
+            return None
+        with sock, sock.makefile('rwb') as stream:
+            stream.write(json.dumps(dict(request, token=self.token)).encode('utf-8') + b'\n')
+            stream.flush()
+            line = stream.readline()
+        if not line:
+            return {'ok': False, 'error': 'Service closed the connection'}
+        return json.loads(line)
+
+    def _run(self, request):
+        reply = self.request(request)
+        if reply is None:
+            if not self.fallback:
+                return {'ok': False, 'error': f'No keying service on {self.address}'}
+            reply = run_job(request)
+            reply['in_process'] = True
+        return reply
+
+    def run_files(self, input_path, output_path, stages=None, params=None):
+        """Keys a file. `stages` is [(name, {option: value}), ...]; or pass `params`."""
+        request = {'input': os.path.abspath(input_path), 'output': os.path.abspath(output_path)}
+        request.update({'params': params} if params is not None else {'stages': stages or []})
+        return self._run(request)
+
+    def run_buffer(self, data, size, stages=None, params=None):
+        """
+        Keys a raw RGBA frame (anything exposing the buffer protocol) through
+        shared memory. Returns (reply, keyed_bytes).
+        """
+        from multiprocessing import shared_memory
+        frame_bytes = size[0] * size[1] * 4
+        shm = shared_memory.SharedMemory(create=True, size=frame_bytes)
+        try:
+            shm.buf[:frame_bytes] = memoryview(data).cast('B')[:frame_bytes]
+            request = {'shm': shm.name, 'size': list(size)}
+            request.update({'params': params} if params is not None else {'stages': stages or []})
+            reply = self._run(request)
+            return reply, bytes(shm.buf[:frame_bytes])
+        finally:
+            shm.close()
+            shm.unlink()
+
+def stages_as_options(argv):
+    """Pipeline-style argv -> [(name, {option: value}), ...] for a request."""
+    import pipeline
+    stages = []
+    for name, _, args in pipeline.parse_stages(argv):
+        # The service has its own working directory: send matte paths absolute
+        options = {k: os.path.abspath(v) if isinstance(v, str) and os.path.isfile(v) else v
+                   for k, v in vars(args).items()}
+        stages.append((name, options))
+    return stages
+
+if __name__ == "__main__":
+    from backends import add_backend_arguments, apply_backend_args
+
+    parser = argparse.ArgumentParser(description="Local keying service with warm workers")
+    parser.add_argument("--address", default=None,
+                        help=f"Unix socket path or 127.0.0.1:port (default: {default_address()})")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve = sub.add_parser("serve", help="Start the service")
+    serve.add_argument("-j", "--jobs", type=int, default=None, help="Worker processes (default: CPU count)")
+    serve.add_argument("--queue", type=int, default=None, help="Max queued jobs (default: 4x workers)")
+    add_backend_arguments(serve)
+
+    run = sub.add_parser("run", help="Key one file through the service (in-process if none is running)",
+                         usage="%(prog)s [--no-fallback] [--backend NAME] input output STAGE [options] [STAGE [options] ...]")
+    run.add_argument("--no-fallback", action="store_true", help="Fail instead of running in-process")
+    add_backend_arguments(run)
+
+    sub.add_parser("ping", help="Check whether the service is running")
+    sub.add_parser("stop", help="Stop a running service")
+
+    argv = sys.argv[1:]
+    args, rest = parser.parse_known_args(argv)
+    address = args.address or default_address()
+
+    if args.command == "serve":
+        if rest:
+            parser.error(f"unrecognized arguments: {' '.join(rest)}")
+        # Workers inherit the choice through the environment
+        print(f"Keying backend: {apply_backend_args(args).name}")
+        try:
+            asyncio.run(KeyingService(args.jobs, args.queue).serve(address))
+        except KeyboardInterrupt:
+            pass
+        except (RuntimeError, OSError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+
+    elif args.command == "run":
+        if len(rest) < 2:
+            run.error("input and output are required")
+        input_path, output_path, stage_argv = rest[0], rest[1], rest[2:]
+        try:
+            stages = stages_as_options(stage_argv)
+        except ValueError as e:
+            run.error(str(e))
+        if args.backend:
+            # Only used when falling back to in-process keying
+            apply_backend_args(args)
+        client = ServiceClient(address, fallback=not args.no_fallback)
+        reply = client.run_files(input_path, output_path, stages)
+        if not reply['ok']:
+            print(f"Error: {reply['error']}")
+            sys.exit(1)
+        where = "in-process" if reply.get('in_process') else "via service"
+        print(f"Keyed {output_path} {where} in {reply['seconds']:.2f}s")
+
+    else:
+        reply = ServiceClient(address, timeout=5).request({'op': 'ping' if args.command == 'ping' else 'shutdown'})
+        if reply is None:
+            print(f"No keying service on {address}")
+            sys.exit(1)
+        if args.command == 'ping':
+            print(f"Service on {address}: {reply['workers']} worker(s), {reply['served']} job(s) served")
+        else:
+            print("Service stopping.")
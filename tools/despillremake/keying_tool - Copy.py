@@ -1,11 +1,20 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, colorchooser, messagebox
-from PIL import Image, ImageTk, ImageColor, ImageDraw, ImageChops
-import math
+from PIL import ImageTk, ImageColor
+import sys
 import threading
 import os
-import ctypes
-from ctypes import wintypes
+import tempfile
+import time
+import backends
+import chroma_key
+import export
+import image_list
+import pipeline
+import preview
+import profiling
+import sweep
+import timing
 
 # ==========================================
 # Windows Native Drag & Drop (no third-party)
@@ -15,281 +24,60 @@ from ctypes import wintypes
 GWL_WNDPROC = -4
 WM_DROPFILES = 0x0233
 
-# Load Windows DLLs
-shell32 = ctypes.windll.shell32
-user32 = ctypes.windll.user32
+# The Windows DLLs are only loaded when drag-and-drop is set up, so the
+# module (and the keying engine behind it) imports on any OS.
+ctypes = wintypes = shell32 = user32 = WNDPROC = SetWindowLong = None
+
+def load_win32():
+    """Loads the Windows API used for drag-and-drop. Raises OSError elsewhere."""
+    global ctypes, wintypes, shell32, user32, WNDPROC, SetWindowLong
+    if shell32 is not None:
+        return
+    if sys.platform != 'win32':
+        raise OSError("Native drag-and-drop needs Windows")
+    import ctypes
+    from ctypes import wintypes
+
+    # Load Windows DLLs
+    shell32 = ctypes.windll.shell32
+    user32 = ctypes.windll.user32
+
+    # DragAcceptFiles enables drag-and-drop on a window
+    shell32.DragAcceptFiles.argtypes = [wintypes.HWND, wintypes.BOOL]
+    shell32.DragAcceptFiles.restype = None
+
+    # DragQueryFileW gets dropped file paths
+    shell32.DragQueryFileW.argtypes = [wintypes.HANDLE, wintypes.UINT, wintypes.LPWSTR, wintypes.UINT]
+    shell32.DragQueryFileW.restype = wintypes.UINT
+
+    # DragFinish releases memory
+    shell32.DragFinish.argtypes = [wintypes.HANDLE]
+    shell32.DragFinish.restype = None
+
+    # Window procedure type
+    WNDPROC = ctypes.WINFUNCTYPE(ctypes.c_long, wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM)
+
+    # SetWindowLongPtrW for 64-bit, SetWindowLongW for 32-bit
+    if ctypes.sizeof(ctypes.c_void_p) == 8:
+        user32.SetWindowLongPtrW.argtypes = [wintypes.HWND, ctypes.c_int, ctypes.c_void_p]
+        user32.SetWindowLongPtrW.restype = ctypes.c_void_p
+        SetWindowLong = user32.SetWindowLongPtrW
+        user32.CallWindowProcW.argtypes = [ctypes.c_void_p, wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM]
+    else:
+        user32.SetWindowLongW.argtypes = [wintypes.HWND, ctypes.c_int, ctypes.c_long]
+        user32.SetWindowLongW.restype = ctypes.c_long
+        SetWindowLong = user32.SetWindowLongW
+        user32.CallWindowProcW.argtypes = [ctypes.c_long, wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM]
+
+    user32.CallWindowProcW.restype = ctypes.c_long
 
-# DragAcceptFiles enables drag-and-drop on a window
-shell32.DragAcceptFiles.argtypes = [wintypes.HWND, wintypes.BOOL]
-shell32.DragAcceptFiles.restype = None
-
-# DragQueryFileW gets dropped file paths
-shell32.DragQueryFileW.argtypes = [wintypes.HANDLE, wintypes.UINT, wintypes.LPWSTR, wintypes.UINT]
-shell32.DragQueryFileW.restype = wintypes.UINT
-
-# DragFinish releases memory
-shell32.DragFinish.argtypes = [wintypes.HANDLE]
-shell32.DragFinish.restype = None
-
-# Window procedure type
-WNDPROC = ctypes.WINFUNCTYPE(ctypes.c_long, wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM)
-
-# SetWindowLongPtrW for 64-bit, SetWindowLongW for 32-bit
-if ctypes.sizeof(ctypes.c_void_p) == 8:
-    user32.SetWindowLongPtrW.argtypes = [wintypes.HWND, ctypes.c_int, ctypes.c_void_p]
-    user32.SetWindowLongPtrW.restype = ctypes.c_void_p
-    SetWindowLong = user32.SetWindowLongPtrW
-    user32.CallWindowProcW.argtypes = [ctypes.c_void_p, wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM]
-else:
-    user32.SetWindowLongW.argtypes = [wintypes.HWND, ctypes.c_int, ctypes.c_long]
-    user32.SetWindowLongW.restype = ctypes.c_long
-    SetWindowLong = user32.SetWindowLongW
-    user32.CallWindowProcW.argtypes = [ctypes.c_long, wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM]
-
-user32.CallWindowProcW.restype = ctypes.c_long
-
-
-# ==========================================
-# PART 1: OPTIMIZED MATH & LUTS
-# ==========================================
-
-Xn, Yn, Zn = 95.0489, 100.0, 108.8840
-DELTA = 0.20689655172
-DELTA_3 = DELTA ** 3
-DELTA_2 = DELTA ** 2
-
-def _calc_linear_srgb(v_int):
-    v = v_int / 255.0
-    if v <= 0.04045: return v / 12.92
-    return ((v + 0.055) / 1.055) ** 2.4
-
-LINEAR_LUT = [_calc_linear_srgb(i) for i in range(256)]
-
-def func_lab(t):
-    if t > DELTA_3: return t ** (1.0 / 3.0)
-    return (t / (3.0 * DELTA_2)) + (4.0 / 29.0)
-
-def rgb_to_lab_fast(r_int, g_int, b_int):
-    lin_r = LINEAR_LUT[r_int]
-    lin_g = LINEAR_LUT[g_int]
-    lin_b = LINEAR_LUT[b_int]
-    x = (lin_r * 0.4124 + lin_g * 0.3576 + lin_b * 0.1805) * 100.0
-    y = (lin_r * 0.2126 + lin_g * 0.7152 + lin_b * 0.0722) * 100.0
-    z = (lin_r * 0.0193 + lin_g * 0.1192 + lin_b * 0.9505) * 100.0
-    l_val = 116.0 * func_lab(y / Yn) - 16.0
-    a_val = 500.0 * (func_lab(x / Xn) - func_lab(y / Yn))
-    b_val = 200.0 * (func_lab(y / Yn) - func_lab(z / Zn))
-    return l_val, a_val, b_val
-
-def hex_to_lab(hex_color):
-    k_rgb = ImageColor.getrgb(hex_color)
-    return rgb_to_lab_fast(k_rgb[0], k_rgb[1], k_rgb[2])
-
-# ==========================================
-# PART 2: PROCESSING ENGINES
-# ==========================================
-
-def run_despill(img, key_color, method, preserve_luma, app_ref=None, job_id=None):
-    width, height = img.size
-    pixels = img.load()
-    new_img = Image.new("RGBA", (width, height))
-    new_pixels = new_img.load()
-    
-    luma_r, luma_g, luma_b = 0.2126, 0.7152, 0.0722
-    
-    m_idx = 0
-    if method == 'Double Red': m_idx = 1
-    elif method == 'Double Average': m_idx = 2
-    elif method == 'Limit': m_idx = 3
-    
-    is_green = (key_color == 'Green')
-
-    for x in range(width):
-        if app_ref and app_ref.current_job_id != job_id: return None
-        for y in range(height):
-            r_int, g_int, b_int, a_int = pixels[x, y]
-            r, g, b = r_int/255.0, g_int/255.0, b_int/255.0
-            orig_r, orig_g, orig_b = r, g, b
-            limit = 0.0
-
-            if is_green:
-                if m_idx == 0: limit = (r + b) * 0.5
-                elif m_idx == 1: limit = (2.0 * r + b) * 0.33333
-                elif m_idx == 2: limit = (2.0 * b + r) * 0.33333
-                elif m_idx == 3: limit = b
-                if g > limit: g = limit
-            else: 
-                if m_idx == 0: limit = (r + g) * 0.5
-                elif m_idx == 1: limit = (2.0 * r + g) * 0.33333
-                elif m_idx == 2: limit = (2.0 * g + r) * 0.33333
-                elif m_idx == 3: limit = g
-                if b > limit: b = limit
-
-            if preserve_luma:
-                diff_r, diff_g, diff_b = orig_r - r, orig_g - g, orig_b - b
-                luma = (abs(diff_r)*luma_r) + (abs(diff_g)*luma_g) + (abs(diff_b)*luma_b)
-                r += luma; g += luma; b += luma
-
-            nr = int(r * 255)
-            ng = int(g * 255)
-            nb = int(b * 255)
-            new_pixels[x, y] = (
-                255 if nr > 255 else (0 if nr < 0 else nr),
-                255 if ng > 255 else (0 if ng < 0 else ng),
-                255 if nb > 255 else (0 if nb < 0 else nb),
-                a_int
-            )
-    return new_img
-
-def run_chromakey(img, key_lab, lower, upper, shadows, highlights, invert, mask_only, app_ref=None, job_id=None):
-    width, height = img.size
-    pixels = img.load()
-    new_img = Image.new("RGBA", (width, height))
-    new_pixels = new_img.load()
-
-    key_L, key_a, key_b = key_lab
-    shad_factor = shadows * 0.01
-    high_factor = highlights * 0.01
-
-    for x in range(width):
-        if app_ref and app_ref.current_job_id != job_id: return None
-        for y in range(height):
-            r_int, g_int, b_int, a_int = pixels[x, y]
-            
-            if a_int > 0 and a_int < 255:
-                alpha_f = 255.0 / a_int
-                pix_lab = rgb_to_lab_fast(
-                    int(r_int * alpha_f) if r_int * alpha_f <= 255 else 255, 
-                    int(g_int * alpha_f) if g_int * alpha_f <= 255 else 255, 
-                    int(b_int * alpha_f) if b_int * alpha_f <= 255 else 255
-                )
-            else:
-                pix_lab = rgb_to_lab_fast(r_int, g_int, b_int)
-
-            diff_L = key_L - pix_lab[0]
-            diff_a = key_a - pix_lab[1]
-            diff_b = key_b - pix_lab[2]
-            dist = math.sqrt(diff_L*diff_L + diff_a*diff_a + diff_b*diff_b)
-
-            mask = 1.0
-            if dist < lower: mask = 0.0
-            elif dist < upper: mask = (dist - lower) / (upper - lower)
-            
-            mask = shad_factor * (high_factor * mask - 1.0) + 1.0
-            if mask < 0.0: mask = 0.0
-            elif mask > 1.0: mask = 1.0
-
-            if invert: mask = 1.0 - mask
-
-            if mask_only:
-                val = int(mask * 255)
-                new_pixels[x, y] = (val, val, val, 255)
-            else:
-                new_a = int(a_int * mask)
-                new_pixels[x, y] = (r_int, g_int, b_int, new_a)
-    return new_img
-
-def run_alpha_extract(img, key_color_hex, bg_brightness, edge_softness, app_ref=None, job_id=None):
-    """
-    Extract alpha from green/blue screen by analyzing how much the key channel is darkened.
-    Semi-transparent elements (shadows, smoke) darken the green proportionally to their opacity.
-    
-    Algorithm:
-    - For green screen: alpha = 1.0 - (green_value / expected_green)
-    - expected_green = bg_brightness (the brightness of pure green screen areas)
-    - Foreground RGB is estimated by removing the green screen contribution
-    """
-    width, height = img.size
-    pixels = img.load()
-    new_img = Image.new("RGBA", (width, height))
-    new_pixels = new_img.load()
-    
-    # Parse key color to determine which channel to use
-    k_rgb = ImageColor.getrgb(key_color_hex)
-    # Determine if green or blue screen based on which channel is dominant
-    is_green = k_rgb[1] >= k_rgb[2]
-    
-    # bg_brightness is the expected value of the key channel in pure BG areas (0-255)
-    bg_val = bg_brightness / 255.0
-    if bg_val < 0.01:
-        bg_val = 0.01  # Prevent division by zero
-    
-    edge_factor = edge_softness / 100.0  # 0.0 = hard edge, 1.0 = soft edge
-    
-    for x in range(width):
-        if app_ref and app_ref.current_job_id != job_id:
-            return None
-        for y in range(height):
-            r_int, g_int, b_int, a_int = pixels[x, y]
-            r, g, b = r_int / 255.0, g_int / 255.0, b_int / 255.0
-            
-            # Get the key channel value
-            if is_green:
-                key_channel = g
-                other1, other2 = r, b
-            else:
-                key_channel = b
-                other1, other2 = r, g
-            
-            # Calculate alpha based on how much the key channel differs from expected
-            # A pure green pixel (0, 255, 0) on green screen has alpha = 0
-            # A 50% shadow (0, 127, 0) has alpha ≈ 0.5
-            # A solid object with low green has alpha = 1.0
-            
-            # FIXED: Only apply alpha extraction if green is DOMINANT (higher than both R and B)
-            # This prevents treating natural colors (skin, red objects) as green screen
-            max_other = max(other1, other2)
-            
-            # Pixel is "green screen" if green is higher than both R and B
-            if key_channel > max_other + 0.05 and key_channel > 0.1:
-                # This is likely BG or semi-transparent overlay on green
-                # Alpha = 1 - (key_channel / bg_brightness)
-                raw_alpha = 1.0 - (key_channel / bg_val)
-                
-                # Apply edge softness
-                if edge_factor > 0 and raw_alpha > 0 and raw_alpha < 1:
-                    raw_alpha = raw_alpha ** (1.0 / (1.0 + edge_factor))
-                
-                # Clamp alpha
-                if raw_alpha < 0:
-                    raw_alpha = 0.0
-                elif raw_alpha > 1:
-                    raw_alpha = 1.0
-                
-                # Estimate foreground color - FIXED: don't divide R/B by alpha
-                if raw_alpha > 0.01:
-                    bg_contribution = (1.0 - raw_alpha) * bg_val
-                    if is_green:
-                        fg_g = max(0, min(1, (g - bg_contribution) / raw_alpha)) if raw_alpha > 0 else 0
-                        fg_r = r  # Keep R as-is
-                        fg_b = b  # Keep B as-is
-                    else:
-                        fg_b = max(0, min(1, (b - bg_contribution) / raw_alpha)) if raw_alpha > 0 else 0
-                        fg_r = r
-                        fg_g = g
-                else:
-                    fg_r, fg_g, fg_b = 0, 0, 0
-                
-                final_alpha = int(raw_alpha * (a_int / 255.0) * 255)
-                
-                new_pixels[x, y] = (
-                    int(fg_r * 255),
-                    int(fg_g * 255),
-                    int(fg_b * 255),
-                    final_alpha
-                )
-            else:
-                # Non-green-dominant pixel = solid foreground, keep as-is
-                new_pixels[x, y] = (r_int, g_int, b_int, a_int)
-    
-    return new_img
 
 # ==========================================
-# PART 3: GUI APPLICATION
+# GUI APPLICATION
 # ==========================================
 
 class KeyingApp:
-    def __init__(self, root):
+    def __init__(self, root, cache_mb=image_list.DEFAULT_CACHE_MB, prefetch=image_list.DEFAULT_PREFETCH):
         self.root = root
         self.root.title("Python Keying Tool v15 (Drag & Drop)")
 
@@ -300,23 +88,43 @@ class KeyingApp:
 
         self.ui_ready = False 
         self.picking_mode = False
+        self.adding_key = False
         self.erasing_mode = False
         
         self.current_job_id = 0     
         self.pending_params = None  
+        self.pending_profile = None  # report path for the next preview job
+        self.profile_request = None  # --profile report path, taken by the first job
+        self.profiler = 'cprofile'   # --profiler
         self.is_processing = False  
 
         self.original_image = None
-        self.manual_mask = None     
+        self.mask = None            # preview.ManualMask (eraser) at full and preview size
         self.preview_image = None   
-        self.preview_mask = None    
         self.processed_preview = None 
+        self.preview_stages = timing.StageTimes()  # span timings of the last preview job
+        self.preview_peak = None    # bytes the last preview job added at its peak
+        self.timing_text = ""
+
+        # Working images reused by every job instead of a fresh copy per job
+        self.preview_buffers = preview.WorkBuffers()
+        self.full_buffers = preview.WorkBuffers()
         
         self.zoom_scale = 1.0
         self.canvas_image_id = None 
+
+        self.recorder = None  # session.SessionRecorder when started with --record
+        # Open images (files, folders); neighbours are decoded and keyed in the background
+        self.images = image_list.ImageList([], cache_mb, prefetch)
+        self.current_entry = None     # image_list.LoadedImage being shown
+        self.processed_params = None  # settings processed_preview was keyed with
+
+        self.sweep_window = None  # parameter sweep panel (open_sweep)
+        self.sweep_result = None
         
         self.current_mode = "Chroma" 
         self.key_color_hex = "#00FF00"
+        self.extra_keys = []  # more key colors sampled with "+ Key" / "Auto Keys"
         
         # New: View Mode (checker, black, white, alpha)
         self.view_mode = "Checker"
@@ -329,10 +137,38 @@ class KeyingApp:
         top_frame.pack(fill=tk.X)
         
         btn_opts = {'padx': 15, 'pady': 5}
-        tk.Button(top_frame, text="📂 Open Image", command=self.load_image, bg="white", **btn_opts).pack(side=tk.LEFT, padx=10)
-        self.btn_save = tk.Button(top_frame, text="💾 Save PNG", command=self.save_image, bg="#d0f0c0", **btn_opts)
+        tk.Button(top_frame, text="📂 Open Image", command=self.load_image, bg="white", **btn_opts).pack(side=tk.LEFT, padx=(10, 2))
+        tk.Button(top_frame, text="📁 Folder", command=self.load_folder, bg="white", **btn_opts).pack(side=tk.LEFT, padx=(2, 2))
+        tk.Button(top_frame, text="◀", command=lambda: self.step_image(-1), bg="white", pady=5).pack(side=tk.LEFT, padx=(8, 0))
+        self.var_image_pos = tk.StringVar(value="0 / 0")
+        tk.Label(top_frame, textvariable=self.var_image_pos, bg="#e0e0e0", width=8).pack(side=tk.LEFT)
+        tk.Button(top_frame, text="▶", command=lambda: self.step_image(1), bg="white", pady=5).pack(side=tk.LEFT, padx=(0, 10))
+        # Page Up / Page Down step through the open images
+        self.root.bind("<Prior>", lambda e: self.step_image(-1))
+        self.root.bind("<Next>", lambda e: self.step_image(1))
+        self.btn_save = tk.Button(top_frame, text="💾 Save Image", command=self.save_image, bg="#d0f0c0", **btn_opts)
         self.btn_save.pack(side=tk.LEFT, padx=10)
         tk.Button(top_frame, text="✂ Crop to Content", command=self.auto_crop, bg="#ffd0d0", **btn_opts).pack(side=tk.LEFT, padx=10)
+        tk.Button(top_frame, text="🎮 Export Shader", command=self.export_shader, bg="white", **btn_opts).pack(side=tk.LEFT, padx=10)
+        tk.Button(top_frame, text="▦ Sweep", command=self.open_sweep, bg="white", **btn_opts).pack(side=tk.LEFT, padx=10)
+
+        # Keying engine (default buffer); auto = fastest available backend (calibrated once)
+        engines = ['auto'] + [name for name, b in backends.BACKENDS.items() if b.available]
+        self.var_backend = tk.StringVar(value=os.environ.get(backends.BACKEND_ENV, backends.DEFAULT_BACKEND))
+        ttk.OptionMenu(top_frame, self.var_backend, self.var_backend.get(), *engines,
+                       command=lambda _: self.change_backend()).pack(side=tk.RIGHT, padx=10)
+        tk.Label(top_frame, text="Engine:", bg="#e0e0e0").pack(side=tk.RIGHT)
+
+        # Encode speed vs file size for saved PNG/WebP files
+        self.var_compression = tk.StringVar(value=export.DEFAULT_COMPRESSION)
+        ttk.OptionMenu(top_frame, self.var_compression, export.DEFAULT_COMPRESSION,
+                       *export.COMPRESSION_PROFILES).pack(side=tk.RIGHT, padx=10)
+        tk.Label(top_frame, text="Export:", bg="#e0e0e0").pack(side=tk.RIGHT)
+
+        # Profiles the next preview or save only, then switches itself off
+        self.var_profile = tk.BooleanVar(value=False)
+        tk.Checkbutton(top_frame, text="Profile next job", variable=self.var_profile,
+                       bg="#e0e0e0").pack(side=tk.RIGHT, padx=10)
         
         content = tk.Frame(self.root)
         content.pack(fill=tk.BOTH, expand=True)
@@ -371,7 +207,16 @@ class KeyingApp:
         self.btn_pick_custom.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(2, 0))
         
         self.lbl_color_preview = tk.Label(frm_ck, text="Current Color", bg=self.key_color_hex, fg="black", relief="sunken")
-        self.lbl_color_preview.pack(fill=tk.X, pady=(0, 10))
+        self.lbl_color_preview.pack(fill=tk.X, pady=(0, 5))
+
+        key_btn_frame = tk.Frame(frm_ck)
+        key_btn_frame.pack(fill=tk.X, pady=(0, 2))
+        self.btn_add_key = tk.Button(key_btn_frame, text="+ Key", command=self.activate_add_key)
+        self.btn_add_key.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 2))
+        tk.Button(key_btn_frame, text="Auto Keys", command=self.auto_keys).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(2, 2))
+        tk.Button(key_btn_frame, text="Clear Keys", command=self.clear_keys).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(2, 0))
+        self.lbl_keys = ttk.Label(frm_ck, text="1 key color", foreground="gray")
+        self.lbl_keys.pack(anchor=tk.W, pady=(0, 10))
 
         self.frm_eraser_size = tk.Frame(frm_ck)
         self.frm_eraser_size.pack(fill=tk.X, pady=(0, 10))
@@ -456,6 +301,32 @@ class KeyingApp:
         self.var_ds_luma = tk.BooleanVar(value=False)
         ttk.Checkbutton(frm_ds, text="Preserve Luminance", variable=self.var_ds_luma, command=self.trigger_update).pack(anchor=tk.W, pady=20)
 
+        # --- MATTE REFINEMENT TAB ---
+        self.tab_matte = ttk.Frame(self.notebook)
+        self.notebook.add(self.tab_matte, text='Matte')
+        frm_mt = tk.Frame(self.tab_matte, pady=10)
+        frm_mt.pack(fill=tk.X)
+
+        ttk.Label(frm_mt, text="Refine the keyed alpha channel", font=("Arial", 9, "italic")).pack(anchor=tk.W, pady=(0, 10))
+
+        ttk.Label(frm_mt, text="Choke (px):").pack(anchor=tk.W)
+        self.var_mt_choke = tk.IntVar(value=0)
+        tk.Scale(frm_mt, from_=0, to=50, variable=self.var_mt_choke, orient=tk.HORIZONTAL, command=lambda v: self.trigger_update()).pack(fill=tk.X)
+
+        ttk.Label(frm_mt, text="Grow (px):").pack(anchor=tk.W, pady=(10, 0))
+        self.var_mt_grow = tk.IntVar(value=0)
+        tk.Scale(frm_mt, from_=0, to=50, variable=self.var_mt_grow, orient=tk.HORIZONTAL, command=lambda v: self.trigger_update()).pack(fill=tk.X)
+
+        ttk.Label(frm_mt, text="Feather:").pack(anchor=tk.W, pady=(10, 0))
+        self.var_mt_feather = tk.DoubleVar(value=0.0)
+        tk.Scale(frm_mt, from_=0, to=50, resolution=0.5, variable=self.var_mt_feather, orient=tk.HORIZONTAL, command=lambda v: self.trigger_update()).pack(fill=tk.X)
+
+        ttk.Label(frm_mt, text="Blur:").pack(anchor=tk.W, pady=(10, 0))
+        self.var_mt_blur = tk.DoubleVar(value=0.0)
+        tk.Scale(frm_mt, from_=0, to=50, resolution=0.5, variable=self.var_mt_blur, orient=tk.HORIZONTAL, command=lambda v: self.trigger_update()).pack(fill=tk.X)
+
+        ttk.Label(frm_mt, text="Radii are in full-resolution pixels.", font=("Arial", 8), foreground="gray").pack(anchor=tk.W, pady=(15, 0))
+
         # --- RIGHT SIDE ---
         self.right_frame = tk.Frame(content, bg="#333333")
         self.right_frame.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
@@ -484,6 +355,7 @@ class KeyingApp:
         
         def set_view():
             self.view_mode = self.var_view.get()
+            if self.recorder: self.recorder.record('view', view=self.view_mode)
             self.redraw_canvas()
 
         tk.Radiobutton(view_frame, text="🏁 Checker", variable=self.var_view, value="Checker", command=set_view, bg="#555555", fg="white", selectcolor="#777777", activebackground="#666666", activeforeground="white").pack(side=tk.LEFT)
@@ -503,6 +375,7 @@ class KeyingApp:
         self.canvas.scan_mark(event.x, event.y)
 
     def on_pan_move(self, event):
+        if self.recorder: self.recorder.record('pan', x=event.x, y=event.y)
         self.canvas.scan_dragto(event.x, event.y, gain=1)
 
     def on_zoom(self, event):
@@ -515,15 +388,18 @@ class KeyingApp:
         elif delta < 0: self.zoom_scale /= zoom_factor
         if self.zoom_scale < 0.1: self.zoom_scale = 0.1
         if self.zoom_scale > 10.0: self.zoom_scale = 10.0
+        if self.recorder: self.recorder.record('zoom', zoom=self.zoom_scale)
         self.redraw_canvas()
 
     # --- TOOLS ---
 
     def reset_tools(self):
         self.picking_mode = False
+        self.adding_key = False
         self.erasing_mode = False
         self.canvas.config(cursor="arrow")
         self.btn_pick_screen.config(relief="raised", bg="SystemButtonFace")
+        self.btn_add_key.config(relief="raised", bg="SystemButtonFace")
         self.btn_eraser.config(relief="raised", bg="SystemButtonFace")
         # Hide eraser cursor circle
         self.canvas.delete("eraser_cursor")
@@ -537,6 +413,32 @@ class KeyingApp:
         self.status_var.set("PICKER: Click image to sample color.")
         self.btn_pick_screen.config(relief="sunken", bg="#cccccc")
 
+    def activate_add_key(self):
+        if not self.preview_image: return
+        self.reset_tools()
+        self.picking_mode = True
+        self.adding_key = True
+        self.canvas.config(cursor="crosshair")
+        self.status_var.set("ADD KEY: Click image to add another key color.")
+        self.btn_add_key.config(relief="sunken", bg="#cccccc")
+
+    def auto_keys(self):
+        if not self.original_image: return
+        self.reset_tools()
+        keys = chroma_key.sample_border_keys(self.original_image)
+        if not keys:
+            self.status_var.set("Auto Keys: no dominant border color found.")
+            return
+        # The most common border color becomes the main key
+        self.extra_keys = keys[1:]
+        self.set_key_color(keys[0])
+        self.status_var.set(f"Auto Keys: sampled {len(keys)} key color(s) from the border.")
+
+    def clear_keys(self):
+        self.extra_keys = []
+        self.update_color_preview()
+        self.trigger_update()
+
     def activate_eraser(self):
         if not self.preview_image: return
         self.reset_tools()
@@ -578,8 +480,12 @@ class KeyingApp:
                 try:
                     pixel = self.preview_image.getpixel((x, y))
                     hex_col = '#{:02x}{:02x}{:02x}'.format(pixel[0], pixel[1], pixel[2])
+                    adding = self.adding_key
                     self.reset_tools()
-                    self.set_key_color(hex_col)
+                    if adding:
+                        self.add_key_color(hex_col)
+                    else:
+                        self.set_key_color(hex_col)
                 except: pass
         
         elif self.erasing_mode:
@@ -622,49 +528,42 @@ class KeyingApp:
 
     def apply_eraser(self, x, y):
         size = self.var_eraser_size.get()
-        draw_prev = ImageDraw.Draw(self.preview_mask)
-        draw_prev.ellipse([x-size/2, y-size/2, x+size/2, y+size/2], fill=0)
-
-        scale_x = self.original_image.width / self.preview_image.width
-        scale_y = self.original_image.height / self.preview_image.height
-        
-        fx, fy = x * scale_x, y * scale_y
-        fsize = size * scale_x 
-        draw_full = ImageDraw.Draw(self.manual_mask)
-        draw_full.ellipse([fx-fsize/2, fy-fsize/2, fx+fsize/2, fy+fsize/2], fill=0)
+        if self.recorder: self.recorder.record('erase', x=x, y=y, size=size)
+        self.mask.erase(x, y, size)
 
         if self.processed_preview:
-            curr = self.processed_preview.copy()
-            r, g, b, a = curr.split()
-            new_a = ImageChops.multiply(a, self.preview_mask)
-            curr.putalpha(new_a)
-            self.processed_preview = curr
+            # The shown result is owned by the UI thread, so the dab is applied in place
+            preview.apply_mask(self.processed_preview, self.mask.preview)
             self.redraw_canvas()
 
     def auto_crop(self):
-        if not self.original_image or not self.manual_mask: return
+        if not self.original_image or not self.mask: return
         
         self.status_var.set("Cropping... Please wait.")
         self.root.update()
 
         params = self.get_params()
-        res = self.process_logic(self.original_image.copy(), params, -1)
-        if not res: return
+        if self.recorder: self.recorder.record('crop')
+        work = self.full_buffers.acquire(self.original_image)
+        res = self.process_logic(work, params, -1)
+        if not res:
+            self.full_buffers.release(work)
+            return
 
         try:
             bbox = res.getchannel('A').getbbox()
         except:
             bbox = res.split()[-1].getbbox()
+        self.full_buffers.release(work)
         
         if bbox:
             self.original_image = self.original_image.crop(bbox)
-            self.manual_mask = self.manual_mask.crop(bbox)
-            
-            self.preview_image = self.original_image.copy()
-            self.preview_image.thumbnail((400, 400))
-            
-            self.preview_mask = self.manual_mask.copy()
-            self.preview_mask = self.preview_mask.resize(self.preview_image.size, Image.Resampling.NEAREST)
+            self.preview_image = preview.make_preview(self.original_image)
+            self.mask.crop(bbox, self.preview_image.size)
+            if self.current_entry:
+                self.current_entry.original = self.original_image
+                self.current_entry.preview = self.preview_image
+                self.current_entry.set_keyed(None, None)
 
             self.zoom_scale = 1.0
             self.trigger_update()
@@ -682,34 +581,99 @@ class KeyingApp:
         self.update_color_preview()
         self.trigger_update()
 
+    def add_key_color(self, hex_code):
+        if hex_code.lower() != self.key_color_hex.lower() and hex_code not in self.extra_keys:
+            self.extra_keys.append(hex_code)
+        self.var_apply_chroma.set(True)
+        self.update_color_preview()
+        self.trigger_update()
+
     def update_color_preview(self):
         rgb = ImageColor.getrgb(self.key_color_hex)
         brightness = (rgb[0] * 299 + rgb[1] * 587 + rgb[2] * 114) / 1000
         txt = "black" if brightness > 125 else "white"
         self.lbl_color_preview.config(bg=self.key_color_hex, fg=txt, text=f"Key: {self.key_color_hex}")
+        count = 1 + len(self.extra_keys)
+        self.lbl_keys.config(text=f"{count} key color{'s' if count > 1 else ''}"
+                             + (f" (+{', '.join(self.extra_keys[:4])}{'…' if len(self.extra_keys) > 4 else ''})" if self.extra_keys else ""))
 
     def load_image(self):
-        path = filedialog.askopenfilename(filetypes=[("Images", "*.png *.jpg *.jpeg *.bmp *.gif *.webp")])
-        if path:
-            self.load_image_from_path(path)
+        paths = filedialog.askopenfilenames(filetypes=[("Images", " ".join("*" + ext for ext in image_list.IMAGE_EXTENSIONS))])
+        if paths:
+            self.open_paths(paths)
+
+    def load_folder(self):
+        folder = filedialog.askdirectory()
+        if folder:
+            self.open_paths([folder])
 
     def load_image_from_path(self, path):
         """Load an image from a file path (used by file dialog and drag-and-drop)"""
+        self.open_paths([path])
+
+    def open_paths(self, paths):
+        """Adds image files and folders to the open images and shows the first of them."""
+        index = self.images.add(paths)
+        if index is None:
+            exts = ', '.join(image_list.IMAGE_EXTENSIONS)
+            messagebox.showwarning("Invalid File", f"Please open an image file ({exts}) or a folder of them")
+            return
+        self.show_image(index)
+
+    def step_image(self, delta):
+        if len(self.images) > 1:
+            self.show_image(self.images.index + delta)
+
+    def show_image(self, index):
+        """Switches to image `index`, restoring its settings, eraser mask and last keyed preview."""
+        self.store_current_image()
         try:
-            self.original_image = Image.open(path).convert("RGBA")
-            self.manual_mask = Image.new("L", self.original_image.size, 255)
-            self.preview_image = self.original_image.copy()
-            self.preview_image.thumbnail((400, 400))
-            self.preview_mask = Image.new("L", self.preview_image.size, 255)
-            self.status_var.set(f"Loaded {os.path.basename(path)}")
-            self.zoom_scale = 1.0
-            self.trigger_update()
+            entry = self.images.open(index)
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load image:\n{str(e)}")
+            return
+        self.current_entry = entry
+        self.original_image = entry.original
+        self.preview_image = entry.preview
+        self.mask = entry.mask
+        if self.recorder: self.recorder.load(self.original_image)
+        if entry.params:
+            self.set_params(entry.params)
+        self.zoom_scale = 1.0
+        self.var_image_pos.set(f"{self.images.index + 1} / {len(self.images)}")
+        self.status_var.set(f"Loaded {entry.name}")
+
+        # Prefetched (or visited before) with these settings: show it without keying
+        params = self.get_params()
+        keyed = entry.keyed_for(params)
+        if keyed is not None and self.ui_ready:
+            self.current_job_id += 1  # a job still keying the previous image is superseded
+            # Replay has no cached previews: it keys the image with these settings instead
+            if self.recorder: self.recorder.update(params)
+            self.show_preview(keyed.copy(), timing.StageTimes(), None, params)
+            self.prefetch_images()
+        else:
+            self.trigger_update()
+
+    def store_current_image(self):
+        """Keeps the shown image's settings and keyed preview for when the user steps back."""
+        entry = self.current_entry
+        if entry is None:
+            return
+        entry.params = self.get_params()
+        if self.processed_preview is not None and self.processed_params is not None:
+            entry.set_keyed(self.processed_params, self.processed_preview)
+
+    def prefetch_images(self):
+        """Decodes and keys the neighbouring images with the current settings (UI thread)."""
+        if len(self.images) > 1:
+            self.images.prefetch(self.get_params())
 
     def setup_native_drag_drop(self):
         """Setup Windows native drag-and-drop using ctypes (no third-party packages)"""
         try:
+            load_win32()
+
             # Force the window to be fully created first
             self.root.update_idletasks()
             self.root.update()
@@ -781,25 +745,17 @@ class KeyingApp:
             file_count = shell32.DragQueryFileW(hdrop, 0xFFFFFFFF, None, 0)
             
             if file_count > 0:
-                # Get the first file path
+                # Collect every dropped file and folder
                 buffer_size = 260  # MAX_PATH
                 buffer = ctypes.create_unicode_buffer(buffer_size)
-                shell32.DragQueryFileW(hdrop, 0, buffer, buffer_size)
-                
-                # Store in local variable to avoid closure issues
-                file_path = str(buffer.value)
+                file_paths = []
+                for i in range(file_count):
+                    shell32.DragQueryFileW(hdrop, i, buffer, buffer_size)
+                    file_paths.append(str(buffer.value))
                 
-                # Check if it's an image file
-                valid_extensions = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp')
-                if file_path.lower().endswith(valid_extensions):
-                    # Use after() to handle in main thread - use default arg to capture value
-                    self.root.after(10, lambda p=file_path: self.load_image_from_path(p))
-                else:
-                    exts = ', '.join(valid_extensions)
-                    self.root.after(10, lambda: messagebox.showwarning(
-                        "Invalid File", 
-                        f"Please drop an image file ({exts})"
-                    ))
+                # Use after() to handle in main thread - use default arg to capture value
+                # (open_paths keeps the images and folders and warns if there are none)
+                self.root.after(10, lambda p=file_paths: self.open_paths(p))
             
             # Release the drop handle
             shell32.DragFinish(hdrop)
@@ -807,17 +763,46 @@ class KeyingApp:
             print(f"Drop handling error: {e}")
 
 
+    def change_backend(self):
+        try:
+            backend = backends.set_backend(self.var_backend.get())
+        except ValueError as e:
+            messagebox.showerror("Engine", str(e))
+            return
+        self.status_var.set(f"Keying engine: {backend.name}")
+        if self.recorder: self.recorder.record('backend', name=backend.name)
+        self.trigger_update()
+
     def on_tab_change(self, event):
         tab_id = self.notebook.index(self.notebook.select())
         if tab_id == 0:
             self.current_mode = "Chroma"
         elif tab_id == 1:
             self.current_mode = "AlphaExtract"
-        else:
+        elif tab_id == 2:
             self.current_mode = "Despill"
+        # The Matte tab refines whatever the previous tab keyed, so the mode stays
 
         self.trigger_update()
 
+    def set_params(self, params):
+        """Shows the keying settings of a get_params() dict (the mode follows the selected tab)."""
+        params = pipeline.resolve_params(params)
+        self.key_color_hex = params['ck_color']
+        self.extra_keys = list(params['ck_keys'])
+        for var, name in ((self.var_apply_chroma, 'apply_chroma'), (self.var_apply_despill, 'apply_despill'),
+                          (self.var_ds_color, 'ds_color'), (self.var_ds_method, 'ds_method'),
+                          (self.var_ds_luma, 'ds_luma'), (self.var_ck_lower, 'ck_low'),
+                          (self.var_ck_upper, 'ck_high'), (self.var_ck_shadow, 'ck_shadow'),
+                          (self.var_ck_high, 'ck_highlight'), (self.var_ck_invert, 'ck_invert'),
+                          (self.var_ck_maskonly, 'ck_maskonly'), (self.var_ae_enabled, 'ae_enabled'),
+                          (self.var_ae_brightness, 'ae_brightness'), (self.var_ae_softness, 'ae_softness'),
+                          (self.var_apply_alpha, 'apply_alpha'), (self.var_mt_choke, 'mt_choke'),
+                          (self.var_mt_grow, 'mt_grow'), (self.var_mt_feather, 'mt_feather'),
+                          (self.var_mt_blur, 'mt_blur')):
+            var.set(params[name])
+        self.update_color_preview()
+
     def get_params(self):
         return {
             'mode': self.current_mode,
@@ -827,6 +812,7 @@ class KeyingApp:
             'ds_method': self.var_ds_method.get(),
             'ds_luma': self.var_ds_luma.get(),
             'ck_color': self.key_color_hex,
+            'ck_keys': list(self.extra_keys),
             'ck_low': self.var_ck_lower.get(),
             'ck_high': self.var_ck_upper.get(),
             'ck_shadow': self.var_ck_shadow.get(),
@@ -837,78 +823,32 @@ class KeyingApp:
             'ae_enabled': self.var_ae_enabled.get(),
             'ae_brightness': self.var_ae_brightness.get(),
             'ae_softness': self.var_ae_softness.get(),
-            'apply_alpha': self.var_apply_alpha.get()
+            'apply_alpha': self.var_apply_alpha.get(),
+            # Matte refinement params
+            'mt_choke': self.var_mt_choke.get(),
+            'mt_grow': self.var_mt_grow.get(),
+            'mt_feather': self.var_mt_feather.get(),
+            'mt_blur': self.var_mt_blur.get()
         }
 
 
 
     def process_logic(self, img_obj, params, job_id):
-        monitor = self if job_id != -1 else None
-
-        if params['mode'] == 'Chroma':
-            if params['apply_chroma']:
-                k_lab = hex_to_lab(params['ck_color'])
-                img_obj = run_chromakey(
-                    img_obj, k_lab, 
-                    params['ck_low'], params['ck_high'], 
-                    params['ck_shadow'], params['ck_highlight'], 
-                    params['ck_invert'], params['ck_maskonly'],
-                    app_ref=monitor, job_id=job_id
-                )
-                if img_obj is None: return None
-            
-            if params['apply_alpha'] and not params['ck_maskonly']:
-                img_obj = run_alpha_extract(
-                    img_obj, params['ck_color'],
-                    params['ae_brightness'], params['ae_softness'],
-                    app_ref=monitor, job_id=job_id
-                )
-                if img_obj is None: return None
-            
-            if params['apply_despill'] and not params['ck_maskonly']:
-                img_obj = run_despill(
-                    img_obj, params['ds_color'], params['ds_method'], params['ds_luma'],
-                    app_ref=monitor, job_id=job_id
-                )
-
-        
-        elif params['mode'] == 'AlphaExtract':
-            if params['ae_enabled']:
-                img_obj = run_alpha_extract(
-                    img_obj, params['ck_color'],
-                    params['ae_brightness'], params['ae_softness'],
-                    app_ref=monitor, job_id=job_id
-                )
-                if img_obj is None:
-                    return None
-        
-        elif params['mode'] == 'Despill':
-            img_obj = run_despill(
-                img_obj, params['ds_color'], params['ds_method'], params['ds_luma'],
-                app_ref=monitor, job_id=job_id
-            )
-
-        if img_obj:
-            mask_to_use = None
-            if job_id == -1: 
-                mask_to_use = self.manual_mask
-            else:
-                mask_to_use = self.preview_mask
-
-            if mask_to_use:
-                if mask_to_use.size != img_obj.size:
-                    mask_to_use = mask_to_use.resize(img_obj.size)
-                
-                r, g, b, a = img_obj.split()
-                new_a = ImageChops.multiply(a, mask_to_use)
-                img_obj.putalpha(new_a)
-
-        return img_obj
+        # Preview jobs stop as soon as a newer job supersedes them; saves (-1) always finish
+        cancel = (lambda: self.current_job_id != job_id) if job_id != -1 else None
+        # Refinement radii are given in full-res pixels; scale them for the preview
+        scale = img_obj.width / self.original_image.width
+        return preview.process_job(img_obj, params, self.mask.for_size(img_obj.size),
+                                   cancel=cancel, refine_scale=scale)
 
     def trigger_update(self):
         if not self.ui_ready or not self.preview_image: return
         self.current_job_id += 1
+        # The preview of the shown image comes first; idle workers prefetch again afterwards
+        self.images.cancel_prefetch()
         self.pending_params = self.get_params()
+        if self.recorder: self.recorder.update(self.pending_params)
+        self.pending_profile = self.pending_profile or self.take_profile_request("preview")
         if not self.is_processing:
             self.status_var.set("Processing...")
             self.is_processing = True
@@ -919,51 +859,61 @@ class KeyingApp:
             current_params = self.pending_params
             this_job_id = self.current_job_id
             self.pending_params = None
-            res_img = self.process_logic(self.preview_image.copy(), current_params, this_job_id)
+            report, self.pending_profile = self.pending_profile, None
+            work = self.preview_buffers.acquire(self.preview_image)
+            with profiling.profiled(report, f"keying tool preview, {current_params}", self.profiler), \
+                    timing.span('preview_job', job=this_job_id), timing.collect() as stages, \
+                    profiling.PeakMemory() as peak:
+                res_img = self.process_logic(work, current_params, this_job_id)
+            if report:
+                self.root.after(0, lambda report=report: self.status_var.set(f"Profile written to {report}"))
+            if res_img is not work:
+                self.preview_buffers.release(work)
             if res_img is not None and this_job_id == self.current_job_id:
-                self.processed_preview = res_img 
-                self.root.after(0, self.redraw_canvas)
+                self.root.after(0, lambda res_img=res_img, stages=stages, peak=peak.bytes, params=current_params:
+                                self.show_preview(res_img, stages, peak, params))
+            else:
+                self.preview_buffers.release(res_img)
+                timing.instant('preview_superseded', job=this_job_id)
         
         self.is_processing = False
-        self.root.after(0, lambda: self.status_var.set("Ready."))
+        self.root.after(0, lambda: self.status_var.set(f"Ready. {self.timing_text}".rstrip()))
+        # Idle again: warm the neighbouring images with the settings just shown
+        self.root.after(0, self.prefetch_images)
+
+    def show_preview(self, res_img, stages, peak, params=None):
+        """Swaps in a finished preview (UI thread) and hands the previous buffer back."""
+        previous = self.processed_preview
+        self.processed_preview = res_img
+        self.processed_params = params
+        self.preview_stages = stages
+        self.preview_peak = peak
+        if previous is not res_img:
+            self.preview_buffers.release(previous)
+        self.redraw_canvas()
+
+    def show_timings(self, draw_stages):
+        """Status bar breakdown of the last preview job plus the redraw that showed it."""
+        stages = timing.StageTimes(self.preview_stages)
+        for name, seconds in draw_stages.items():
+            stages[name] = stages.get(name, 0.0) + seconds
+        stages.total = self.preview_stages.total + draw_stages.total
+        memory = profiling.describe_peak(self.preview_peak, self.preview_image.size)
+        self.timing_text = f"[{backends.current().name}] {stages.summary()}" + (f", {memory}" if memory else "")
+        if not self.is_processing:
+            self.status_var.set(f"Ready. {self.timing_text}")
 
     def redraw_canvas(self):
         if not self.processed_preview: return
-        orig_w, orig_h = self.processed_preview.size
-        new_w = int(orig_w * self.zoom_scale)
-        new_h = int(orig_h * self.zoom_scale)
-        zoomed_img = self.processed_preview.resize((new_w, new_h), Image.Resampling.BILINEAR)
-        
-        # --- VIEW MODE LOGIC ---
-        bg = None
-        if self.view_mode == "Checker":
-            bg = Image.new('RGBA', (new_w, new_h), (204, 204, 204, 255))
-            draw = ImageDraw.Draw(bg)
-            tile = int(20 * self.zoom_scale) 
-            if tile < 5: tile = 5 
-            for x in range(0, new_w, tile):
-                for y in range(0, new_h, tile):
-                    if (x // tile + y // tile) % 2 == 0:
-                        draw.rectangle([x, y, x+tile, y+tile], fill=(153, 153, 153, 255))
-            bg.alpha_composite(zoomed_img)
-
-        elif self.view_mode == "Black":
-            bg = Image.new('RGBA', (new_w, new_h), (0, 0, 0, 255))
-            bg.alpha_composite(zoomed_img)
-
-        elif self.view_mode == "White":
-            bg = Image.new('RGBA', (new_w, new_h), (255, 255, 255, 255))
-            bg.alpha_composite(zoomed_img)
-
-        elif self.view_mode == "Alpha":
-            # Extract Alpha and show as grayscale
-            try:
-                alpha = zoomed_img.getchannel('A')
-            except:
-                alpha = zoomed_img.split()[-1]
-            bg = alpha.convert("RGBA") # Convert grayscale mask to RGBA for Tkinter
-        
-        self.tk_img = ImageTk.PhotoImage(bg)
+        with timing.span('redraw'), timing.collect() as draw_stages:
+            self.draw_preview()
+        self.show_timings(draw_stages)
+
+    def draw_preview(self):
+        bg = preview.compose_view(self.processed_preview, self.zoom_scale, self.view_mode)
+
+        with timing.span('photoimage'):
+            self.tk_img = ImageTk.PhotoImage(bg)
         cw = self.canvas.winfo_width()
         ch = self.canvas.winfo_height()
         if self.canvas_image_id is None:
@@ -974,34 +924,203 @@ class KeyingApp:
 
     def save_image(self):
         if not self.original_image: return
-        path = filedialog.asksaveasfilename(defaultextension=".png", filetypes=[("PNG", "*.png")])
+        path = filedialog.asksaveasfilename(defaultextension=".png", filetypes=[
+            ("PNG", "*.png"), ("WebP (lossless)", "*.webp"),
+            ("Raw RGBA", "*.rgba"), ("NumPy array", "*.npy")])
         if not path: return
         self.btn_save.config(state=tk.DISABLED, text="Saving...")
         self.status_var.set("Processing Full Resolution...")
         params = self.get_params()
-        threading.Thread(target=self.bg_save, args=(path, params, -1), daemon=True).start()
+        report = self.take_profile_request("save")
+        compression = self.var_compression.get()
+        threading.Thread(target=self.bg_save, args=(path, params, -1, report, compression), daemon=True).start()
+
+    def export_shader(self):
+        """Writes the current settings as a Godot runtime keying shader (after its self-check)."""
+        import godot_shader
+        path = filedialog.asksaveasfilename(defaultextension=".gdshader", filetypes=[("Godot shader", "*.gdshader")])
+        if not path: return
+        params = self.get_params()
+        self.status_var.set("Checking shader against the offline keyer...")
+        self.root.update_idletasks()
+        try:
+            passed, worst = godot_shader.export_shader(params, path, "the keying tool")
+        except Exception as e:
+            messagebox.showerror("Error", str(e))
+            self.status_var.set("Shader export failed.")
+            return
+        if not passed:
+            messagebox.showerror("Error", f"Shader self-check failed (difference {worst}/255); nothing written.")
+            self.status_var.set("Shader export failed.")
+            return
+        skipped = godot_shader.unsupported(params)
+        note = f" Not in the shader: {', '.join(skipped)}." if skipped else ""
+        self.status_var.set(f"Wrote {path} (max difference {worst}/255).{note}")
+
+    # --- Parameter sweep panel ---
+
+    def open_sweep(self):
+        """Opens (or raises) the sweep panel, prefilled with the current settings."""
+        if not self.original_image: return
+        if self.sweep_window is not None and self.sweep_window.winfo_exists():
+            self.sweep_window.lift()
+            return
+        win = self.sweep_window = tk.Toplevel(self.root)
+        win.title("Parameter Sweep")
+        form = tk.Frame(win, padx=10, pady=10)
+        form.pack(fill=tk.X)
+        params = self.get_params()
+        despill = pipeline.DESPILL_METHODS[params['ds_method']] if params['apply_despill'] else 'none'
+        fields = [
+            ('lower', "Lower", f"{max(0, params['ck_low'] - 10):g}:{params['ck_low'] + 10:g}:4"),
+            ('upper', "Upper", f"{max(0, params['ck_high'] - 10):g}:{params['ck_high'] + 10:g}:4"),
+            ('shadows', "Shadows", f"{params['ck_shadow']:g}"),
+            ('highlights', "Highlights", f"{params['ck_highlight']:g}"),
+            ('despill', "Despill", despill),
+        ]
+        self.sweep_vars = {}
+        for row, (name, label, default) in enumerate(fields):
+            tk.Label(form, text=label + ":").grid(row=row, column=0, sticky=tk.W)
+            var = self.sweep_vars[name] = tk.StringVar(value=default)
+            tk.Entry(form, textvariable=var, width=24).grid(row=row, column=1, sticky=tk.W)
+        tk.Label(form, text="Values: 10,15,20 or start:stop:step. Despill: " + ", ".join(sweep.DESPILL_CHOICES),
+                 font=("Arial", 8)).grid(row=len(fields), column=0, columnspan=2, sticky=tk.W)
+        self.btn_sweep = tk.Button(form, text="Render", command=self.run_sweep, bg="#d0f0c0")
+        self.btn_sweep.grid(row=0, column=2, rowspan=2, padx=10)
+        self.sweep_status = tk.StringVar(value="Click a cell to use its settings.")
+        tk.Label(win, textvariable=self.sweep_status, anchor=tk.W).pack(fill=tk.X, padx=10)
+        self.sweep_canvas = tk.Canvas(win, bg="#333333", width=800, height=500)
+        self.sweep_canvas.pack(fill=tk.BOTH, expand=True)
+        self.sweep_canvas.bind("<Button-1>", self.on_sweep_click)
+
+    def run_sweep(self):
+        try:
+            axes = {name: sweep.parse_values(var.get(), str if name == 'despill' else float)
+                    for name, var in self.sweep_vars.items()}
+            bad = [m for m in axes['despill'] if m not in sweep.DESPILL_CHOICES]
+            if bad:
+                raise ValueError(f"Unknown despill method(s): {', '.join(bad)}")
+        except ValueError as e:
+            messagebox.showerror("Sweep", str(e), parent=self.sweep_window)
+            return
+        self.btn_sweep.config(state=tk.DISABLED)
+        self.sweep_status.set("Rendering...")
+        params = self.get_params()
+        view = self.view_mode
+        threading.Thread(target=self.bg_sweep, args=(self.original_image, params, axes, view), daemon=True).start()
 
-    def bg_save(self, path, params, job_id):
+    def bg_sweep(self, img, params, axes, view):
         try:
-            final = self.process_logic(self.original_image.copy(), params, job_id)
+            result = sweep.run_sweep(img, params, axes, view_mode=view)
+            self.root.after(0, lambda: self.show_sweep(params, *result))
+        except Exception as e:
+            msg = str(e)
+            self.root.after(0, lambda msg=msg: self.show_sweep_error(msg))
+
+    def show_sweep_error(self, error):
+        if not self.sweep_window.winfo_exists(): return
+        self.btn_sweep.config(state=tk.NORMAL)
+        self.sweep_status.set(f"Sweep failed: {error}")
+
+    def show_sweep(self, params, sheet, cells, columns, thumb_size, seconds):
+        if not self.sweep_window.winfo_exists(): return
+        self.btn_sweep.config(state=tk.NORMAL)
+        self.sweep_result = (params, cells, columns, thumb_size)
+        self.sweep_tk_img = ImageTk.PhotoImage(sheet)
+        self.sweep_canvas.delete("all")
+        self.sweep_canvas.create_image(0, 0, image=self.sweep_tk_img, anchor=tk.NW)
+        self.sweep_canvas.config(width=min(sheet.width, 1400), height=min(sheet.height, 900))
+        self.sweep_status.set(f"{len(cells)} cells in {seconds:.2f}s. Click a cell to use its settings.")
+
+    def on_sweep_click(self, event):
+        if not self.sweep_result: return
+        params, cells, columns, thumb_size = self.sweep_result
+        index = sweep.cell_at(event.x, event.y, columns, thumb_size, len(cells))
+        if index is None: return
+        chosen = sweep.cell_params(params, cells[index])
+        self.var_ck_lower.set(chosen['ck_low'])
+        self.var_ck_upper.set(chosen['ck_high'])
+        self.var_ck_shadow.set(chosen['ck_shadow'])
+        self.var_ck_high.set(chosen['ck_highlight'])
+        self.var_apply_despill.set(chosen['apply_despill'])
+        self.var_ds_method.set(chosen['ds_method'])
+        self.sweep_status.set("Using " + ", ".join(f"{k} {v}" for k, v in cells[index].items()))
+        self.trigger_update()
+
+    def take_profile_request(self, kind):
+        """
+        Report path for this job: the --profile path if no job took it yet,
+        else a temp file if 'Profile next job' is ticked (and unticks it),
+        else None.
+        """
+        if self.profile_request:
+            report, self.profile_request = self.profile_request, None
+            return report
+        if not self.var_profile.get():
+            return None
+        self.var_profile.set(False)
+        return os.path.join(tempfile.gettempdir(), f"keying_profile_{time.strftime('%Y%m%d_%H%M%S')}_{kind}.txt")
+
+    def bg_save(self, path, params, job_id, report=None, compression=export.DEFAULT_COMPRESSION):
+        work = self.full_buffers.acquire(self.original_image)
+        try:
+            with profiling.profiled(report, f"keying tool save to {path}, {params}", self.profiler), \
+                    timing.span('save_job', path=path), timing.collect() as stages, \
+                    profiling.PeakMemory() as peak:
+                final = self.process_logic(work, params, job_id)
+                if final:
+                    channels = pipeline.export_channels(params)
+                    _, size = export.save_image(final, path, compression, channels)
             if final:
-                final.save(path, "PNG")
-                self.root.after(0, lambda: self.save_finished(path, None))
+                memory = ", ".join(part for part in (
+                    export.format_size(size), profiling.describe_peak(peak.bytes, final.size)) if part)
+                self.root.after(0, lambda: self.save_finished(path, None, stages, report, memory))
             else:
                 self.root.after(0, lambda: self.save_finished(None, "Process aborted."))
         except Exception as e:
-            self.root.after(0, lambda: self.save_finished(None, str(e)))
+            msg = str(e)
+            self.root.after(0, lambda msg=msg: self.save_finished(None, msg))
+        finally:
+            self.full_buffers.release(work)
 
-    def save_finished(self, path, error):
-        self.btn_save.config(state=tk.NORMAL, text="💾 Save PNG")
+    def save_finished(self, path, error, stages=None, report=None, memory=""):
+        self.btn_save.config(state=tk.NORMAL, text="💾 Save Image")
         if error:
             messagebox.showerror("Error", error)
             self.status_var.set("Error saving.")
         else:
             messagebox.showinfo("Success", f"Saved to {path}")
-            self.status_var.set(f"Saved to {path}")
+            details = ", ".join(part for part in (stages.summary() if stages else "", memory) if part)
+            self.status_var.set(f"Saved to {path}. {details}" if details else f"Saved to {path}")
+            if report:
+                self.status_var.set(f"Saved to {path}. Profile written to {report}")
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Python Keying Tool")
+    backends.add_backend_arguments(parser)
+    timing.add_trace_arguments(parser)
+    profiling.add_profile_arguments(parser)
+    parser.add_argument("--record", metavar="SESSION",
+                        help="Record this session (image, parameter changes, zoom, eraser) for session.py replay")
+    parser.add_argument("images", nargs="*", help="Images or folders to open (step with Page Up / Page Down)")
+    parser.add_argument("--cache-mb", type=float, default=image_list.DEFAULT_CACHE_MB,
+                        help=f"Memory kept for open images (default {image_list.DEFAULT_CACHE_MB} MB)")
+    parser.add_argument("--prefetch", type=int, default=image_list.DEFAULT_PREFETCH,
+                        help=f"Images decoded and keyed ahead on each side (default {image_list.DEFAULT_PREFETCH})")
+    args = parser.parse_args()
+    # Selected before the window opens so the engine menu shows it
+    backends.apply_backend_args(args)
+    timing.apply_trace_args(args)
+    profiling.apply_profile_args(args)
+
     root = tk.Tk()
-    app = KeyingApp(root)
-    root.mainloop()
\ No newline at end of file
+    app = KeyingApp(root, args.cache_mb, args.prefetch)
+    app.profile_request, app.profiler = args.profile, args.profiler
+    if args.record:
+        from session import SessionRecorder
+        app.recorder = SessionRecorder(args.record)
+    if args.images:
+        root.after(200, lambda: app.open_paths(args.images))
+    root.mainloop()
+    app.images.shutdown()
\ No newline at end of file
@@ -1,137 +1,22 @@
+import os
+import tempfile
+import time
 import tkinter as tk
 from tkinter import ttk, filedialog, colorchooser, messagebox
-from PIL import Image, ImageTk, ImageColor
-import math
-import sys
-import threading
+from PIL import Image, ImageTk
+import backends
+import profiling
+from pipeline import DESPILL_METHODS, chromakey_image, despill_image
 
 # ==========================================
-# CORE IMAGE PROCESSING LOGIC (Pure Python)
+# IMAGE PROCESSING (shared engine, see keying_core.py)
 # ==========================================
 
-# --- Math Constants ---
-Xn, Yn, Zn = 95.0489, 100.0, 108.8840
-DELTA = 0.20689655172
-DELTA_3 = DELTA ** 3
-DELTA_2 = DELTA ** 2
-
-# --- Helper Functions ---
-
-def linearize_srgb(v):
-    if v <= 0.04045: return v / 12.92
-    return ((v + 0.055) / 1.055) ** 2.4
-
-def func_lab(t):
-    if t > DELTA_3: return t ** (1.0 / 3.0)
-    return (t / (3.0 * DELTA_2)) + (4.0 / 29.0)
-
-def rgb_to_lab(r, g, b):
-    # 1. Linearize
-    lin_r = linearize_srgb(r)
-    lin_g = linearize_srgb(g)
-    lin_b = linearize_srgb(b)
-    
-    # 2. XYZ
-    x = (lin_r * 0.4124 + lin_g * 0.3576 + lin_b * 0.1805) * 100.0
-    y = (lin_r * 0.2126 + lin_g * 0.7152 + lin_b * 0.0722) * 100.0
-    z = (lin_r * 0.0193 + lin_g * 0.1192 + lin_b * 0.9505) * 100.0
-    
-    # 3. Lab
-    l_val = 116.0 * func_lab(y / Yn) - 16.0
-    a_val = 500.0 * (func_lab(x / Xn) - func_lab(y / Yn))
-    b_val = 200.0 * (func_lab(y / Yn) - func_lab(z / Zn))
-    return l_val, a_val, b_val
-
-def clamp(val, min_v=0, max_v=255):
-    return max(min_v, min(max_v, int(val)))
-
-# --- Processing Engines ---
-
 def run_despill(img, key_color, method, preserve_luma):
-    width, height = img.size
-    pixels = img.load()
-    new_img = Image.new("RGBA", (width, height))
-    new_pixels = new_img.load()
-    
-    luma_r, luma_g, luma_b = 0.2126, 0.7152, 0.0722
-
-    for x in range(width):
-        for y in range(height):
-            r_int, g_int, b_int, a_int = pixels[x, y]
-            r, g, b = r_int/255.0, g_int/255.0, b_int/255.0
-            
-            orig_r, orig_g, orig_b = r, g, b
-            limit = 0.0
-
-            if key_color == 'Green':
-                if method == 'Average': limit = (r + b) / 2.0
-                elif method == 'Double Red': limit = (2.0 * r + b) / 3.0
-                elif method == 'Double Average': limit = (2.0 * b + r) / 3.0
-                elif method == 'Limit': limit = b
-                if g > limit: g = limit
-            else: # Blue
-                if method == 'Average': limit = (r + g) / 2.0
-                elif method == 'Double Red': limit = (2.0 * r + g) / 3.0
-                elif method == 'Double Average': limit = (2.0 * g + r) / 3.0
-                elif method == 'Limit': limit = g
-                if b > limit: b = limit
-
-            if preserve_luma:
-                diff_r, diff_g, diff_b = orig_r - r, orig_g - g, orig_b - b
-                luma = (abs(diff_r)*luma_r) + (abs(diff_g)*luma_g) + (abs(diff_b)*luma_b)
-                r += luma; g += luma; b += luma
-
-            new_pixels[x, y] = (clamp(r*255), clamp(g*255), clamp(b*255), a_int)
-    
-    return new_img
+    return despill_image(img, key_color.lower(), DESPILL_METHODS[method], preserve_luma)
 
 def run_chromakey(img, hex_color, lower, upper, shadows, highlights, invert, mask_only):
-    width, height = img.size
-    pixels = img.load()
-    new_img = Image.new("RGBA", (width, height))
-    new_pixels = new_img.load()
-
-    # Pre-calc key Lab
-    k_rgb = ImageColor.getrgb(hex_color)
-    key_lab = rgb_to_lab(k_rgb[0]/255.0, k_rgb[1]/255.0, k_rgb[2]/255.0)
-
-    for x in range(width):
-        for y in range(height):
-            r_int, g_int, b_int, a_int = pixels[x, y]
-            r, g, b = r_int/255.0, g_int/255.0, b_int/255.0
-            
-            # Un-multiply alpha
-            if a_int > 0:
-                alpha_f = a_int / 255.0
-                pix_lab = rgb_to_lab(r/alpha_f, g/alpha_f, b/alpha_f)
-            else:
-                pix_lab = rgb_to_lab(r, g, b)
-
-            # Distance
-            diff_L = key_lab[0] - pix_lab[0]
-            diff_a = key_lab[1] - pix_lab[1]
-            diff_b = key_lab[2] - pix_lab[2]
-            dist = math.sqrt(diff_L**2 + diff_a**2 + diff_b**2)
-
-            # Mask
-            mask = 1.0
-            if dist < lower: mask = 0.0
-            elif dist < upper: mask = (dist - lower) / (upper - lower)
-            
-            # Shadows/Highlights
-            mask = shadows * 0.01 * (highlights * 0.01 * mask - 1.0) + 1.0
-            mask = max(0.0, min(1.0, mask))
-
-            if invert: mask = 1.0 - mask
-
-            if mask_only:
-                val = int(mask * 255)
-                new_pixels[x, y] = (val, val, val, 255)
-            else:
-                new_a = int(a_int * mask)
-                new_pixels[x, y] = (r_int, g_int, b_int, new_a)
-
-    return new_img
+    return chromakey_image(img, hex_color, lower, upper, shadows, highlights, invert, mask_only)
 
 # ==========================================
 # GUI APPLICATION
@@ -149,6 +34,8 @@ class KeyingApp:
         self.processed_preview = None
         self.current_mode = "Despill" # or "Chroma"
         self.key_color_hex = "#00FF00"
+        self.profile_request = None  # --profile report path, taken by the first job
+        self.profiler = 'cprofile'   # --profiler
         
         # Layout
         self.setup_ui()
@@ -159,6 +46,17 @@ class KeyingApp:
         top_frame.pack(fill=tk.X)
         tk.Button(top_frame, text="Open Image", command=self.load_image).pack(side=tk.LEFT, padx=10)
         tk.Button(top_frame, text="Save Result", command=self.save_image, bg="#dddddd").pack(side=tk.LEFT, padx=10)
+
+        # Keying engine (default buffer); auto = fastest available backend (calibrated once)
+        engines = ['auto'] + [name for name, b in backends.BACKENDS.items() if b.available]
+        self.var_backend = tk.StringVar(value=os.environ.get(backends.BACKEND_ENV, backends.DEFAULT_BACKEND))
+        ttk.OptionMenu(top_frame, self.var_backend, self.var_backend.get(), *engines,
+                       command=lambda _: self.change_backend()).pack(side=tk.RIGHT, padx=10)
+        tk.Label(top_frame, text="Engine:").pack(side=tk.RIGHT)
+
+        # Profiles the next preview or save only, then switches itself off
+        self.var_profile = tk.BooleanVar(value=False)
+        tk.Checkbutton(top_frame, text="Profile next job", variable=self.var_profile).pack(side=tk.RIGHT, padx=10)
         
         # Main Content
         content = tk.Frame(self.root)
@@ -261,6 +159,15 @@ class KeyingApp:
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load image: {e}")
 
+    def change_backend(self):
+        try:
+            backend = backends.set_backend(self.var_backend.get())
+        except ValueError as e:
+            messagebox.showerror("Engine", str(e))
+            return
+        self.status_var.set(f"Keying engine: {backend.name}")
+        self.trigger_update()
+
     def on_tab_change(self, event):
         tab_id = self.notebook.index(self.notebook.select())
         self.current_mode = "Despill" if tab_id == 0 else "Chroma"
@@ -277,14 +184,30 @@ class KeyingApp:
         
         # Gather params
         params = self.get_params()
+        report = self.take_profile_request("preview")
         
         # Run processing directly (threading is better but adds complexity to sync)
         # Given the "thumbnail" approach, this should be tolerable.
-        res_img = self.process_image(self.preview_image.copy(), params)
+        with profiling.profiled(report, f"keying tool preview, {params}", self.profiler):
+            res_img = self.process_image(self.preview_image.copy(), params)
         
         # Update Canvas
         self.display_image(res_img)
-        self.status_var.set("Preview Updated.")
+        self.status_var.set(f"Preview Updated. Profile written to {report}" if report else "Preview Updated.")
+
+    def take_profile_request(self, kind):
+        """
+        Report path for this job: the --profile path if no job took it yet,
+        else a temp file if 'Profile next job' is ticked (and unticks it),
+        else None.
+        """
+        if self.profile_request:
+            report, self.profile_request = self.profile_request, None
+            return report
+        if not self.var_profile.get():
+            return None
+        self.var_profile.set(False)
+        return os.path.join(tempfile.gettempdir(), f"keying_profile_{time.strftime('%Y%m%d_%H%M%S')}_{kind}.txt")
 
     def get_params(self):
         return {
@@ -334,16 +257,27 @@ class KeyingApp:
 
         try:
             params = self.get_params()
+            report = self.take_profile_request("save")
             # Process the original FULL SIZE image
-            final_img = self.process_image(self.original_image.copy(), params)
-            final_img.save(path)
+            with profiling.profiled(report, f"keying tool save to {path}, {params}", self.profiler):
+                final_img = self.process_image(self.original_image.copy(), params)
+                final_img.save(path)
             messagebox.showinfo("Success", f"Saved to {path}")
-            self.status_var.set("Saved.")
+            self.status_var.set(f"Saved. Profile written to {report}" if report else "Saved.")
         except Exception as e:
             messagebox.showerror("Error", str(e))
             self.status_var.set("Error saving.")
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Python Keying Tool")
+    backends.add_backend_arguments(parser)
+    profiling.add_profile_arguments(parser)
+    args = parser.parse_args()
+    backends.apply_backend_args(args)
+    profiling.apply_profile_args(args)
+
     root = tk.Tk()
     app = KeyingApp(root)
+    app.profile_request, app.profiler = args.profile, args.profiler
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,172 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageChops, ImageFilter
+from timing import span
+
+# ==========================================
+# MATTE REFINEMENT (Choke / Grow / Feather / Blur)
+# ==========================================
+# All operations work on a single "L" band (the alpha channel) and cost the
+# same whatever the radius:
+#   - Erode/Dilate use a separable min/max filter built from power-of-two
+#     window doubling, so a radius r costs O(log r) C-level band operations.
+#   - Blur uses Pillow's GaussianBlur, which is an extended box blur
+#     (running sums), so it does not depend on the radius either.
+# Large images are split into horizontal strips with a halo wide enough for
+# the whole chain, refined in parallel and pasted back.
+
+STRIP_HEIGHT = 256
+
+def _pad_edges(band, radius, horizontal):
+    """Pads a band by `radius` pixels on both sides, replicating the edge pixels."""
+    w, h = band.size
+    if horizontal:
+        out = Image.new("L", (w + 2 * radius, h))
+        out.paste(band, (radius, 0))
+        out.paste(band.crop((0, 0, 1, h)).resize((radius, h), Image.Resampling.NEAREST), (0, 0))
+        out.paste(band.crop((w - 1, 0, w, h)).resize((radius, h), Image.Resampling.NEAREST), (w + radius, 0))
+    else:
+        out = Image.new("L", (w, h + 2 * radius))
+        out.paste(band, (0, radius))
+        out.paste(band.crop((0, 0, w, 1)).resize((w, radius), Image.Resampling.NEAREST), (0, 0))
+        out.paste(band.crop((0, h - 1, w, h)).resize((w, radius), Image.Resampling.NEAREST), (0, h + radius))
+    return out
+
+def _shifted(band, offset, size, horizontal):
+    """Window of `size` starting `offset` pixels in along one axis."""
+    if horizontal:
+        return band.crop((offset, 0, offset + size[0], size[1]))
+    return band.crop((0, offset, size[0], offset + size[1]))
+
+def _extreme_1d(band, radius, op, horizontal):
+    """
+    Min (op=darker) or max (op=lighter) over a 2*radius+1 window along one axis.
+    acc holds the extreme over [x, x + span), doubled until it covers the window;
+    two overlapping spans then cover it exactly.
+    """
+    size = band.size
+    window = 2 * radius + 1
+    padded = _pad_edges(band, radius, horizontal)
+    padded_size = padded.size
+
+    acc = padded
+    span = 1
+    while span * 2 <= window:
+        acc = op(acc, _shifted(acc, span, padded_size, horizontal))
+        span *= 2
+
+    return op(_shifted(acc, 0, size, horizontal), _shifted(acc, window - span, size, horizontal))
+
+def erode(band, radius):
+    """Chokes the matte: square min filter of the given radius (pixels)."""
+    radius = int(radius)
+    if radius <= 0:
+        return band
+    band = _extreme_1d(band, radius, ImageChops.darker, True)
+    return _extreme_1d(band, radius, ImageChops.darker, False)
+
+def dilate(band, radius):
+    """Grows the matte: square max filter of the given radius (pixels)."""
+    radius = int(radius)
+    if radius <= 0:
+        return band
+    band = _extreme_1d(band, radius, ImageChops.lighter, True)
+    return _extreme_1d(band, radius, ImageChops.lighter, False)
+
+def blur(band, radius):
+    """Gaussian-like blur (3-pass extended box blur)."""
+    if radius <= 0:
+        return band
+    return band.filter(ImageFilter.GaussianBlur(radius))
+
+def feather(band, radius):
+    """
+    Softens the matte edge inwards: the matte is choked by `radius` and then
+    blurred by the same amount, and never exceeds the original matte, so no
+    halo is added outside the keyed edge.
+    """
+    if radius <= 0:
+        return band
+    soft = blur(erode(band, math.ceil(radius)), radius)
+    return ImageChops.darker(soft, band)
+
+def _blur_halo(radius):
+    if radius <= 0:
+        return 0
+    return int(math.ceil(3.0 * radius)) + 4
+
+def refine_halo(choke=0, grow=0, feather_radius=0, blur_radius=0):
+    """Number of extra rows a strip needs so that refining it matches the full image."""
+    halo = int(choke) + int(grow) + _blur_halo(blur_radius)
+    if feather_radius > 0:
+        halo += int(math.ceil(feather_radius)) + _blur_halo(feather_radius)
+    return halo
+
+def _refine_band(band, choke, grow, feather_radius, blur_radius):
+    band = erode(band, choke)
+    band = dilate(band, grow)
+    band = feather(band, feather_radius)
+    band = blur(band, blur_radius)
+    return band
+
+def refine_alpha(alpha, choke=0, grow=0, feather_radius=0, blur_radius=0, workers=None, strip_height=STRIP_HEIGHT):
+    """
+    Refines an "L" matte: choke, then grow, then feather, then blur.
+    Strips of `strip_height` rows are processed in parallel with halos.
+    """
+    if choke <= 0 and grow <= 0 and feather_radius <= 0 and blur_radius <= 0:
+        return alpha
+
+    width, height = alpha.size
+    if height <= strip_height:
+        return _refine_band(alpha, choke, grow, feather_radius, blur_radius)
+
+    halo = refine_halo(choke, grow, feather_radius, blur_radius)
+    result = Image.new("L", alpha.size)
+
+    def run_strip(y0):
+        y1 = min(y0 + strip_height, height)
+        top = max(0, y0 - halo)
+        bottom = min(height, y1 + halo)
+        refined = _refine_band(alpha.crop((0, top, width, bottom)), choke, grow, feather_radius, blur_radius)
+        return y0, refined.crop((0, y0 - top, width, y1 - top))
+
+    # Pillow releases the GIL inside its filters, so threads scale here
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for y0, strip in pool.map(run_strip, range(0, height, strip_height)):
+            result.paste(strip, (0, y0))
+
+    return result
+
+def refine_image(img, choke=0, grow=0, feather_radius=0, blur_radius=0, workers=None):
+    """Refines the alpha channel of an RGBA image in place and returns it."""
+    if choke <= 0 and grow <= 0 and feather_radius <= 0 and blur_radius <= 0:
+        return img
+    with span('refine'):
+        img.putalpha(refine_alpha(img.getchannel("A"), choke, grow, feather_radius, blur_radius, workers))
+    return img
+
+# --- CLI helpers ---
+
+def add_refine_arguments(parser):
+    """Adds the matte refinement options to an argparse parser."""
+    group = parser.add_argument_group("Matte refinement")
+    group.add_argument("--choke", type=int, default=0,
+                       help="Erode the matte by this many pixels")
+    group.add_argument("--grow", type=int, default=0,
+                       help="Dilate the matte by this many pixels")
+    group.add_argument("--feather", type=float, default=0.0,
+                       help="Soften the matte edge inwards by this radius")
+    group.add_argument("--blur", type=float, default=0.0,
+                       help="Gaussian-like blur radius applied to the matte")
+    return group
+
+def refine_args(args):
+    """Returns the refinement settings from parsed CLI args as keyword arguments."""
+    return {
+        'choke': args.choke,
+        'grow': args.grow,
+        'feather_radius': args.feather,
+        'blur_radius': args.blur,
+    }
@@ -0,0 +1,275 @@
+import argparse
+import os
+import sys
+from PIL import Image
+
+from backends import add_backend_arguments, apply_backend_args
+from build_cache import add_cache_arguments, backend_param, run_cached
+from export import add_export_arguments, save_output
+from game_export import add_variant_arguments, check_sizes, describe, export_variants
+from timing import add_trace_arguments, apply_trace_args, span
+from watch import add_watch_arguments, watch_cli
+from alpha_extract import add_alpha_extract_arguments, alpha_extract_image, alpha_extract_stage
+from chroma_key import add_chroma_arguments, check_chroma_args, chroma_stage, chromakey_image
+from despill import add_despill_arguments, despill_image, despill_stage
+from matte_ops import add_refine_arguments, refine_args, refine_image
+
+# ==========================================
+# CHAINED PIPELINE (one process, one buffer)
+# ==========================================
+# Usage:
+#   python pipeline.py input.png output.png chroma --color "#5fb356" despill
+#   python pipeline.py in.png out.png alpha-extract --bg-brightness 230 matte --choke 1 despill -m limit
+#
+# Each stage name is followed by that stage's own options (the same options
+# as the standalone CLI). The image is decoded once, converted to RGBA once,
+# passed through every stage in memory and encoded once at the end.
+
+def matte_stage(img, args):
+    """Refines the alpha channel of an in-memory RGBA image."""
+    return refine_image(img, **refine_args(args))
+
+# name -> (add_arguments, run)
+STAGES = {
+    'chroma': (add_chroma_arguments, chroma_stage),
+    'alpha-extract': (add_alpha_extract_arguments, alpha_extract_stage),
+    'despill': (add_despill_arguments, despill_stage),
+    'matte': (add_refine_arguments, matte_stage),
+}
+
+# name -> check(args), raising ValueError for option combinations the stage rejects
+STAGE_CHECKS = {
+    'chroma': check_chroma_args,
+}
+
+def split_stages(argv):
+    """Splits `argv` at stage names: returns [(name, [stage args...]), ...]."""
+    stages = []
+    for token in argv:
+        if token in STAGES:
+            stages.append((token, []))
+        elif stages:
+            stages[-1][1].append(token)
+        else:
+            raise ValueError(f"Expected a stage name ({', '.join(STAGES)}), got '{token}'")
+    return stages
+
+def stage_parser(name):
+    add_arguments, _ = STAGES[name]
+    parser = argparse.ArgumentParser(prog=f"pipeline.py ... {name}")
+    add_arguments(parser)
+    return parser
+
+def parse_stages(argv):
+    """Parses the stage list into [(name, run, args), ...]."""
+    parsed = []
+    for name, stage_argv in split_stages(argv):
+        args = stage_parser(name).parse_args(stage_argv)
+        STAGE_CHECKS.get(name, lambda args: None)(args)
+        parsed.append((name, STAGES[name][1], args))
+    return parsed
+
+def stages_from_options(stage_list):
+    """
+    Builds [(name, run, args), ...] from [(name, {option: value}), ...], where
+    option names are the CLI destinations (e.g. 'color', 'preserve_luminance').
+    Used by callers that describe stages as data (JSON requests, presets).
+    """
+    parsed = []
+    for name, options in stage_list:
+        if name not in STAGES:
+            raise ValueError(f"Unknown stage '{name}'")
+        args = stage_parser(name).parse_args([])
+        unknown = set(options) - set(vars(args))
+        if unknown:
+            raise ValueError(f"Unknown option(s) for {name}: {', '.join(sorted(unknown))}")
+        for key, value in options.items():
+            setattr(args, key, value)
+        STAGE_CHECKS.get(name, lambda args: None)(args)
+        parsed.append((name, STAGES[name][1], args))
+    return parsed
+
+def intermediate_path(output_path, index, name):
+    root, _ = os.path.splitext(output_path)
+    return f"{root}.{index:02d}_{name}.png"
+
+def run_pipeline(img, stages, output_path=None, keep_intermediates=False):
+    """Runs parsed stages over an in-memory RGBA image and returns the result."""
+    for index, (name, run, args) in enumerate(stages, 1):
+        print(f"[{index}/{len(stages)}] {name}")
+        img = run(img, args)
+        if keep_intermediates and output_path and index < len(stages):
+            path = intermediate_path(output_path, index, name)
+            print(f"  Keeping intermediate {path}")
+            img.save(path)
+    return img
+
+# --- Keying tool parameters (headless) ---
+# The same dict the keying tool's get_params() returns, so presets saved from
+# the GUI settings can drive batch runs without Tk.
+DEFAULT_PARAMS = {
+    'mode': 'Chroma',
+    'apply_chroma': True,
+    'apply_despill': False,
+    'ds_color': 'Green',
+    'ds_method': 'Average',
+    'ds_luma': False,
+    'ck_color': '#00FF00',
+    'ck_keys': [],  # extra key colors; the mask uses the nearest key
+    'ck_low': 15.0,
+    'ck_high': 35.0,
+    'ck_shadow': 100.0,
+    'ck_highlight': 100.0,
+    'ck_invert': False,
+    'ck_maskonly': False,
+    'ae_enabled': False,
+    'ae_brightness': 255,
+    'ae_softness': 50.0,
+    'apply_alpha': False,
+    'mt_choke': 0,
+    'mt_grow': 0,
+    'mt_feather': 0.0,
+    'mt_blur': 0.0,
+}
+
+# GUI labels -> despill.py names
+DESPILL_METHODS = {
+    'Average': 'average',
+    'Double Red': 'double_red',
+    'Double Average': 'double_average',
+    'Limit': 'limit',
+}
+
+def resolve_params(params):
+    """Fills in missing keys of a get_params()-style dict with the GUI defaults."""
+    unknown = set(params) - set(DEFAULT_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown parameter(s): {', '.join(sorted(unknown))}")
+    resolved = dict(DEFAULT_PARAMS)
+    resolved.update(params)
+    return resolved
+
+def shows_mask(params):
+    """True when the result is the chroma key mask (a mask-only chroma step runs), not colors."""
+    params = resolve_params(params)
+    return params['mode'] == 'Chroma' and params['apply_chroma'] and params['ck_maskonly']
+
+def export_channels(params, channels='rgba'):
+    """Channels to save a process_params() result with: 'mask' when it shows the mask."""
+    return 'mask' if shows_mask(params) else channels
+
+def process_params(img, params, cancel=None, refine_scale=1.0):
+    """
+    Headless equivalent of the keying tool's process_logic (without the
+    manual eraser mask). `img` is an RGBA image; returns the result, or None
+    if `cancel()` returned True part way. Refinement radii are given in
+    full-resolution pixels and multiplied by `refine_scale` (for previews).
+    """
+    params = resolve_params(params)
+    ds_color = params['ds_color'].lower()
+    ds_method = DESPILL_METHODS[params['ds_method']]
+    mask_only = shows_mask(params)
+
+    # name -> run(img); each returns None when cancelled
+    chroma = lambda img: chromakey_image(
+        img, [params['ck_color']] + list(params['ck_keys']),
+        params['ck_low'], params['ck_high'],
+        params['ck_shadow'], params['ck_highlight'],
+        params['ck_invert'], params['ck_maskonly'], cancel=cancel
+    )
+    alpha = lambda img: alpha_extract_image(
+        img, params['ck_color'], params['ae_brightness'], params['ae_softness'], cancel=cancel)
+    despill = lambda img: despill_image(img, ds_color, ds_method, params['ds_luma'], cancel=cancel)
+
+    steps = []
+    if params['mode'] == 'Chroma':
+        if params['apply_chroma']:
+            steps.append(chroma)
+        if params['apply_alpha'] and not mask_only:
+            steps.append(alpha)
+        if params['apply_despill'] and not mask_only:
+            steps.append(despill)
+
+    elif params['mode'] == 'AlphaExtract':
+        if params['ae_enabled']:
+            steps.append(alpha)
+
+    elif params['mode'] == 'Despill':
+        steps.append(despill)
+
+    for step in steps:
+        img = step(img)
+        if img is None:
+            return None
+
+    if params['mode'] != 'Despill' and not mask_only:
+        img = refine_image(
+            img,
+            choke=round(params['mt_choke'] * refine_scale), grow=round(params['mt_grow'] * refine_scale),
+            feather_radius=params['mt_feather'] * refine_scale, blur_radius=params['mt_blur'] * refine_scale
+        )
+
+    return img
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [-h] [--keep-intermediates] [--force] [--watch] ... input output STAGE [options] [STAGE [options] ...]",
+        description="Run keying stages in one process on one in-memory image",
+        epilog=f"Stages: {', '.join(STAGES)}. Run 'pipeline.py in out <stage> -h' for stage options."
+    )
+    parser.add_argument("input", help="Input image path")
+    parser.add_argument("output", help="Output image path")
+    parser.add_argument("--keep-intermediates", action="store_true",
+                        help="Also write the image after each stage (for debugging)")
+    add_backend_arguments(parser)
+    add_cache_arguments(parser)
+    add_watch_arguments(parser)
+    add_export_arguments(parser)
+    add_variant_arguments(parser)
+    add_trace_arguments(parser)
+
+    # Everything from the first stage name on belongs to the stages
+    argv = sys.argv[1:]
+    first_stage = next((i for i, token in enumerate(argv) if token in STAGES), len(argv))
+    args = parser.parse_args(argv[:first_stage])
+
+    try:
+        stages = parse_stages(argv[first_stage:])
+    except ValueError as e:
+        parser.error(str(e))
+    if not stages:
+        parser.error("No stages given")
+    check_sizes(parser, args.variant)
+    apply_backend_args(args)
+    apply_trace_args(args)
+
+    def run():
+        print(f"Opening {args.input}...")
+        try:
+            with span('decode'):
+                img = Image.open(args.input).convert("RGBA")
+        except Exception as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+
+        img = run_pipeline(img, stages, args.output, args.keep_intermediates)
+
+        mask_only = any(name == 'chroma' and stage_args.mask_only for name, _, stage_args in stages)
+        save_output(img, args.output, args, mask_only=mask_only)
+        if args.variant:
+            print("Writing variants...")
+            meta = export_variants(img, args.output, args.variant, args.premultiply,
+                                   args.trim_threshold, args.trim_pad, args.compression)
+            print(describe(meta))
+        print("Done.")
+
+    stage_params = [(name, vars(stage_args)) for name, _, stage_args in stages]
+    params = {'tool': 'pipeline', 'stages': stage_params, 'backend': backend_param(),
+              'export': {'compression': args.compression, 'alpha_only': args.alpha_only},
+              'variants': {'sizes': args.variant, 'premultiply': args.premultiply,
+                           'trim_threshold': args.trim_threshold, 'trim_pad': args.trim_pad}}
+    if args.watch:
+        watch_cli(args, lambda: run_cached('pipeline', args, run, params),
+                  extra_options=[options for _, options in stage_params])
+    else:
+        run_cached('pipeline', args, run, params)
@@ -0,0 +1,170 @@
+import threading
+from PIL import Image, ImageChops, ImageDraw
+
+from pipeline import process_params
+from timing import span
+
+# ==========================================
+# PREVIEW RENDERING (headless)
+# ==========================================
+# The keying tool's per-job image work without Tk: the manual (eraser) mask,
+# eraser dabs and the zoomed view over its background. The GUI and the
+# session replay (session.py) both call these, so replayed timings measure
+# the same code the artists run.
+#
+# Memory: a job works in a preallocated buffer (WorkBuffers) instead of a
+# fresh copy of the source, the manual mask multiplies the alpha band in
+# place and is skipped entirely while nothing has been erased, and resized
+# masks and the checker background are cached.
+
+PREVIEW_SIZE = (400, 400)
+VIEW_MODES = ('Checker', 'Black', 'White', 'Alpha')
+
+def make_preview(original):
+    """Downscaled working copy used for interactive previews."""
+    preview = original.copy()
+    preview.thumbnail(PREVIEW_SIZE)
+    return preview
+
+class WorkBuffers:
+    """
+    Preallocated RGBA working images for jobs on one source image. acquire()
+    fills a free buffer with the source (a paste, no new allocation); release()
+    hands it back once its result is no longer needed or shown. Buffers of an
+    earlier source size are dropped.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.size = None
+        self.free = []
+        self.in_use = {}
+
+    def acquire(self, source):
+        with self.lock:
+            if source.size != self.size:
+                self.size = source.size
+                self.free = []
+            buf = self.free.pop() if self.free else Image.new("RGBA", source.size)
+            self.in_use[id(buf)] = buf
+        buf.paste(source)
+        return buf
+
+    def release(self, img):
+        """Returns a buffer to the pool; anything else (or None) is ignored."""
+        if img is None:
+            return
+        with self.lock:
+            if self.in_use.pop(id(img), None) is not None and img.size == self.size:
+                self.free.append(img)
+
+class ManualMask:
+    """
+    The eraser mask at full and preview resolution. for_size() returns None
+    while nothing has been erased, so untouched jobs skip the multiply.
+    """
+    def __init__(self, full_size, preview_size):
+        self.full = Image.new("L", full_size, 255)
+        self.preview = Image.new("L", preview_size, 255)
+        self.edits = 0
+        self._resized = None  # (size, edits, mask)
+
+    def erase(self, x, y, size):
+        erase(self.preview, self.full, x, y, size)
+        self.edits += 1
+
+    def crop(self, bbox, preview_size):
+        self.full = self.full.crop(bbox)
+        self.preview = self.full.resize(preview_size, Image.Resampling.NEAREST)
+        self._resized = None
+
+    def for_size(self, size):
+        """Mask matching `size` (resized once per edit and cached), or None if untouched."""
+        if not self.edits:
+            return None
+        if size == self.full.size:
+            return self.full
+        if size == self.preview.size:
+            return self.preview
+        cached = self._resized
+        if cached is None or cached[0] != size or cached[1] != self.edits:
+            cached = self._resized = (size, self.edits, self.full.resize(size))
+        return cached[2]
+
+def apply_mask(img, mask):
+    """Multiplies the image's alpha band by the manual mask in place (resized to fit if needed)."""
+    with span('manual_mask'):
+        if mask.size != img.size:
+            mask = mask.resize(img.size)
+        img.putalpha(ImageChops.multiply(img.getchannel("A"), mask))
+    return img
+
+def process_job(img, params, mask=None, cancel=None, refine_scale=1.0):
+    """
+    One preview or save job: the keying pipeline, then the manual mask.
+    Returns the result, or None if `cancel()` returned True part way.
+    """
+    img = process_params(img, params, cancel=cancel, refine_scale=refine_scale)
+    if img and mask:
+        img = apply_mask(img, mask)
+    return img
+
+def erase(preview_mask, full_mask, x, y, size):
+    """Erases a round dab of `size` preview pixels at (x, y) from both masks."""
+    draw_prev = ImageDraw.Draw(preview_mask)
+    draw_prev.ellipse([x-size/2, y-size/2, x+size/2, y+size/2], fill=0)
+
+    scale_x = full_mask.width / preview_mask.width
+    scale_y = full_mask.height / preview_mask.height
+
+    fx, fy = x * scale_x, y * scale_y
+    fsize = size * scale_x
+    draw_full = ImageDraw.Draw(full_mask)
+    draw_full.ellipse([fx-fsize/2, fy-fsize/2, fx+fsize/2, fy+fsize/2], fill=0)
+
+_checker_cache = [None, None]  # (size, tile), image
+
+def checker(size, zoom_scale):
+    """Gray checkerboard whose squares follow the zoom level (cached; do not modify)."""
+    new_w, new_h = size
+    tile = max(5, int(20 * zoom_scale))
+    if _checker_cache[0] == (size, tile):
+        return _checker_cache[1]
+    bg = Image.new('RGBA', (new_w, new_h), (204, 204, 204, 255))
+    draw = ImageDraw.Draw(bg)
+    for x in range(0, new_w, tile):
+        for y in range(0, new_h, tile):
+            if (x // tile + y // tile) % 2 == 0:
+                draw.rectangle([x, y, x+tile, y+tile], fill=(153, 153, 153, 255))
+    _checker_cache[:] = [(size, tile), bg]
+    return bg
+
+def compose_view(img, zoom_scale, view_mode):
+    """Zooms the processed preview and puts it over the selected view background."""
+    orig_w, orig_h = img.size
+    new_w = int(orig_w * zoom_scale)
+    new_h = int(orig_h * zoom_scale)
+    with span('resize'):
+        # At 100% the source is only read, so it is used as is
+        zoomed_img = img if (new_w, new_h) == img.size else img.resize((new_w, new_h), Image.Resampling.BILINEAR)
+
+    with span('composite', view=view_mode):
+        bg = None
+        if view_mode == "Checker":
+            bg = Image.alpha_composite(checker((new_w, new_h), zoom_scale), zoomed_img)
+
+        elif view_mode == "Black":
+            bg = Image.new('RGBA', (new_w, new_h), (0, 0, 0, 255))
+            bg.alpha_composite(zoomed_img)
+
+        elif view_mode == "White":
+            bg = Image.new('RGBA', (new_w, new_h), (255, 255, 255, 255))
+            bg.alpha_composite(zoomed_img)
+
+        elif view_mode == "Alpha":
+            # Extract Alpha and show as grayscale
+            try:
+                alpha = zoomed_img.getchannel('A')
+            except:
+                alpha = zoomed_img.split()[-1]
+            bg = alpha.convert("RGBA") # Convert grayscale mask to RGBA for Tkinter
+    return bg
@@ -0,0 +1,299 @@
+import contextlib
+import io
+import os
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+
+# ==========================================
+# CPU AND ALLOCATION PROFILING
+# ==========================================
+# Usage:
+#   python chroma_key.py in.png out.png --color "#5fb356" --profile report.txt
+#   python despill.py in.png out.png --profile report.txt --profiler sampling
+#   python keying_tool.py --profile report.txt   (profiles the first preview or save)
+#
+# The job runs under cProfile (or pyinstrument's sampling profiler when it is
+# installed and --profiler sampling is given) plus tracemalloc. The report
+# lists the hottest functions by own and cumulative time, the largest
+# allocation sites still alive at the end of the job and the peak traced
+# memory. With cProfile the raw stats are also written to REPORT.prof (for
+# snakeviz, `python -m pstats`, ...).
+#
+# tracemalloc sees Python allocations (tobytes() buffers, caches, arrays)
+# but not Pillow's own image memory.
+
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 20
+PROFILERS = ('cprofile', 'sampling')
+
+def sampling_available():
+    try:
+        import pyinstrument  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def _start_cpu(profiler):
+    if profiler == 'sampling':
+        if not sampling_available():
+            raise ValueError("The sampling profiler needs pyinstrument (pip install pyinstrument)")
+        from pyinstrument import Profiler
+        prof = Profiler()
+        prof.start()
+        return prof
+    import cProfile
+    prof = cProfile.Profile()
+    prof.enable()
+    return prof
+
+def _stop_cpu(prof):
+    if hasattr(prof, 'disable'):
+        prof.disable()
+    else:
+        prof.stop()
+
+def _cpu_sections(prof, report_path):
+    """Report text for the CPU profile; also saves cProfile stats next to the report."""
+    if not hasattr(prof, 'disable'):
+        return ["== Sampled call tree ==", prof.output_text(unicode=False, color=False)]
+    import pstats
+    prof.dump_stats(report_path + '.prof')
+    sections = []
+    for key, label in (('tottime', 'own'), ('cumulative', 'cumulative')):
+        out = io.StringIO()
+        pstats.Stats(prof, stream=out).strip_dirs().sort_stats(key).print_stats(TOP_FUNCTIONS)
+        sections.append(f"== Hot functions by {label} time (top {TOP_FUNCTIONS}) ==")
+        # Drop pstats' own banner lines up to the table
+        text = out.getvalue()
+        sections.append(text[text.find('   ncalls'):] if '   ncalls' in text else text)
+    return sections
+
+def _allocation_sections(snapshot):
+    stats = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    )).statistics('lineno')
+    lines = [f"== Largest allocation sites alive at the end (top {TOP_ALLOCATIONS}) =="]
+    for stat in stats[:TOP_ALLOCATIONS]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size / (1 << 20):9.2f} MB {stat.count:8d} blocks  "
+                     f"{os.path.basename(frame.filename)}:{frame.lineno}")
+    if len(lines) == 1:
+        lines.append("(nothing)")
+    return ["\n".join(lines)]
+
+@contextlib.contextmanager
+def profiled(report_path, title='', profiler='cprofile'):
+    """
+    Profiles the block and writes a text report to `report_path`.
+    Does nothing when `report_path` is empty.
+    """
+    if not report_path:
+        yield
+        return
+
+    owns_tracemalloc = not tracemalloc.is_tracing()
+    if owns_tracemalloc:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    prof = _start_cpu(profiler)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _stop_cpu(prof)
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        if owns_tracemalloc:
+            tracemalloc.stop()
+
+        import backends
+        header = [
+            f"Keying profile: {title}" if title else "Keying profile",
+            f"Date: {time.strftime('%Y-%m-%d %H:%M:%S')}",
+            f"Python {platform.python_version()} on {platform.platform()}, "
+            f"{backends.current().name} backend",
+            f"Wall time: {elapsed:.3f} s",
+            f"Peak traced memory: {peak / (1 << 20):.1f} MB",
+        ]
+        sections = ["\n".join(header)] + _cpu_sections(prof, report_path) + _allocation_sections(snapshot)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            f.write("\n\n".join(sections).rstrip() + "\n")
+        print(f"Profile written to {report_path}", file=sys.stderr)
+
+# --- Per-job peak memory ---
+# Resident memory (what the OS reports) includes Pillow's image buffers,
+# which tracemalloc does not see. Linux reads /proc/self/status and can reset
+# the high-water mark (clear_refs); Windows asks GetProcessMemoryInfo for the
+# working set, whose peak cannot be reset. The counters are per process.
+
+SAMPLE_INTERVAL = 0.005
+
+def _proc_status_kb(field):
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def _linux_memory():
+    current, peak = _proc_status_kb('VmRSS'), _proc_status_kb('VmHWM')
+    if current is None or peak is None:
+        return None
+    return current * 1024, peak * 1024
+
+def _linux_reset_peak():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+_win_memory_info = None
+
+def _windows_memory():
+    global _win_memory_info
+    if _win_memory_info is None:
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        kernel32 = ctypes.windll.kernel32
+        kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        # K32GetProcessMemoryInfo is psapi's GetProcessMemoryInfo exported by kernel32 (Windows 7+)
+        get_info = kernel32.K32GetProcessMemoryInfo
+        get_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+        get_info.restype = wintypes.BOOL
+
+        def memory_info():
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            if not get_info(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+                return None
+            return counters.WorkingSetSize, counters.PeakWorkingSetSize
+        _win_memory_info = memory_info
+    return _win_memory_info()
+
+def process_memory():
+    """(current, peak) resident bytes of this process, or None where unsupported."""
+    if sys.platform == 'win32':
+        try:
+            return _windows_memory()
+        except (OSError, AttributeError):
+            return None
+    return _linux_memory()
+
+# Measurements running right now; the Linux high-water mark is only reset
+# when no other one is, so concurrent jobs do not erase each other's peak.
+_peak_lock = threading.Lock()
+_peak_active = [0]
+
+class PeakMemory:
+    """
+    `with PeakMemory() as peak:` measures how far memory rose above its level
+    at the start of the block; read `peak.bytes` afterwards (None if unknown).
+    Resident memory is used where process_memory() can read it, so Pillow's
+    image memory counts (for the whole process: concurrent jobs add up).
+    If the process peak rises during the block it is exact; when the peak
+    could not be reset first (Windows, or another job is being measured on
+    Linux), the block's own peak may stay below the older process peak, so a
+    thread also samples the current value every SAMPLE_INTERVAL seconds.
+    Elsewhere it falls back to the tracemalloc peak while tracemalloc is
+    running (Python allocations only).
+    """
+    def __enter__(self):
+        self.bytes = None
+        self.start = None
+        self.sampler = None
+        if process_memory() is not None:
+            with _peak_lock:
+                reset = _peak_active[0] == 0 and sys.platform != 'win32' and _linux_reset_peak()
+                _peak_active[0] += 1
+            counters = process_memory()
+            if counters is not None:
+                self.start, self.start_peak = counters
+                self.high = self.start
+                if not reset:
+                    self.stop = threading.Event()
+                    self.sampler = threading.Thread(target=self._sample, daemon=True)
+                    self.sampler.start()
+            else:
+                self._release()
+        if self.start is None and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            self.start_traced = tracemalloc.get_traced_memory()[0]
+        return self
+
+    def _sample(self):
+        while not self.stop.wait(SAMPLE_INTERVAL):
+            counters = process_memory()
+            if counters is not None:
+                self.high = max(self.high, counters[0])
+
+    def _release(self):
+        with _peak_lock:
+            _peak_active[0] -= 1
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            if self.sampler is not None:
+                self.stop.set()
+                self.sampler.join()
+            counters = process_memory()
+            if counters is not None:
+                current, peak = counters
+                high = peak if peak > self.start_peak else max(self.high, current)
+                self.bytes = max(0, high - self.start)
+            self._release()
+        elif tracemalloc.is_tracing():
+            self.bytes = max(0, tracemalloc.get_traced_memory()[1] - self.start_traced)
+        return False
+
+def describe_peak(peak_bytes, image_size=None):
+    """'peak +12.3 MB (2.1x image)' for status lines; '' when unknown."""
+    if peak_bytes is None:
+        return ''
+    text = f"peak +{peak_bytes / (1 << 20):.1f} MB"
+    if image_size:
+        text += f" ({peak_bytes / (image_size[0] * image_size[1] * 4):.1f}x image)"
+    return text
+
+# --- CLI helpers ---
+
+def add_profile_arguments(parser):
+    parser.add_argument("--profile", metavar="REPORT",
+                        help="Profile the run (CPU + allocations) and write a report to this file")
+    parser.add_argument("--profiler", choices=PROFILERS, default='cprofile',
+                        help="CPU profiler for --profile (sampling needs pyinstrument)")
+
+def apply_profile_args(args):
+    """
+    Checks the profiler choice (exits with a message if unusable). A profiled
+    run always does the work, even if the output is up to date.
+    """
+    if not getattr(args, 'profile', None):
+        return
+    if args.profiler == 'sampling' and not sampling_available():
+        print("Error: --profiler sampling needs pyinstrument (pip install pyinstrument)", file=sys.stderr)
+        sys.exit(1)
+    if hasattr(args, 'force'):
+        args.force = True
+
+def profile_cli(args):
+    """Context manager profiling a CLI run when --profile was given."""
+    return profiled(args.profile, " ".join([os.path.basename(sys.argv[0])] + sys.argv[1:]), args.profiler)
@@ -1,2 +1 @@
-python chroma_key.py input.png output.png --color "#5fb356"
-python despill.py output.png output_despill.png
\ No newline at end of file
+python pipeline.py input.png output_despill.png chroma --color "#5fb356" despill
\ No newline at end of file
@@ -0,0 +1,310 @@
+import argparse
+import io
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageChops
+
+import pipeline
+from backends import add_backend_arguments, apply_backend_args
+from batch import load_preset
+
+# ==========================================
+# IMAGE SEQUENCE KEYING
+# ==========================================
+# Usage:
+#   python sequence.py frames/frame_%05d.png keyed/frame_%05d.png --preset intro.json
+#
+# Frames flow through an ordered pipeline:
+#   worker processes: decode -> key -> encode (PNG bytes in memory)
+#   writer thread:    writes encoded frames to disk in frame order
+# At most --queue frames are in flight, so a slow disk or a slow frame
+# holds back decoding instead of filling memory (backpressure). Different
+# frames are in different stages at the same time.
+#
+# With --temporal, each task is a chunk of consecutive frames. Inside a chunk
+# tiles whose input is unchanged from the previous frame (within --tolerance)
+# reuse the previous keyed tile; only changed tiles are re-keyed. Matte
+# refinement, the only stage that looks at neighbouring pixels, runs on the
+# whole reassembled frame, so with --tolerance 0 the output is identical.
+
+def pattern_regex(pattern):
+    """Regex matching file names of a printf-style frame pattern (e.g. frame_%05d.png)."""
+    name = os.path.basename(pattern)
+    match = re.search(r'%(0?)(\d*)d', name)
+    if not match:
+        raise ValueError(f"Frame pattern needs a %d placeholder: {pattern}")
+    width = match.group(2)
+    digits = r'(\d{%s})' % width if match.group(1) and width else r'(\d+)'
+    return re.compile('^' + re.escape(name[:match.start()]) + digits + re.escape(name[match.end():]) + '$')
+
+def find_frames(pattern, start=None, end=None):
+    """Sorted frame numbers present on disk for a frame pattern."""
+    directory = os.path.dirname(pattern) or '.'
+    regex = pattern_regex(pattern)
+    numbers = []
+    for name in os.listdir(directory):
+        match = regex.match(name)
+        if match:
+            number = int(match.group(1))
+            if (start is None or number >= start) and (end is None or number <= end):
+                numbers.append(number)
+    return sorted(numbers)
+
+# --- Temporal tile reuse ---
+
+TEMPORAL_TILE = 64
+
+# Above this fraction of changed tiles a whole-frame key is cheaper
+FULL_FRAME_RATIO = 0.6
+
+REFINE_KEYS = ('mt_choke', 'mt_grow', 'mt_feather', 'mt_blur')
+
+class TemporalKeyer:
+    """
+    Keys consecutive frames, re-keying only the tiles that changed since the
+    previous frame. Keeps the previous input and the previous (unrefined)
+    keyed frame.
+    """
+    def __init__(self, params, tile_size=TEMPORAL_TILE, tolerance=0):
+        self.params = pipeline.resolve_params(params)
+        # Per-pixel stages run per tile; refinement runs on the full frame
+        self.pixel_params = dict(self.params, **{k: 0 for k in REFINE_KEYS})
+        self.tile_size = tile_size
+        self.tolerance = tolerance
+        self.prev_input = None
+        self.prev_keyed = None
+        self.tiles = 0
+        self.reused = 0
+
+    def changed_tiles(self, img):
+        """Boxes of tiles whose max channel difference to the previous frame exceeds the tolerance."""
+        diff = ImageChops.difference(img, self.prev_input)
+        bands = diff.split()
+        # Max over channels, then threshold: non-zero = changed pixel
+        peak = bands[0]
+        for band in bands[1:]:
+            peak = ImageChops.lighter(peak, band)
+        if self.tolerance > 0:
+            peak = peak.point([0 if v <= self.tolerance else 255 for v in range(256)])
+
+        width, height = img.size
+        boxes = []
+        for y0 in range(0, height, self.tile_size):
+            for x0 in range(0, width, self.tile_size):
+                box = (x0, y0, min(x0 + self.tile_size, width), min(y0 + self.tile_size, height))
+                if peak.crop(box).getbbox() is not None:
+                    boxes.append(box)
+        return boxes
+
+    def key(self, img):
+        # `reference` is the input each keyed tile was computed from. Reused
+        # tiles keep their old reference so slow drift below the tolerance
+        # still triggers a re-key once it adds up.
+        total = -(-img.width // self.tile_size) * -(-img.height // self.tile_size)
+        self.tiles += total
+        if self.prev_input is None or self.prev_input.size != img.size:
+            keyed = pipeline.process_params(img.copy(), self.pixel_params)
+            reference = img
+        else:
+            boxes = self.changed_tiles(img)
+            if len(boxes) > total * FULL_FRAME_RATIO:
+                keyed = pipeline.process_params(img.copy(), self.pixel_params)
+                reference = img
+            else:
+                # Only tiles that are really taken from the previous frame count as reused
+                self.reused += total - len(boxes)
+                keyed = self.prev_keyed.copy()
+                reference = self.prev_input.copy()
+                for box in boxes:
+                    tile = img.crop(box)
+                    reference.paste(tile, box)
+                    keyed.paste(pipeline.process_params(tile, self.pixel_params), box)
+
+        self.prev_input = reference
+        self.prev_keyed = keyed
+
+        out = keyed.copy()
+        if self.params['mode'] != 'Despill' and not pipeline.shows_mask(self.params):
+            out = pipeline.refine_image(
+                out,
+                choke=self.params['mt_choke'], grow=self.params['mt_grow'],
+                feather_radius=self.params['mt_feather'], blur_radius=self.params['mt_blur']
+            )
+        return out
+
+# --- Worker side ---
+
+_worker_params = None
+
+def init_worker(params):
+    global _worker_params
+    _worker_params = params
+    # Build key Lab, levels table and pixel cache once per worker
+    pipeline.process_params(Image.new("RGBA", (1, 1)), params)
+
+def key_chunk(srcs, temporal=False, tolerance=0):
+    """
+    Decode, key and encode a chunk of consecutive frames.
+    Returns ([(png_bytes, pixels, error), ...], tiles, reused_tiles).
+    """
+    keyer = TemporalKeyer(_worker_params, tolerance=tolerance) if temporal else None
+    results = []
+    for src in srcs:
+        try:
+            img = Image.open(src).convert("RGBA")
+            if keyer:
+                img = keyer.key(img)
+            else:
+                img = pipeline.process_params(img, _worker_params)
+            buf = io.BytesIO()
+            img.save(buf, "PNG")
+            results.append((buf.getvalue(), img.width * img.height, None))
+        except Exception as e:
+            # The next frame must not reuse tiles across a broken one
+            if keyer:
+                keyer.prev_input = None
+            results.append((None, 0, str(e)))
+    if keyer:
+        return results, keyer.tiles, keyer.reused
+    return results, 0, 0
+
+# --- Main side ---
+
+def writer_thread(write_queue, stats):
+    """Writes (path, data) items in the order they arrive; None ends the thread."""
+    while True:
+        item = write_queue.get()
+        if item is None:
+            return
+        path, data = item
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        stats['written'] += 1
+
+def key_sequence(input_pattern, output_pattern, params, frames, workers=None, max_in_flight=None,
+                 progress=None, temporal=False, tolerance=0, chunk=None):
+    """
+    Keys `frames` (frame numbers) from input_pattern into output_pattern.
+    Returns a summary dict with frames/s, Mpix/s and the temporal reuse ratio.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunk = chunk or (8 if temporal else 1)
+    # max_in_flight counts frames; tasks are chunks of frames
+    max_in_flight = max(1, (max_in_flight or workers * 2 * chunk) // chunk)
+    stats = {'written': 0}
+    failures = []
+    pixels = 0
+    tiles = 0
+    reused = 0
+    chunks = [frames[i:i + chunk] for i in range(0, len(frames), chunk)]
+
+    write_queue = queue.Queue(maxsize=max_in_flight)
+    writer = threading.Thread(target=writer_thread, args=(write_queue, stats), daemon=True)
+    writer.start()
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(params,)) as pool:
+        pending = deque()
+        next_chunk = iter(chunks)
+
+        def submit_next():
+            numbers = next(next_chunk, None)
+            if numbers is not None:
+                srcs = [input_pattern % number for number in numbers]
+                pending.append((numbers, pool.submit(key_chunk, srcs, temporal, tolerance)))
+
+        for _ in range(max_in_flight):
+            submit_next()
+
+        # Results are consumed strictly in frame order
+        while pending:
+            numbers, future = pending.popleft()
+            results, chunk_tiles, chunk_reused = future.result()
+            submit_next()
+            tiles += chunk_tiles
+            reused += chunk_reused
+            for number, (data, frame_pixels, error) in zip(numbers, results):
+                if error:
+                    failures.append((number, error))
+                    print(f"  FAILED frame {number}: {error}")
+                    continue
+                pixels += frame_pixels
+                write_queue.put((output_pattern % number, data))
+                if progress:
+                    progress(number)
+
+    write_queue.put(None)
+    writer.join()
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    return {
+        'frames': stats['written'],
+        'failures': failures,
+        'seconds': elapsed,
+        'fps': stats['written'] / elapsed,
+        'mpix_per_s': pixels / 1e6 / elapsed,
+        'tiles': tiles,
+        'reused_tiles': reused,
+    }
+
+def print_sequence_summary(summary):
+    print(f"Keyed {summary['frames']} frame(s) in {summary['seconds']:.2f}s: "
+          f"{summary['fps']:.2f} frames/s, {summary['mpix_per_s']:.2f} Mpix/s, "
+          f"{len(summary['failures'])} failure(s)")
+    if summary['tiles']:
+        ratio = summary['reused_tiles'] / summary['tiles']
+        print(f"Temporal reuse: {summary['reused_tiles']}/{summary['tiles']} tiles ({ratio:.1%})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Key a numbered image sequence")
+    parser.add_argument("input", help="Input frame pattern, e.g. frames/frame_%%05d.png")
+    parser.add_argument("output", help="Output frame pattern, e.g. keyed/frame_%%05d.png")
+    parser.add_argument("--preset", help="JSON or TOML file of keying tool parameters")
+    parser.add_argument("--start", type=int, help="First frame number to key")
+    parser.add_argument("--end", type=int, help="Last frame number to key")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--queue", type=int, default=None,
+                        help="Maximum frames in flight (default: 2x workers)")
+    parser.add_argument("--temporal", action="store_true",
+                        help="Reuse keyed tiles that are unchanged from the previous frame")
+    parser.add_argument("--tolerance", type=int, default=0,
+                        help="Max per-channel difference (0-255) for a tile to count as unchanged. "
+                             "0 keeps the output identical.")
+    parser.add_argument("--chunk", type=int, default=None,
+                        help="Consecutive frames per task (default: 8 with --temporal, else 1)")
+    add_backend_arguments(parser)
+    args = parser.parse_args()
+    apply_backend_args(args)
+
+    try:
+        params = load_preset(args.preset)
+        frames = find_frames(args.input, args.start, args.end)
+    except Exception as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    if not frames:
+        print(f"No frames found for {args.input}")
+        sys.exit(1)
+
+    print(f"Keying {len(frames)} frame(s) ({frames[0]}-{frames[-1]})...")
+    last_report = [time.perf_counter()]
+
+    def progress(number):
+        now = time.perf_counter()
+        if now - last_report[0] >= 2.0:
+            last_report[0] = now
+            print(f"  ...frame {number}")
+
+    summary = key_sequence(args.input, args.output, params, frames, args.jobs, args.queue, progress,
+                           args.temporal, args.tolerance, args.chunk)
+    print_sequence_summary(summary)
+    if summary['failures']:
+        sys.exit(1)
@@ -0,0 +1,354 @@
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from PIL import Image
+
+import backends
+import preview
+from benchmark import percentile
+from profiling import PeakMemory
+
+# ==========================================
+# SESSION RECORDING AND REPLAY
+# ==========================================
+# Usage:
+#   python "keying_tool - Copy.py" --record session.jsonl      (use the tool, then close it)
+#   python session.py replay session.jsonl [--speed 1] [-o replay.json]
+#   python session.py replay session.jsonl --baseline replay.json --threshold 15
+#
+# A recording is one JSON object per line: a header, then events stamped with
+# seconds since the recording started ("t"):
+#   {"type": "load", "image": "session.jsonl.1.png"}   (a copy of the loaded image)
+#   {"type": "update", "params": {...get_params()...}} ("params" only when changed)
+#   {"type": "zoom", "zoom": 1.21} / {"type": "view", "view": "Black"}
+#   {"type": "pan", "x": 10, "y": 4}
+#   {"type": "erase", "x": 120, "y": 88, "size": 20}   (preview coordinates)
+#   {"type": "crop"} / {"type": "backend", "name": "numpy"}
+#
+# Replay drives the same code as the keying tool (preview.py and the
+# pipeline) without Tk, at the recorded pacing: one "UI" thread handles
+# events and redraws while a worker thread runs preview jobs, superseding
+# and cancelling them exactly like the tool does. Latencies are measured
+# from the moment an event was due, so a busy UI thread shows up in them:
+#   - time to preview: parameter change -> redraw showing a result that includes it
+#   - redraw: zoom/view change -> redraw done
+#   - stroke: eraser dab -> redraw done
+# plus the peak memory each preview job added (see profiling.PeakMemory).
+# Tk's own PhotoImage/canvas cost is not part of the replay.
+
+FORMAT = 1
+
+class SessionRecorder:
+    """Appends GUI events to a session file as they happen."""
+
+    def __init__(self, path):
+        self.path = path
+        self.start = time.perf_counter()
+        self.images = 0
+        self.last_params = None
+        self.file = open(path, 'w', encoding='utf-8')
+        self._write({'type': 'session', 'format': FORMAT, 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                     'backend': backends.current().name})
+
+    def _write(self, event):
+        self.file.write(json.dumps(event) + '\n')
+        self.file.flush()
+
+    def record(self, kind, **data):
+        event = {'t': round(time.perf_counter() - self.start, 4), 'type': kind}
+        event.update(data)
+        self._write(event)
+
+    def load(self, img):
+        """Records a newly loaded image, keeping a copy next to the session file."""
+        self.images += 1
+        name = f"{os.path.basename(self.path)}.{self.images}.png"
+        img.save(os.path.join(os.path.dirname(os.path.abspath(self.path)), name), compress_level=1)
+        self.record('load', image=name)
+
+    def update(self, params):
+        if params != self.last_params:
+            self.last_params = dict(params)
+            self.record('update', params=params)
+        else:
+            self.record('update')
+
+    def close(self):
+        self.file.close()
+
+def load_session(path):
+    """Returns (header, events) of a recording."""
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    if not lines or lines[0].get('type') != 'session':
+        raise ValueError(f"{path} is not a session recording")
+    if lines[0].get('format') != FORMAT:
+        raise ValueError(f"Unsupported session format {lines[0].get('format')}")
+    return lines[0], lines[1:]
+
+# --- Replay ---
+
+class SessionReplay:
+    """Headless stand-in for the keying tool's preview loop."""
+
+    def __init__(self, session_dir):
+        self.session_dir = session_dir
+        self.ui = queue.Queue()           # callbacks posted to the "UI" thread (root.after)
+        self.current_job_id = 0
+        self.pending_params = None
+        self.last_params = None
+        self.is_processing = False
+        self.original_image = None
+        self.mask = None
+        self.preview_image = None
+        self.processed_preview = None
+        self.preview_buffers = preview.WorkBuffers()
+        self.full_buffers = preview.WorkBuffers()
+        self.zoom_scale = 1.0
+        self.view_mode = "Checker"
+
+        self.waiting = {}                 # job id -> time its update was due, until shown
+        self.latencies = {'time_to_preview': [], 'redraw': [], 'stroke': [], 'crop': []}
+        self.jobs = {'triggered': 0, 'started': 0, 'shown': 0, 'superseded': 0, 'coalesced': 0}
+        self.job_peaks = []
+
+    # Worker side (mirrors KeyingApp.bg_worker / process_logic)
+
+    def process_logic(self, img_obj, params, job_id):
+        cancel = (lambda: self.current_job_id != job_id) if job_id != -1 else None
+        scale = img_obj.width / self.original_image.width
+        return preview.process_job(img_obj, params, self.mask.for_size(img_obj.size),
+                                   cancel=cancel, refine_scale=scale)
+
+    def bg_worker(self):
+        while self.pending_params:
+            current_params = self.pending_params
+            this_job_id = self.current_job_id
+            self.pending_params = None
+            self.jobs['started'] += 1
+            work = self.preview_buffers.acquire(self.preview_image)
+            with PeakMemory() as peak:
+                res_img = self.process_logic(work, current_params, this_job_id)
+            if peak.bytes is not None:
+                self.job_peaks.append(peak.bytes)
+            if res_img is not work:
+                self.preview_buffers.release(work)
+            if res_img is not None and this_job_id == self.current_job_id:
+                self.ui.put(lambda img=res_img, job=this_job_id: self.show(img, job))
+            else:
+                self.preview_buffers.release(res_img)
+                self.jobs['superseded'] += 1
+        self.is_processing = False
+
+    # UI side
+
+    def trigger_update(self, params, due):
+        if not self.preview_image:
+            return
+        self.current_job_id += 1
+        self.jobs['triggered'] += 1
+        self.waiting[self.current_job_id] = due
+        self.pending_params = params
+        if not self.is_processing:
+            self.is_processing = True
+            threading.Thread(target=self.bg_worker, daemon=True).start()
+
+    def show(self, img, job_id):
+        previous = self.processed_preview
+        self.processed_preview = img
+        if previous is not img:
+            self.preview_buffers.release(previous)
+        self.redraw_canvas()
+        self.jobs['shown'] += 1
+        done = time.perf_counter()
+        for job in [j for j in self.waiting if j <= job_id]:
+            self.latencies['time_to_preview'].append(done - self.waiting.pop(job))
+
+    def redraw_canvas(self):
+        if self.processed_preview:
+            preview.compose_view(self.processed_preview, self.zoom_scale, self.view_mode)
+
+    def handle(self, event, due):
+        kind = event['type']
+        if kind == 'load':
+            self.original_image = Image.open(os.path.join(self.session_dir, event['image'])).convert("RGBA")
+            self.preview_image = preview.make_preview(self.original_image)
+            self.mask = preview.ManualMask(self.original_image.size, self.preview_image.size)
+            self.zoom_scale = 1.0
+        elif kind == 'update':
+            self.last_params = event.get('params', self.last_params)
+            if self.last_params is not None:
+                self.trigger_update(self.last_params, due)
+        elif kind in ('zoom', 'view'):
+            if kind == 'zoom':
+                self.zoom_scale = event['zoom']
+            else:
+                self.view_mode = event['view']
+            if self.processed_preview:
+                self.redraw_canvas()
+                self.latencies['redraw'].append(time.perf_counter() - due)
+        elif kind == 'erase':
+            self.mask.erase(event['x'], event['y'], event['size'])
+            if self.processed_preview:
+                preview.apply_mask(self.processed_preview, self.mask.preview)
+                self.redraw_canvas()
+            self.latencies['stroke'].append(time.perf_counter() - due)
+        elif kind == 'crop':
+            # Like KeyingApp.auto_crop: keyed at full resolution on the UI thread
+            work = self.full_buffers.acquire(self.original_image)
+            res = self.process_logic(work, self.last_params, -1)
+            bbox = res.getchannel('A').getbbox() if res else None
+            self.full_buffers.release(work)
+            if bbox:
+                self.original_image = self.original_image.crop(bbox)
+                self.preview_image = preview.make_preview(self.original_image)
+                self.mask.crop(bbox, self.preview_image.size)
+                self.zoom_scale = 1.0
+            self.latencies['crop'].append(time.perf_counter() - due)
+        elif kind == 'backend':
+            backends.set_backend(event['name'])
+        # 'pan' only moves the Tk canvas: nothing to render
+
+    def pump(self, until=None):
+        """Runs posted callbacks until `until` (perf_counter), or until all work is done."""
+        while True:
+            timeout = None if until is None else until - time.perf_counter()
+            if until is None and not self.is_processing and self.ui.empty():
+                return
+            if timeout is not None and timeout <= 0:
+                # Callbacks that are already queued still run before the next event
+                try:
+                    self.ui.get_nowait()()
+                    continue
+                except queue.Empty:
+                    return
+            try:
+                callback = self.ui.get(timeout=0.05 if timeout is None else min(timeout, 0.05))
+            except queue.Empty:
+                continue
+            callback()
+
+    def replay(self, events, speed=1.0):
+        start = time.perf_counter()
+        for event in events:
+            due = start + event.get('t', 0.0) / speed
+            self.pump(due)
+            self.handle(event, max(due, start))
+        self.pump()
+        self.jobs['coalesced'] = self.jobs['triggered'] - self.jobs['started']
+        return time.perf_counter() - start
+
+def latency_stats(values):
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': max(values),
+    }
+
+def replay_session(path, speed=1.0):
+    """Replays a recording and returns the report dict."""
+    header, events = load_session(path)
+    player = SessionReplay(os.path.dirname(os.path.abspath(path)))
+    wall = player.replay(events, speed)
+    return {
+        'session': os.path.basename(path),
+        'recorded_seconds': events[-1]['t'] if events else 0.0,
+        'replay_seconds': wall,
+        'speed': speed,
+        'backend': backends.current().name,
+        'events': len(events),
+        'jobs': player.jobs,
+        'latency': {name: latency_stats(values) for name, values in player.latencies.items()},
+        'job_peak_mb': latency_stats([b / (1 << 20) for b in player.job_peaks]),
+        'preview_mb': (player.preview_image.width * player.preview_image.height * 4 / (1 << 20)
+                       if player.preview_image else None),
+    }
+
+def print_report(report):
+    jobs = report['jobs']
+    print(f"Replayed {report['events']} event(s) from {report['session']} in {report['replay_seconds']:.2f}s "
+          f"(recorded {report['recorded_seconds']:.2f}s, speed {report['speed']:g}x, {report['backend']} backend)")
+    print(f"Preview jobs: {jobs['triggered']} triggered, {jobs['started']} started, {jobs['shown']} shown, "
+          f"{jobs['superseded']} superseded, {jobs['coalesced']} coalesced before starting")
+    for name, stats in report['latency'].items():
+        if stats['count']:
+            print(f"  {name:16} n={stats['count']:<5} p50 {stats['p50'] * 1000:7.1f} ms  "
+                  f"p90 {stats['p90'] * 1000:7.1f} ms  p99 {stats['p99'] * 1000:7.1f} ms  "
+                  f"max {stats['max'] * 1000:7.1f} ms")
+    peaks = report['job_peak_mb']
+    if peaks['count'] and report['preview_mb']:
+        print(f"  job peak memory  p50 {peaks['p50']:.2f} MB  max {peaks['max']:.2f} MB "
+              f"({peaks['max'] / report['preview_mb']:.1f}x the {report['preview_mb']:.2f} MB preview)")
+
+def compare_reports(report, baseline, threshold):
+    """Latency percentiles that grew by more than `threshold` percent: [(name, old, new, change %)]."""
+    regressions = []
+    for name, stats in report['latency'].items():
+        old = baseline.get('latency', {}).get(name, {})
+        for key in ('p50', 'p90'):
+            if stats.get('count') and old.get('count') and old[key] > 0:
+                change = (stats[key] - old[key]) / old[key] * 100
+                if change > threshold:
+                    regressions.append((f"{name} {key}", old[key], stats[key], change))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded keying tool sessions headlessly")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    replay = sub.add_parser("replay", help="Replay a session and report interactive latencies")
+    replay.add_argument("session", help="Session recording (.jsonl)")
+    replay.add_argument("--speed", type=float, default=1.0, help="Pacing multiplier (2 = twice as fast)")
+    replay.add_argument("-o", "--output", help="Write the report as JSON")
+    replay.add_argument("--baseline", help="Earlier JSON report to compare against")
+    replay.add_argument("--threshold", type=float, default=15.0,
+                        help="Latency growth in percent that counts as a regression (default: 15)")
+    backends.add_backend_arguments(replay)
+
+    info = sub.add_parser("info", help="Summarize a recording")
+    info.add_argument("session", help="Session recording (.jsonl)")
+
+    args = parser.parse_args()
+
+    try:
+        header, events = load_session(args.session)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    if args.command == "info":
+        counts = {}
+        for event in events:
+            counts[event['type']] = counts.get(event['type'], 0) + 1
+        print(f"{args.session}: recorded {header['created']} with the {header['backend']} backend, "
+              f"{events[-1]['t'] if events else 0:.2f}s")
+        for kind, count in sorted(counts.items()):
+            print(f"  {kind}: {count}")
+        sys.exit(0)
+
+    backends.apply_backend_args(args)
+    report = replay_session(args.session, args.speed)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+        print(f"Wrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_reports(report, baseline, args.threshold)
+        for name, old, new, change in regressions:
+            print(f"  SLOWER  {name}: {old * 1000:.1f} ms -> {new * 1000:.1f} ms ({change:+.1f}%)")
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:g}% against {args.baseline}")
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,93 @@
+import contextlib
+import sys
+from PIL import Image
+
+# ==========================================
+# RAW RGBA FRAME STREAMING (stdin -> stdout)
+# ==========================================
+# Lets the keyers sit in a shell pipeline between a decoder and an encoder:
+#   ffmpeg -i in.ogv -f rawvideo -pix_fmt rgba - |
+#     python chroma_key.py - - --size 1920x1080 --color "#5fb356" |
+#     ffmpeg -f rawvideo -pix_fmt rgba -s 1920x1080 -i - out.webm
+#
+# Frames are read with readinto() into one preallocated buffer, keyed in
+# place and written straight from it, so a frame is never copied on the
+# default 'buffer' backend. No PNG encode/decode happens.
+# Status messages go to stderr so stdout carries only frame data.
+
+def parse_size(text):
+    """Parses 'WxH' into (width, height)."""
+    try:
+        width, height = (int(v) for v in text.lower().split('x'))
+    except ValueError:
+        raise ValueError(f"Size must look like 1920x1080, got '{text}'")
+    if width <= 0 or height <= 0:
+        raise ValueError(f"Size must be positive, got '{text}'")
+    return width, height
+
+def read_frame(stream, view):
+    """Fills `view` from `stream`. Returns bytes read (0 at a clean end of stream)."""
+    filled = 0
+    while filled < len(view):
+        n = stream.readinto(view[filled:])
+        if not n:
+            break
+        filled += n
+    return filled
+
+def stream_frames(size, process, stdin=None, stdout=None):
+    """
+    Reads raw RGBA frames of `size` and passes each to process(img, buf),
+    which keys the reused frame buffer `buf` in place and returns None, or
+    returns a new RGBA image to write instead. `img` is a read-only image
+    view of `buf` for stages that only read pixels; modifying it detaches
+    it from `buf` for good, so stages copy it first. Writes the raw RGBA
+    result and returns the number of frames processed.
+    """
+    stdin = stdin or sys.stdin.buffer
+    stdout = stdout or sys.stdout.buffer
+    frame_bytes = size[0] * size[1] * 4
+    buf = bytearray(frame_bytes)
+    view = memoryview(buf)
+    img = Image.frombuffer("RGBA", size, buf, "raw", "RGBA", 0, 1)
+    frames = 0
+
+    # Anything the stages print must not end up in the frame data
+    with contextlib.redirect_stdout(sys.stderr):
+        while True:
+            n = read_frame(stdin, view)
+            if n == 0:
+                break
+            if n < frame_bytes:
+                raise ValueError(f"Truncated frame {frames}: got {n} of {frame_bytes} bytes")
+
+            out = process(img, buf)
+            if out is None:
+                stdout.write(view)
+            elif out.size != size or out.mode != "RGBA":
+                raise ValueError("Stage changed the frame size or mode; cannot stream")
+            else:
+                stdout.write(out.tobytes())
+            frames += 1
+
+    stdout.flush()
+    return frames
+
+def is_stream(args):
+    return args.input == '-' or args.output == '-'
+
+def add_stream_arguments(parser):
+    parser.add_argument("--size", help="Frame size WxH for raw RGBA streaming (input and output '-')")
+
+def run_stream(args, process):
+    """Streams stdin to stdout through `process`, for CLIs given '-' as input and output."""
+    if args.input != '-' or args.output != '-':
+        print("Error: streaming needs '-' for both input and output", file=sys.stderr)
+        sys.exit(1)
+    try:
+        size = parse_size(args.size or '')
+        frames = stream_frames(size, process)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"Streamed {frames} frame(s).", file=sys.stderr)
@@ -0,0 +1,285 @@
+import argparse
+import itertools
+import json
+import math
+import os
+import sys
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageChops, ImageColor, ImageDraw
+
+import pipeline
+import preview
+from chroma_key import key_lab_set
+from backends import add_backend_arguments, apply_backend_args, current
+from batch import load_preset
+from keying_core import key_distance, levels_table, pixels32, unpack
+from timing import add_trace_arguments, apply_trace_args, span
+
+# ==========================================
+# PARAMETER SWEEP CONTACT SHEETS
+# ==========================================
+# Usage:
+#   python sweep.py plate.png sheet.png --color "#5fb356" --lower 5:30:5 --upper 25:50:5
+#   python sweep.py plate.png sheet.png --preset intro.json --shadows 80,100,120 --despill average,limit,none
+#
+# Renders one thumbnail per combination of the swept values (each option
+# takes a comma list or start:stop:step, stop included) into a labelled grid,
+# and writes SHEET.json listing every cell's parameters in grid order.
+# Parameters that are not swept come from --preset / the keying tool defaults.
+#
+# Shared work is done once and reused by every cell that needs it:
+#   Lab distance field   once per key color ("F" image; each distinct pixel
+#                        color goes through the Lab math once)
+#   tolerance mask       once per (color, lower, upper): a linear point() on
+#                        the distance field
+#   levels               a 256-entry table per (shadows, highlights, invert)
+#   despill              once per method on the source; keying only changes
+#                        alpha, so a cell takes the despilled colors and the
+#                        keyed alpha without despilling again
+# Masks, despill variants and cells are evaluated on a thread pool (the band
+# operations run in Pillow's C code, outside the GIL).
+#
+# Thumbnails show chroma key + despill; alpha extraction and matte
+# refinement are not swept and are left out. Cells can differ from a full
+# render by one mask level where a distance sits on a byte boundary (the
+# field is stored as 32-bit floats), and by a level or two more where
+# shadows/highlights stretch the mask: a cell applies them to the byte mask,
+# a full render to the float mask before quantizing.
+
+SWEEP_AXES = ('color', 'lower', 'upper', 'shadows', 'highlights', 'despill')
+DESPILL_CHOICES = ('none',) + tuple(pipeline.DESPILL_METHODS.values())
+DEFAULT_THUMB = 256
+
+def parse_values(text, kind=float):
+    """'5,10,20' or '5:30:5' (stop included) -> list of values."""
+    text = text.strip()
+    if ':' in text and kind is not str:
+        parts = [float(p) for p in text.split(':')]
+        if len(parts) != 3 or parts[2] <= 0:
+            raise ValueError(f"Range '{text}' must be start:stop:step with a positive step")
+        start, stop, step = parts
+        count = int(math.floor((stop - start) / step + 1e-9)) + 1
+        return [round(start + i * step, 6) for i in range(max(count, 0))]
+    values = [v.strip() for v in text.split(',') if v.strip()]
+    return [kind(v) for v in values] if kind is not str else values
+
+# --- Shared intermediates ---
+
+def distance_field(img, key_lab):
+    """Lab distance to the key for every pixel, as an "F" image."""
+    with span('distance_field', size=list(img.size)):
+        cache = {}
+        dists = array('f')
+        for px in pixels32(img.tobytes()):
+            d = cache.get(px)
+            if d is None:
+                d = cache[px] = key_distance(*unpack(px), key_lab)
+            dists.append(d)
+        return Image.frombytes('F', img.size, dists.tobytes())
+
+def tolerance_mask_image(field, lower, upper):
+    """
+    Tolerance mask ("L") from a distance field: keying_core.tolerance_mask
+    with identity levels as one linear point() (Pillow truncates and clips
+    when converting to L, as tolerance_mask quantizes).
+    """
+    with span('tolerance', lower=lower, upper=upper):
+        if upper <= lower:
+            # Hard cut: 0 below lower, 255 from lower on
+            return field.point(lambda d: (d - lower) * 1e9 + 255.0).convert('L')
+        scale = 255.0 / (upper - lower)
+        return field.point(lambda d: d * scale - lower * scale).convert('L')
+
+def despill_colors(img, method, params):
+    """Despilled copy of `img` (alpha untouched), or `img` itself for 'none'."""
+    if method == 'none':
+        return img
+    with span('despill', method=method):
+        data = current().despill(img.tobytes(), params['ds_color'].lower(), method, params['ds_luma'])
+        return Image.frombytes('RGBA', img.size, bytes(data))
+
+class Sweep:
+    """
+    One sweep over a source image. Intermediates are memoized per key so
+    concurrently evaluated cells share them; build() evaluates every cell.
+    """
+    def __init__(self, img, params, workers=None):
+        self.img = img
+        self.params = pipeline.resolve_params(params)
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.memo = {}
+
+    def shared(self, key, compute):
+        """compute() once per key, even when several threads ask at the same time."""
+        with self.lock:
+            entry = self.memo.get(key)
+            if entry is None:
+                entry = self.memo[key] = [threading.Lock(), None]
+        with entry[0]:
+            if entry[1] is None:
+                entry[1] = compute()
+        return entry[1]
+
+    def field(self, color):
+        return self.shared(('field', color),
+                           lambda: distance_field(self.img, key_lab_set([color] + list(self.params['ck_keys']))))
+
+    def mask(self, color, lower, upper):
+        return self.shared(('mask', color, lower, upper),
+                           lambda: tolerance_mask_image(self.field(color), lower, upper))
+
+    def colors(self, method):
+        return self.shared(('despill', method), lambda: despill_colors(self.img, method, self.params))
+
+    def cell(self, values):
+        """Keyed RGBA thumbnail for one {axis: value} combination."""
+        with span('cell'):
+            mask = self.mask(values['color'], values['lower'], values['upper'])
+            mask = mask.point(levels_table(values['shadows'], values['highlights'], self.params['ck_invert']))
+            out = self.colors(values['despill']).copy()
+            out.putalpha(ImageChops.multiply(self.img.getchannel('A'), mask))
+            return out
+
+    def build(self, cells):
+        """Evaluates `cells` (a list of value dicts) in parallel. Returns the images in order."""
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            # Intermediates first, so cells do not queue behind each other on them
+            prep = [pool.submit(self.mask, v['color'], v['lower'], v['upper']) for v in cells]
+            prep += [pool.submit(self.colors, method) for method in {v['despill'] for v in cells}]
+            for future in prep:
+                future.result()
+            return list(pool.map(self.cell, cells))
+
+def sweep_cells(axes):
+    """All combinations of {axis: [values]} as dicts, in SWEEP_AXES order."""
+    names = [name for name in SWEEP_AXES if name in axes]
+    return [dict(zip(names, combo)) for combo in itertools.product(*(axes[n] for n in names))]
+
+def base_axes(params):
+    """Single-value axes from a get_params()-style dict (what a sweep varies from)."""
+    despill = pipeline.DESPILL_METHODS[params['ds_method']] if params['apply_despill'] else 'none'
+    return {'color': [params['ck_color']], 'lower': [params['ck_low']], 'upper': [params['ck_high']],
+            'shadows': [params['ck_shadow']], 'highlights': [params['ck_highlight']], 'despill': [despill]}
+
+def cell_params(params, values):
+    """The get_params()-style dict of one cell."""
+    out = dict(pipeline.resolve_params(params))
+    out.update({'ck_color': values['color'], 'ck_low': values['lower'], 'ck_high': values['upper'],
+                'ck_shadow': values['shadows'], 'ck_highlight': values['highlights']})
+    if values['despill'] == 'none':
+        out['apply_despill'] = False
+    else:
+        out['apply_despill'] = True
+        out['ds_method'] = {v: k for k, v in pipeline.DESPILL_METHODS.items()}[values['despill']]
+    return out
+
+# --- Contact sheet ---
+
+LABEL_HEIGHT = 14
+SHORT_NAMES = {'color': '', 'lower': 'L', 'upper': 'U', 'shadows': 'S', 'highlights': 'H', 'despill': ''}
+
+def cell_label(values, varying):
+    return " ".join(f"{SHORT_NAMES[name]}{values[name]:g}" if isinstance(values[name], float)
+                    else f"{SHORT_NAMES[name]}{values[name]}" for name in varying)
+
+def contact_sheet(images, labels, columns=None, view_mode='Checker'):
+    """Grid of the cell thumbnails over the view background, each with its label."""
+    columns = columns or math.ceil(math.sqrt(len(images)))
+    rows = math.ceil(len(images) / columns)
+    tw = max(img.width for img in images)
+    th = max(img.height for img in images) + LABEL_HEIGHT
+    sheet = Image.new('RGB', (columns * tw, rows * th), (60, 60, 60))
+    draw = ImageDraw.Draw(sheet)
+    for i, (img, label) in enumerate(zip(images, labels)):
+        x, y = (i % columns) * tw, (i // columns) * th
+        sheet.paste(preview.compose_view(img, 1.0, view_mode).convert('RGB'), (x, y))
+        draw.text((x + 3, y + img.height + 1), label, fill=(230, 230, 230))
+    return sheet, columns
+
+def cell_at(x, y, columns, thumb_size, count):
+    """Index of the cell under sheet pixel (x, y), or None."""
+    column, row = int(x // thumb_size[0]), int(y // (thumb_size[1] + LABEL_HEIGHT))
+    index = row * columns + column
+    return index if 0 <= column < columns and 0 <= index < count else None
+
+def run_sweep(img, params, axes, thumb=DEFAULT_THUMB, workers=None, columns=None, view_mode='Checker'):
+    """
+    Renders the sweep of `axes` ({axis: [values]}, missing axes from `params`)
+    on a thumbnail of `img`. Returns (sheet, cells, columns, thumb_size, seconds).
+    """
+    params = pipeline.resolve_params(params)
+    full_axes = base_axes(params)
+    full_axes.update({name: values for name, values in axes.items() if values})
+    cells = sweep_cells(full_axes)
+    varying = [name for name in SWEEP_AXES if len(full_axes[name]) > 1] or ['lower', 'upper']
+
+    small = img.convert('RGBA')
+    small.thumbnail((thumb, thumb))
+    start = time.perf_counter()
+    images = Sweep(small, params, workers).build(cells)
+    seconds = time.perf_counter() - start
+    sheet, columns = contact_sheet(images, [cell_label(v, varying) for v in cells], columns, view_mode)
+    return sheet, cells, columns, small.size, seconds
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render a contact sheet of keying parameter combinations")
+    parser.add_argument("input", help="Input image")
+    parser.add_argument("output", help="Contact sheet image (cell parameters go to OUTPUT.json)")
+    parser.add_argument("--preset", help="get_params()-style JSON/TOML preset for everything not swept")
+    parser.add_argument("--color", help="Key color(s), comma separated hex")
+    parser.add_argument("--lower", help="Lower tolerances, e.g. 5:30:5 or 10,15,20")
+    parser.add_argument("--upper", help="Upper tolerances")
+    parser.add_argument("--shadows", help="Shadows values")
+    parser.add_argument("--highlights", help="Highlights values")
+    parser.add_argument("--despill", help=f"Despill methods, comma separated ({', '.join(DESPILL_CHOICES)})")
+    parser.add_argument("--thumb", type=int, default=DEFAULT_THUMB, help="Thumbnail size in pixels (default 256)")
+    parser.add_argument("--columns", type=int, default=None, help="Grid columns (default: square-ish)")
+    parser.add_argument("--view", choices=preview.VIEW_MODES, default='Checker', help="Thumbnail background")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Worker threads (default: Python's default)")
+    add_backend_arguments(parser)
+    add_trace_arguments(parser)
+
+    args = parser.parse_args()
+    apply_backend_args(args)
+    apply_trace_args(args)
+
+    try:
+        params = load_preset(args.preset)
+        axes = {}
+        if args.color:
+            axes['color'] = parse_values(args.color, str)
+            for color in axes['color']:
+                ImageColor.getrgb(color)
+        for name in ('lower', 'upper', 'shadows', 'highlights'):
+            if getattr(args, name):
+                axes[name] = parse_values(getattr(args, name))
+        if args.despill:
+            axes['despill'] = parse_values(args.despill, str)
+            bad = [m for m in axes['despill'] if m not in DESPILL_CHOICES]
+            if bad:
+                raise ValueError(f"Unknown despill method(s): {', '.join(bad)}")
+        img = Image.open(args.input)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    sheet, cells, columns, thumb_size, seconds = run_sweep(img, params, axes, args.thumb, args.jobs,
+                                                          args.columns, args.view)
+    sheet.save(args.output)
+
+    # One ordinary render of the same thumbnail, for scale
+    single = img.convert('RGBA')
+    single.thumbnail((args.thumb, args.thumb))
+    start = time.perf_counter()
+    pipeline.process_params(single, cell_params(params, cells[0]))
+    single_seconds = max(time.perf_counter() - start, 1e-9)
+
+    with open(os.path.splitext(args.output)[0] + '.json', 'w', encoding='utf-8') as f:
+        json.dump({'columns': columns, 'thumb_size': list(thumb_size),
+                   'cells': [dict(values, params=cell_params(params, values)) for values in cells]}, f, indent=2)
+    print(f"Wrote {args.output}: {len(cells)} cell(s) of {thumb_size[0]}x{thumb_size[1]} in {seconds:.2f}s "
+          f"(one full render: {single_seconds:.3f}s, so the sweep cost {seconds / single_seconds:.1f} renders)")
@@ -0,0 +1,104 @@
+import os
+import time
+
+# ==========================================
+# WATCH MODE (stat polling, no dependencies)
+# ==========================================
+# Polls the size and mtime of the watched files. Once something changes, it
+# keeps polling until the files have been quiet for `debounce` seconds (so an
+# editor writing a PNG in several chunks triggers one run), then hands the set
+# of changed paths to the callback. Works the same on every OS.
+
+POLL_INTERVAL = 0.5
+DEBOUNCE = 0.5
+
+def snapshot(paths):
+    """{path: (size, mtime_ns)} for the paths that currently exist."""
+    stats = {}
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        stats[path] = (st.st_size, st.st_mtime_ns)
+    return stats
+
+def changed_paths(old, new):
+    """Paths added, modified or removed between two snapshots."""
+    changed = {path for path, stamp in new.items() if old.get(path) != stamp}
+    changed.update(path for path in old if path not in new)
+    return changed
+
+def watch(get_paths, on_change, interval=POLL_INTERVAL, debounce=DEBOUNCE, run_first=True):
+    """
+    Calls on_change(changed_paths) whenever the files returned by get_paths()
+    change. get_paths is re-evaluated every poll, so new files are picked up.
+    Runs until interrupted with Ctrl+C.
+    """
+    previous = snapshot(get_paths())
+
+    def run(changed):
+        try:
+            on_change(changed)
+        except (Exception, SystemExit) as e:
+            # A half-written file must not stop the watcher
+            print(f"Run failed ({e or 'error'}); waiting for the next change.")
+
+    if run_first:
+        run(set(previous))
+
+    print(f"Watching {len(previous)} file(s) for changes (Ctrl+C to stop)...")
+    try:
+        while True:
+            time.sleep(interval)
+            current = snapshot(get_paths())
+            changed = changed_paths(previous, current)
+            if not changed:
+                continue
+
+            # Debounce: wait until a burst of writes has settled
+            while True:
+                time.sleep(debounce)
+                settled = snapshot(get_paths())
+                more = changed_paths(current, settled)
+                if not more:
+                    break
+                changed |= more
+                current = settled
+
+            previous = current
+            print(f"Change detected in {len(changed)} file(s).")
+            run(changed)
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+
+def option_files(options):
+    """Existing file paths among option values (mattes, presets...)."""
+    files = []
+    for value in options.values():
+        if isinstance(value, str) and os.path.isfile(value):
+            files.append(value)
+    return files
+
+def add_watch_arguments(parser):
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and re-key when inputs or option files change")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL,
+                        help="Seconds between change checks in --watch mode")
+    parser.add_argument("--debounce", type=float, default=DEBOUNCE,
+                        help="Seconds files must be unchanged before re-keying in --watch mode")
+
+def watch_cli(args, run, extra_options=None):
+    """
+    Watch mode for the single-file CLIs: reruns `run()` when the input or any
+    file named by the options changes. The process stays alive, so key tables
+    built by the first run are reused.
+    """
+    def get_paths():
+        paths = [args.input] + option_files(vars(args))
+        for options in extra_options or []:
+            paths += option_files(options)
+        written = {args.output, getattr(args, 'manifest', None)}
+        return [p for p in dict.fromkeys(paths) if p not in written]
+
+    watch(get_paths, lambda changed: run(), args.poll_interval, args.debounce)